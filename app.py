@@ -22,28 +22,254 @@
 # =========================================
 
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request, Query
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from datetime import datetime, timedelta
 import os
 import re
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
 from supabase import create_client, Client
-from typing import Optional
+from typing import Optional, TypedDict
+from dataclasses import dataclass
 import pytz
 from dotenv import load_dotenv
 import json
+import orjson
 from dateutil import parser as date_parser
 from pydub import AudioSegment
+import numpy as np
 import tempfile
+import io
+import struct
+import hashlib
+import threading
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+import csv
+import base64
+import asyncio
+import signal
+import time
+import sys
+import hmac
+import tracemalloc
+import queue
+import random
+import urllib.request
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 
 # .envファイルを読み込む
 load_dotenv()
 
+# =========================================
+# JSONシリアライズ（orjson）・レスポンスモデル
+# =========================================
+# レスポンスは orjson でエンコードする（datetime・dataclass・NumPy配列を直接扱えるため、
+# isoformat() や辞書への変換を行わずにそのまま渡す）。
+# JSONを返すエンドポイントは slots の dataclass（キーが予約語・省略可能なものは TypedDict）で
+# レスポンスを組み立て、FastAPI の jsonable_encoder を経由しないよう FastJSONResponse を直接返す。
+# /api/audio-files/export は行をそのまま1行ずつ encode_json で送るため、モデルに詰め替えない。
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+def _json_default(value):
+    """orjson が扱えない型（Decimal など）は文字列にする（json.dumps(default=str) と同じ扱い）"""
+    return str(value)
+
+def encode_json(content) -> bytes:
+    """レスポンス本体をJSON（UTF-8、区切り文字の空白なし）にエンコードする"""
+    return orjson.dumps(content, default=_json_default, option=ORJSON_OPTIONS)
+
+class FastJSONResponse(JSONResponse):
+    """orjson でエンコードする JSONResponse（アプリ全体のデフォルト）"""
+
+    def render(self, content) -> bytes:
+        return encode_json(content)
+
+
+class AudioFileRow(TypedDict, total=False):
+    """/api/audio-files の1行（Supabaseの行にS3のメタデータを付与したもの、コピーせずにそのまま返す）"""
+    device_id: str
+    recorded_at: str
+    file_path: str
+    local_date: Optional[str]
+    time_block: Optional[str]
+    created_at: Optional[str]
+    file_exists: bool
+    file_size_bytes: Optional[int]
+    last_modified: Optional[datetime]
+
+
+@dataclass(slots=True)
+class AudioFilesPage:
+    files: list[AudioFileRow]
+    total_count: int
+    limit: int
+    offset: int
+
+
+@dataclass(slots=True)
+class DeviceSummary:
+    device_id: str
+
+
+@dataclass(slots=True)
+class DevicesPage:
+    devices: list[DeviceSummary]
+    total_count: int
+
+
+@dataclass(slots=True)
+class HealthResponse:
+    status: str
+    timestamp: datetime
+    s3_configured: bool
+    supabase_configured: bool
+
+
+@dataclass(slots=True)
+class UploadResponse:
+    status: str
+    s3_key: str
+    device_id: str
+    recorded_at: datetime   # ユーザーのローカル時間（受信したタイムゾーンのまま）
+    local_date: str
+    file_size_bytes: int
+    sha256: Optional[str]
+    method: str
+    processing_status: str
+    skip_policy: str
+    stored: bool
+    replication_status: Optional[str]
+    trace_id: Optional[str]
+    timezone_info: str
+    supabase_id: Optional[object] = None
+
+
+@dataclass(slots=True)
+class PresignedUrlResponse:
+    presigned_url: str
+    file_path: str
+    expires_in_hours: int
+    expires_at: datetime
+    bucket: str
+
+
+@dataclass(slots=True)
+class ArchivePresignedUrlResponse(PresignedUrlResponse):
+    archive: dict   # archive_path / offset / length / range（resolve_archive_range）
+
+
+@dataclass(slots=True)
+class RestoredPresignedUrlResponse(PresignedUrlResponse):
+    storage_class: str
+    restore_status: str
+    restore_expiry_date: Optional[str]   # 復元したコピーの期限を過ぎるとURLも使えなくなる
+
+
+@dataclass(slots=True)
+class RestorePendingResponse:
+    """GLACIER などに移されたオブジェクトの復元待ち（202）"""
+    file_path: str
+    storage_class: str
+    restore_status: str   # requested / in_progress / archived
+    retry_after_seconds: int
+    bucket: str
+
+
+class ManifestEntry(TypedDict, total=False):
+    recorded_at: str   # UTC
+    local_time: Optional[str]
+    s3_key: str
+    stored: bool
+    size_bytes: Optional[int]
+    duration_seconds: Optional[float]
+    sha256: Optional[str]
+    status: Optional[str]
+
+
+@dataclass(slots=True)
+class DailyManifest:
+    """S3に保存したマニフェスト（キャッシュ上の辞書）をそのまま包む（files はコピーしない）"""
+    device_id: str
+    local_date: str
+    files: list[ManifestEntry]
+    total_count: int
+    total_size_bytes: int
+    updated_at: str
+
+
+class ArchiveEntry(TypedDict):
+    recorded_at: str
+    file_path: str
+    offset: int
+    length: int
+    range: str
+    sha256: str
+
+
+@dataclass(slots=True)
+class DailyArchive:
+    device_id: str
+    local_date: str
+    archive_path: str
+    size_bytes: int
+    sha256: str
+    total_count: int
+    entries: list[ArchiveEntry]
+    missing: list[str]
+    created_at: str
+    presigned_url: str
+    expires_at: datetime
+
+
+@dataclass(slots=True)
+class MetricsResponse:
+    timestamp: datetime
+    response_cache: dict
+    drain: dict
+    replication: dict
+    events: dict
+    tracing: dict
+    storage_restore: dict
+
+
+class CoverageDay(TypedDict, total=False):
+    local_date: str
+    bitmap: str
+    covered_slots: int
+    missing_slots: list[str]   # include_missing=false の場合は含めない
+
+
+# "from" / "to" はPythonの予約語のため dataclass にできない（関数形式の TypedDict で型だけ付ける）
+CoverageRange = TypedDict("CoverageRange", {
+    "device_id": str,
+    "from": str,
+    "to": str,
+    "slot_minutes": int,
+    "slots_per_day": int,
+    "days": list[CoverageDay],
+    "total_slots": int,
+    "covered_slots": int,
+    "coverage_ratio": Optional[float],
+})
+
 # =========================================
 # 基本設定
 # =========================================
-app = FastAPI(title="WatchMe Vault API - S3 Storage")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動・終了処理（終了時は実行中のアップロードをドレインしてから停止する）"""
+    install_drain_signal_handler()
+    reset_stream_cache_dir()
+    start_event_publisher()
+    start_replicator()
+    yield
+    await drain_uploads()
+
+app = FastAPI(title="WatchMe Vault API - S3 Storage", lifespan=lifespan, default_response_class=FastJSONResponse)
 
 # AWS S3設定
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
@@ -51,97 +277,2783 @@ AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME", "watchme-vault")
 AWS_REGION = os.getenv("AWS_REGION", "us-east-1")
 
-# Supabase設定
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Supabase設定
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# アップロードサイズの上限（100MB）
+MAX_UPLOAD_SIZE_BYTES = 100 * 1024 * 1024
+
+# アップロード本体を読み込むチャンクサイズ（読み込みながらSHA-256を計算する）
+UPLOAD_READ_CHUNK_SIZE = 1024 * 1024
+
+# =========================================
+# WAV正規化設定（WatchMe仕様: 16kHz / mono / 16-bit）
+# =========================================
+# WAVアップロードを仕様に揃えるか（仕様どおりのファイルはそのまま保存される）
+WAV_NORMALIZE_ON_INGEST = True
+
+# 保存するWAVのサンプリングレート（Hz）
+WAV_TARGET_SAMPLE_RATE = 16000
+
+# リサンプリング用ローパスフィルターの片側ゼロ交差数（大きいほど急峻・高コスト）
+WAV_RESAMPLE_ZERO_CROSSINGS = 16
+
+# リサンプリングを行う出力フレーム数の単位（メモリ使用量の上限を決める）
+WAV_RESAMPLE_BLOCK_FRAMES = 16384
+
+# =========================================
+# デバイススキップ設定（夜間停止機能）
+# =========================================
+# 注意: これらは運用設定なので、環境変数ではなくコード内で管理する
+# 必要に応じて直接このファイルを編集してください
+
+# スキップ機能を有効にするかどうか
+SKIP_ENABLED = True
+
+# スキップ対象のデバイスID（複数指定可能）
+SKIP_DEVICE_IDS = [
+    '9f7d6e27-98c3-4c19-bdfb-f7fda58b9a93'  # 特定のオブザーバーデバイス
+]
+
+# スキップする時間帯（0-23の整数で指定）
+# 例：23,0,1,2,3,4,5 = 夜23時から朝5時台まで
+SKIP_HOURS = [23, 0, 1, 2, 3, 4, 5]
+
+# スキップ対象データの保存ポリシー
+#   "store"   : 通常通り files/ に保存する（従来の動作、S3イベントでLambdaが起動する）
+#   "discard" : 音声は保存せず、メタデータ（skippedステータス）のみ登録する
+#   "cold"    : SKIP_STORAGE_PREFIX 配下に低コストのストレージクラスで保存する（Lambdaは起動しない）
+#   "preview" : ダウンサンプリングしたプレビュー音声のみ SKIP_STORAGE_PREFIX 配下に保存する
+SKIP_STORAGE_POLICY = "store"
+
+# files/ 以外のプレフィックスに保存することで、S3イベント通知（files/ 配下のPUT）を発火させない
+SKIP_STORAGE_PREFIX = "skipped"
+
+# "discard" ポリシーの行の file_path に使うプレフィックス（file_path は NOT NULL のため、
+# 保存しなかったことが分かるキーを記録する。このプレフィックスのオブジェクトはS3に存在しない）
+# discarded/{device_id}/{date}/{HH-MM-SS}/audio.wav
+SKIP_DISCARD_PREFIX = "discarded"
+
+# "cold" ポリシーで使用するS3ストレージクラス
+SKIP_STORAGE_CLASS = "STANDARD_IA"
+
+# "preview" ポリシーで使用するサンプリングレート（Hz）
+SKIP_PREVIEW_FRAME_RATE = 8000
+
+SKIP_STORAGE_POLICIES = ("store", "discard", "cold", "preview")
+
+# =========================================
+# 日次マニフェスト設定
+# =========================================
+# files/ 配下に置くとS3イベント通知（Lambda）が発火するため、別プレフィックスに保存する
+# manifests/{device_id}/{local_date}/manifest.json
+MANIFEST_PREFIX = "manifests"
+
+# メモリ上にキャッシュするマニフェスト数の上限（デバイス×日）
+MANIFEST_CACHE_MAX_ENTRIES = 512
+
+# マニフェストの読み込み→更新→書き戻しを直列化するロックの数（デバイス×日のハッシュで割り当てる）
+# プロセス内の排他のみ。複数インスタンス間で取りこぼした分は rebuild=true で audio_files から作り直す
+MANIFEST_LOCK_STRIPES = 64
+
+# =========================================
+# 日次アーカイブ設定（compact_archives.py）
+# =========================================
+# archives/{device_id}/{local_date}/bundle.bin と index.json（files/ 配下ではないためLambdaは発火しない）
+ARCHIVE_PREFIX = "archives"
+
+# ローカル日付の終了後、アーカイブ対象とするまでの猶予（遅れて届くアップロードを待つ、時間）
+ARCHIVE_GRACE_HOURS = 2
+
+# メモリ上にキャッシュするインデックス数の上限（デバイス×日）
+ARCHIVE_INDEX_CACHE_MAX_ENTRIES = 512
+
+# =========================================
+# ストレージ階層化設定（tier_storage.py）
+# =========================================
+# 処理ステータス（transcriptions / behavior_features / emotion_features）がすべて完了した録音を、
+# ローカル日付からの経過日数に応じて低コストのストレージクラスへ移す（経過日数, ストレージクラス）。
+# 一度移したクラスより上の階層には戻さない。
+STORAGE_TIER_RULES = [
+    (30, "STANDARD_IA"),
+    (90, "GLACIER_IR"),
+    (365, "GLACIER"),
+]
+
+# 階層化の対象とする処理ステータス（すべてのステータスがこのいずれかの場合のみ移す）
+STORAGE_TIER_DONE_STATUSES = ("completed", "skipped")
+
+# ストレージクラスの順序（後ろほど低コスト・取り出しが遅い）
+STORAGE_CLASS_ORDER = ("STANDARD", "STANDARD_IA", "GLACIER_IR", "GLACIER", "DEEP_ARCHIVE")
+
+# 取り出す前に復元（RestoreObject）が必要なストレージクラス
+STORAGE_RESTORE_CLASSES = ("GLACIER", "DEEP_ARCHIVE")
+
+# 復元したコピーを保持する日数と、復元の速度（Expedited / Standard / Bulk）
+STORAGE_RESTORE_DAYS = 7
+STORAGE_RESTORE_TIER = "Standard"
+
+# 復元中の場合にクライアントへ返す再試行までの秒数（Retry-After）
+STORAGE_RESTORE_RETRY_AFTER_SECONDS = 900
+
+# =========================================
+# 録音カバレッジインデックス設定
+# =========================================
+# coverage/{device_id}/{YYYY-MM}.json（1日48スロットのビットマップを1か月分）
+COVERAGE_PREFIX = "coverage"
+
+# 1日のスロット数（30分単位）
+COVERAGE_SLOTS_PER_DAY = 48
+
+# メモリ上にキャッシュするインデックス数の上限（デバイス×月）
+COVERAGE_CACHE_MAX_ENTRIES = 1024
+
+# インデックスの作成・ビット更新を直列化するロックの数（デバイス×月のハッシュで割り当てる）
+COVERAGE_LOCK_STRIPES = 64
+
+# /api/devices/{device_id}/coverage で1回に指定できる最大日数
+COVERAGE_MAX_RANGE_DAYS = 366
+
+# =========================================
+# 波形サマリー（peaks）設定
+# =========================================
+# 波形サマリーの保存先プレフィックス（peaks/{音声のS3キー}.peaks.json に保存）
+PEAKS_PREFIX = "peaks"
+
+# 1ポイントあたりのサンプル数（16kHzで1秒 = 30分の録音で1800ポイント）
+PEAKS_SAMPLES_PER_PEAK = 16000
+
+# アップロード時に波形サマリーを生成するかどうか（Falseの場合は初回リクエスト時に生成）
+PEAKS_ON_INGEST = True
+
+# メモリ上にキャッシュする波形サマリー数の上限
+PEAKS_CACHE_MAX_ENTRIES = 2048
+
+# =========================================
+# エクスポート設定
+# =========================================
+# エクスポートで出力するaudio_filesのカラム
+EXPORT_COLUMNS = [
+    "device_id",
+    "recorded_at",
+    "local_date",
+    "local_time",
+    "file_path",
+    "file_size_bytes",
+    "transcriptions_status",
+    "behavior_features_status",
+    "emotion_features_status",
+    "created_at"
+]
+
+# S3メタデータ付与（include_s3=true）時の追加カラム
+EXPORT_S3_COLUMNS = ["file_exists", "s3_size_bytes", "last_modified"]
+
+# S3メタデータを付与する際の1チャンクあたりの行数と並列数
+EXPORT_S3_CHUNK_SIZE = 100
+EXPORT_S3_CONCURRENCY = 16
+
+# =========================================
+# レスポンスキャッシュ設定（/api/audio-files, /api/devices）
+# =========================================
+# キャッシュするレスポンス数の上限
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+
+# キャッシュの有効期限（秒）
+# アップロードによる変更は即時に無効化されるが、S3上の削除など
+# このAPIを経由しない変更を反映するために上限を設ける
+RESPONSE_CACHE_TTL_SECONDS = 300
+
+# 直近の無効化の記録数（読み込み中に無効化されたレスポンスをキャッシュしないための照合用）
+# 読み込みの間にこれを超える無効化があった場合はキャッシュせずに返す
+RESPONSE_CACHE_INVALIDATION_LOG_SIZE = 1024
+
+# =========================================
+# 音声ストリーミング（Range対応プロキシ）設定
+# =========================================
+# 最近再生されたオブジェクトをキャッシュするローカルディレクトリ
+STREAM_CACHE_DIR = os.getenv("STREAM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "watchme-vault-stream-cache"))
+
+# ディスクキャッシュの上限サイズ（バイト、0でキャッシュ無効）
+STREAM_CACHE_MAX_BYTES = int(os.getenv("STREAM_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+# S3からの読み出し・レスポンス送信のチャンクサイズ
+STREAM_CHUNK_SIZE = 256 * 1024
+
+# キャッシュにないオブジェクトをバックグラウンドでディスクキャッシュに取り込む並列数
+STREAM_CACHE_FILL_WORKERS = 4
+
+# =========================================
+# ローカルファーストのアップロード（S3への非同期レプリケーション）設定
+# =========================================
+# 設定するとアップロードをこのディレクトリに永続化して即座に応答し、S3へは非同期に転送する
+# （未設定時は従来どおりS3へ同期的にPUTする）。コンテナ再作成で消えないボリュームを指定すること
+LOCAL_INGEST_DIR = os.getenv("LOCAL_INGEST_DIR")
+
+# ローカルに保持できる未転送データの上限（バイト）。超える場合は503で端末に再送を促す
+LOCAL_INGEST_MAX_BYTES = int(os.getenv("LOCAL_INGEST_MAX_BYTES", str(10 * 1024 * 1024 * 1024)))
+
+# S3へ同時に転送するオブジェクト数
+REPLICATION_CONCURRENCY = 4
+
+# 1オブジェクトあたりの最大試行回数と、再試行間隔の基準（秒、指数バックオフ）
+REPLICATION_MAX_ATTEMPTS = 5
+REPLICATION_RETRY_BASE_SECONDS = 1.0
+
+# 最大試行回数まで失敗したジョブをキューに戻すまでの待ち時間（秒、再投入ごとに倍、上限あり）
+# ジョブはローカルに残り、転送に成功するか破棄されるまで容量（LOCAL_INGEST_MAX_BYTES）を予約し続ける
+REPLICATION_REQUEUE_BASE_SECONDS = 30.0
+REPLICATION_REQUEUE_MAX_DELAY_SECONDS = 900.0
+
+# このサイズを超えるオブジェクトはマルチパートアップロードで転送する
+# S3イベント（audio-processor Lambda）の通知対象は ObjectCreated:Put のみのため、
+# 録音（m4aから変換したWAVを含む）は単一PUTの上限（5GB）まで1回のPUTで転送し、
+# CompleteMultipartUpload のイベントを発生させない
+REPLICATION_MULTIPART_THRESHOLD = 5 * 1024 * 1024 * 1024
+REPLICATION_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+
+# ローカルストアが満杯のときに返す Retry-After（秒）
+REPLICATION_RETRY_AFTER_SECONDS = 30
+
+# =========================================
+# 処理開始イベント（file ready）の発行設定
+# =========================================
+# 通知先: "sqs"（SQS互換キュー）/ "webhook" / "local"（プロセス内キュー、開発用）。未設定時は発行しない
+EVENT_NOTIFIER = os.getenv("EVENT_NOTIFIER", "").strip().lower()
+EVENT_SQS_QUEUE_URL = os.getenv("EVENT_SQS_QUEUE_URL")
+EVENT_WEBHOOK_URL = os.getenv("EVENT_WEBHOOK_URL")
+
+# 未送信イベントを永続化するディレクトリ（設定すると再起動をまたいで再送する）
+EVENT_OUTBOX_DIR = os.getenv("EVENT_OUTBOX_DIR")
+
+# この件数が溜まるか、最初のイベントからこの秒数が経過したらまとめて送信する
+EVENT_BATCH_MAX_EVENTS = 100
+EVENT_BATCH_MAX_WAIT_SECONDS = 1.0
+
+# 1メッセージにまとめる同一デバイスのイベント数と、1回の送信に含めるメッセージ数（SQSの上限は10）
+EVENT_MESSAGE_MAX_EVENTS = 20
+EVENT_SEND_BATCH_MESSAGES = 10
+
+# 送信失敗時の再試行間隔（秒、指数バックオフ。イベントは破棄せず送信できるまで再試行する）
+EVENT_RETRY_BASE_SECONDS = 1.0
+EVENT_RETRY_MAX_SECONDS = 60.0
+
+# SKIP対象（処理しない録音）のイベントも発行するか
+EVENT_PUBLISH_SKIPPED = False
+
+# =========================================
+# グレースフルシャットダウン（ドレイン）設定
+# =========================================
+# SIGTERM受信後、実行中のアップロード（S3 PUT・メタデータ登録）の完了を待つ最大時間（秒）
+# docker-compose の stop_grace_period / docker stop -t はこれより長くすること
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "60"))
+
+# ドレイン中に新規アップロードへ返す Retry-After（秒）
+DRAIN_RETRY_AFTER_SECONDS = 5
+
+# =========================================
+# 管理者用診断エンドポイント設定
+# =========================================
+# /api/admin/* に必要なトークン（X-Admin-Token ヘッダー、未設定時は無効）
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# サンプリングプロファイラーの最大計測時間（秒）とデフォルトのサンプリング間隔（ミリ秒）
+PROFILE_MAX_SECONDS = 60
+PROFILE_INTERVAL_MS = 10
+
+# tracemalloc開始時に記録するトレースバックの深さ
+TRACEMALLOC_DEFAULT_FRAMES = 10
+
+# =========================================
+# トレーシング設定
+# =========================================
+# スパンの出力先: "file"（JSON Lines）/ "memory"（プロセス内、/api/admin/traces で参照）。未設定時は記録しない
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "").strip().lower()
+TRACE_FILE_PATH = os.getenv("TRACE_FILE_PATH", "logs/traces.jsonl")
+
+# 記録するリクエストの割合（0.0〜1.0）。traceparent ヘッダーで sampled が指定された場合はそれに従う
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+
+# "memory" で保持するスパン数の上限
+TRACE_MEMORY_MAX_SPANS = 10000
+
+# S3クライアントの初期化
+s3_client = None
+if AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY:
+    s3_client = boto3.client(
+        's3',
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_REGION
+    )
+
+# Supabaseクライアントの初期化
+supabase_client: Optional[Client] = None
+if SUPABASE_URL and SUPABASE_KEY:
+    try:
+        supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    except Exception as e:
+        print(f"⚠️ Supabase client initialization failed: {e}")
+        # テスト環境などでは継続可能にする
+        supabase_client = None
+
+# =========================================
+# Audio Conversion Utility
+# =========================================
+def convert_m4a_to_wav(file_content: bytes, original_filename: str) -> tuple[bytes, str]:
+    """
+    Convert M4A audio to WAV format with WatchMe specifications.
+
+    Args:
+        file_content: M4A file content
+        original_filename: Original filename (for logging)
+
+    Returns:
+        tuple: (wav_content, content_type)
+
+    Raises:
+        Exception: If conversion fails
+    """
+    print(f"🔄 Converting M4A to WAV: {original_filename}")
+
+    try:
+        with tempfile.NamedTemporaryFile(suffix='.m4a', delete=False) as temp_m4a:
+            temp_m4a.write(file_content)
+            temp_m4a_path = temp_m4a.name
+
+        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_wav:
+            temp_wav_path = temp_wav.name
+
+        audio = AudioSegment.from_file(temp_m4a_path, format='m4a')
+
+        # Convert to WatchMe specifications: 16kHz, mono, 16-bit
+        audio = audio.set_frame_rate(16000)
+        audio = audio.set_channels(1)
+        audio = audio.set_sample_width(2)  # 2 bytes = 16-bit
+
+        audio.export(temp_wav_path, format='wav')
+
+        with open(temp_wav_path, 'rb') as f:
+            wav_content = f.read()
+
+        os.unlink(temp_m4a_path)
+        os.unlink(temp_wav_path)
+
+        print(f"✅ Conversion successful: M4A ({len(file_content)} bytes) -> WAV ({len(wav_content)} bytes)")
+
+        return wav_content, 'audio/wav'
+
+    except Exception as e:
+        print(f"❌ M4A to WAV conversion failed: {str(e)}")
+        raise Exception(f"Audio conversion failed: {str(e)}")
+
+def create_preview_wav(wav_content: bytes, frame_rate: int = SKIP_PREVIEW_FRAME_RATE) -> bytes:
+    """
+    Downsample WAV audio to a small mono preview (used for skipped recordings).
+
+    Args:
+        wav_content: WAV file content
+        frame_rate: Target sample rate of the preview
+
+    Returns:
+        bytes: Preview WAV content
+    """
+    audio = AudioSegment.from_file(io.BytesIO(wav_content), format='wav')
+    audio = audio.set_channels(1).set_frame_rate(frame_rate).set_sample_width(2)
+
+    buffer = io.BytesIO()
+    audio.export(buffer, format='wav')
+    return buffer.getvalue()
+
+def get_wav_duration(wav_content: bytes) -> Optional[float]:
+    """
+    Read the duration of WAV audio from its header.
+
+    Returns:
+        float: Duration in seconds, or None if the content is not a readable WAV
+    """
+    try:
+        info = read_wav_info(wav_content)
+    except (ValueError, struct.error):
+        return None
+
+    bytes_per_second = info["sample_rate"] * info["channels"] * info["sample_width"]
+    if not bytes_per_second:
+        return None
+    return round(info["data_size"] / bytes_per_second, 3)
+
+def read_wav_info(wav_content: bytes) -> dict:
+    """
+    Parse the RIFF/WAVE header without copying the sample data.
+
+    Returns:
+        dict: format_tag, channels, sample_rate, sample_width, data_offset, data_size
+
+    Raises:
+        ValueError: If the content is not a RIFF/WAVE file
+    """
+    if len(wav_content) < 12 or wav_content[0:4] != b'RIFF' or wav_content[8:12] != b'WAVE':
+        raise ValueError("Not a RIFF/WAVE file")
+
+    info = {}
+    offset = 12
+    while offset + 8 <= len(wav_content):
+        chunk_id = wav_content[offset:offset + 4]
+        chunk_size = struct.unpack_from('<I', wav_content, offset + 4)[0]
+        body_offset = offset + 8
+
+        if chunk_id == b'fmt ':
+            format_tag, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', wav_content, body_offset)
+            if format_tag == 0xFFFE and chunk_size >= 26:
+                # WAVE_FORMAT_EXTENSIBLE: SubFormat GUIDの先頭2バイトが実際のフォーマット
+                format_tag = struct.unpack_from('<H', wav_content, body_offset + 24)[0]
+            info.update({
+                "format_tag": format_tag,
+                "channels": channels,
+                "sample_rate": sample_rate,
+                "sample_width": bits // 8
+            })
+        elif chunk_id == b'data':
+            info["data_offset"] = body_offset
+            # ストリーミング録音などでサイズが未確定（0xFFFFFFFF）の場合はファイル末尾まで
+            info["data_size"] = min(chunk_size, len(wav_content) - body_offset)
+            break
+
+        offset = body_offset + chunk_size + (chunk_size & 1)
+
+    if "channels" not in info or "data_offset" not in info:
+        raise ValueError("WAV file is missing fmt or data chunk")
+
+    return info
+
+def wav_samples(wav_content: bytes, info: Optional[dict] = None) -> tuple[np.ndarray, dict]:
+    """
+    Return the WAV samples as a (frames, channels) NumPy view on the original buffer.
+
+    8-bit (unsigned) and 24-bit data are converted; 16/32-bit PCM and 32-bit float
+    are returned without copying.
+    """
+    info = info or read_wav_info(wav_content)
+    width = info["sample_width"]
+    channels = info["channels"]
+    count = info["data_size"] // (width * channels) * channels
+    offset = info["data_offset"]
+
+    if info["format_tag"] == 3 and width == 4:
+        samples = np.frombuffer(wav_content, dtype='<f4', count=count, offset=offset)
+    elif info["format_tag"] != 1:
+        raise ValueError(f"Unsupported WAV format tag: {info['format_tag']}")
+    elif width == 1:
+        samples = (np.frombuffer(wav_content, dtype=np.uint8, count=count, offset=offset).astype(np.int16) - 128) << 8
+    elif width == 2:
+        samples = np.frombuffer(wav_content, dtype='<i2', count=count, offset=offset)
+    elif width == 3:
+        raw = np.frombuffer(wav_content, dtype=np.uint8, count=count * 3, offset=offset).reshape(-1, 3)
+        samples = (raw[:, 0].astype(np.int32) << 8 | raw[:, 1].astype(np.int32) << 16 | raw[:, 2].astype(np.int32) << 24) >> 8
+    elif width == 4:
+        samples = np.frombuffer(wav_content, dtype='<i4', count=count, offset=offset)
+    else:
+        raise ValueError(f"Unsupported WAV sample width: {width}")
+
+    return samples.reshape(-1, channels), info
+
+def compute_peaks(wav_content: bytes, samples_per_peak: int = PEAKS_SAMPLES_PER_PEAK) -> dict:
+    """
+    Compute a compact min/max/RMS waveform summary of WAV audio.
+
+    Each point covers `samples_per_peak` frames (all channels combined).
+    Values are normalized to [-1.0, 1.0]. Blocks are processed in chunks so that
+    memory stays bounded regardless of the recording length.
+
+    Returns:
+        dict: sample_rate, channels, samples_per_peak, length, duration_seconds, min, max, rms
+    """
+    samples, info = wav_samples(wav_content)
+    frames = samples.shape[0]
+
+    if info["format_tag"] == 3:
+        scale = 1.0
+    else:
+        scale = float(1 << (8 * max(info["sample_width"], 2) - 1))
+
+    mins, maxs, rms = [], [], []
+    # 約100万フレームごと（samples_per_peakの倍数）に処理してメモリ使用量を抑える
+    chunk_frames = max(1, (1 << 20) // samples_per_peak) * samples_per_peak
+    for start in range(0, frames, chunk_frames):
+        chunk = samples[start:start + chunk_frames].astype(np.float32)
+        block_starts = np.arange(0, chunk.shape[0], samples_per_peak)
+        counts = np.diff(np.append(block_starts, chunk.shape[0])) * chunk.shape[1]
+
+        mins.append(np.minimum.reduceat(chunk.min(axis=1), block_starts))
+        maxs.append(np.maximum.reduceat(chunk.max(axis=1), block_starts))
+        rms.append(np.sqrt(np.add.reduceat(np.square(chunk).sum(axis=1), block_starts) / counts))
+
+    def normalize(parts):
+        if not parts:
+            return []
+        return np.round(np.concatenate(parts) / scale, 4).tolist()
+
+    return {
+        "sample_rate": info["sample_rate"],
+        "channels": info["channels"],
+        "samples_per_peak": samples_per_peak,
+        "length": sum(len(part) for part in mins),
+        "duration_seconds": round(frames / info["sample_rate"], 3) if info["sample_rate"] else None,
+        "min": normalize(mins),
+        "max": normalize(maxs),
+        "rms": normalize(rms)
+    }
+
+def is_watchme_wav(info: dict) -> bool:
+    """WAVヘッダーがWatchMe仕様（16kHz / mono / 16-bit PCM）かどうか"""
+    return (
+        info["format_tag"] == 1
+        and info["channels"] == 1
+        and info["sample_rate"] == WAV_TARGET_SAMPLE_RATE
+        and info["sample_width"] == 2
+    )
+
+def build_wav_header(data_size: int, sample_rate: int = WAV_TARGET_SAMPLE_RATE, channels: int = 1, sample_width: int = 2) -> bytes:
+    """PCM WAVの44バイトヘッダーを生成する"""
+    return struct.pack(
+        '<4sI4s4sIHHIIHH4sI',
+        b'RIFF', 36 + data_size, b'WAVE',
+        b'fmt ', 16, 1, channels, sample_rate, sample_rate * channels * sample_width, channels * sample_width, sample_width * 8,
+        b'data', data_size
+    )
+
+def design_polyphase_filter(up: int, down: int, zero_crossings: int = WAV_RESAMPLE_ZERO_CROSSINGS) -> np.ndarray:
+    """
+    Design a Kaiser-windowed sinc low-pass filter split into `up` polyphase branches.
+
+    Returns:
+        np.ndarray: (up, taps_per_phase) coefficients; row p is the branch for output phase p,
+        with taps ordered oldest-to-newest input sample.
+    """
+    # アップサンプリング後のレートで、入出力のうち低い方のナイキスト周波数をカットオフにする
+    cutoff = 0.5 / max(up, down)
+    taps_per_phase = 2 * zero_crossings * max(1, -(-down // up))
+    length = taps_per_phase * up
+    # 奇数長（中心が整数位置）のフィルターにして末尾を0で埋め、群遅延を整数サンプルにする
+    t = np.arange(length - 1) - (length - 2) / 2
+    h = np.append(2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(length - 1, 8.6) * up, 0.0)
+    # y[n] = Σ_k h[p + k*up] * x[i - k] を x[i-K+1 .. i] との内積にするため、各相のタップを逆順に並べる
+    return h.reshape(taps_per_phase, up).T[:, ::-1].astype(np.float32)
+
+def resample_to_watchme(samples: np.ndarray, sample_rate: int, scale: float,
+                        block_frames: int = WAV_RESAMPLE_BLOCK_FRAMES) -> np.ndarray:
+    """
+    Downmix (frames, channels) samples to mono and resample to WAV_TARGET_SAMPLE_RATE.
+
+    Uses a polyphase FIR filter evaluated directly on the input view, block by block,
+    so only one block of float32 samples is materialized at a time.
+
+    Returns:
+        np.ndarray: int16 mono samples at WAV_TARGET_SAMPLE_RATE
+    """
+    divisor = np.gcd(WAV_TARGET_SAMPLE_RATE, sample_rate)
+    up, down = WAV_TARGET_SAMPLE_RATE // divisor, sample_rate // divisor
+    frames = samples.shape[0]
+    out_frames = -(-frames * up // down)
+    out = np.empty(out_frames, dtype=np.int16)
+
+    def mono(start: int, stop: int) -> np.ndarray:
+        """入力の [start, stop) をモノラルfloat32で返す（範囲外は0）"""
+        block = np.zeros(stop - start, dtype=np.float32)
+        lo, hi = max(start, 0), min(stop, frames)
+        if lo < hi:
+            chunk = samples[lo:hi]
+            if chunk.shape[1] == 1:
+                block[lo - start:hi - start] = chunk[:, 0]
+            else:
+                np.sum(chunk, axis=1, dtype=np.float32, out=block[lo - start:hi - start])
+            block *= 1.0 / (scale * chunk.shape[1])
+        return block
+
+    if up == down:
+        for start in range(0, frames, block_frames):
+            chunk = mono(start, min(start + block_frames, frames))
+            out[start:start + chunk.shape[0]] = np.clip(np.rint(chunk * 32767), -32768, 32767)
+        return out
+
+    bank = design_polyphase_filter(up, down)
+    taps = bank.shape[1]
+    # フィルターの群遅延（アップサンプリング後のレートで (len-2)/2）を補正する
+    delay = (taps * up - 2) // 2
+    # 出力 n と n+up は同じフィルター相を使い、入力位置が down ずつ進む。
+    # 相ごとに入力窓の行列（コピーなしのビュー）とタップの積をまとめて計算する
+    block = max(1, block_frames // up) * up
+    y = np.empty(block, dtype=np.float32)
+
+    for start in range(0, out_frames, block):
+        stop = min(start + block, out_frames)
+        first_newest = (start * down + delay) // up
+        last_newest = ((stop - 1) * down + delay) // up
+        windows = np.lib.stride_tricks.sliding_window_view(mono(first_newest - taps + 1, last_newest + 1), taps)
+
+        for residue in range(min(up, stop - start)):
+            position = (start + residue) * down + delay
+            count = len(range(start + residue, stop, up))
+            offset = position // up - first_newest
+            y[residue:stop - start:up] = windows[offset:offset + (count - 1) * down + 1:down] @ bank[position % up]
+
+        out[start:stop] = np.clip(np.rint(y[:stop - start] * 32767), -32768, 32767)
+
+    return out
+
+def normalize_wav(wav_content: bytes) -> tuple[bytes, bool]:
+    """
+    Normalize WAV audio to WatchMe specifications (16kHz, mono, 16-bit) in-process.
+
+    Compliant files are returned unchanged (no decode, no copy). Others are downmixed
+    and resampled with NumPy instead of going through ffmpeg.
+
+    Returns:
+        tuple: (wav_content, converted)
+
+    Raises:
+        ValueError: If the content is not a supported RIFF/WAVE file
+    """
+    info = read_wav_info(wav_content)
+    if is_watchme_wav(info):
+        return wav_content, False
+
+    samples, info = wav_samples(wav_content, info)
+    if info["format_tag"] == 3:
+        scale = 1.0
+    else:
+        scale = float(1 << (8 * max(info["sample_width"], 2) - 1))
+
+    pcm = resample_to_watchme(samples, info["sample_rate"], scale)
+    normalized = build_wav_header(pcm.nbytes) + pcm.astype('<i2', copy=False).tobytes()
+    print(
+        f"🔄 Normalized WAV: {info['sample_rate']}Hz/{info['channels']}ch/{info['sample_width'] * 8}bit "
+        f"-> {WAV_TARGET_SAMPLE_RATE}Hz/1ch/16bit ({len(wav_content)} -> {len(normalized)} bytes)"
+    )
+    return normalized, True
+
+# =========================================
+# チェックサムユーティリティ
+# =========================================
+async def read_upload_with_checksum(file: UploadFile) -> tuple[bytes, str]:
+    """
+    アップロード本体をチャンク単位で読み込みながらSHA-256を計算する（バッファの再走査なし）
+
+    Returns:
+        tuple: (content, sha256 hexdigest)
+
+    Raises:
+        HTTPException: サイズ上限（MAX_UPLOAD_SIZE_BYTES）を超えた場合（413）
+    """
+    hasher = hashlib.sha256()
+    chunks = []
+    size = 0
+    while True:
+        chunk = await file.read(UPLOAD_READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_UPLOAD_SIZE_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail="File size exceeds limit (100MB)"
+            )
+        hasher.update(chunk)
+        chunks.append(chunk)
+    return b"".join(chunks), hasher.hexdigest()
+
+def s3_checksum_sha256(sha256_hex: str) -> str:
+    """SHA-256のhexdigestをS3のChecksumSHA256形式（base64）に変換する"""
+    return base64.b64encode(bytes.fromhex(sha256_hex)).decode('ascii')
+
+# =========================================
+# タイムゾーン・スキップ判定ユーティリティ
+# =========================================
+def get_device_timezone(device_id: str) -> str:
+    """
+    devicesテーブルからデバイスのタイムゾーンを取得する
+
+    Returns:
+        str: タイムゾーン名（未登録・未設定の場合は"UTC"）
+    """
+    device_result = supabase_client.table("devices").select("timezone").eq(
+        "device_id", device_id
+    ).execute()
+
+    if not device_result.data or len(device_result.data) == 0:
+        print(f"⚠️ Warning: Device {device_id} not found in devices table, using UTC")
+        return "UTC"
+
+    device_timezone_str = device_result.data[0].get("timezone")
+    if not device_timezone_str:
+        print(f"⚠️ Warning: Device {device_id} has no timezone set, using UTC")
+        return "UTC"
+
+    return device_timezone_str
+
+def calculate_local_datetime(recorded_at: datetime, device_timezone_str: str) -> tuple[str, datetime]:
+    """
+    recorded_atをデバイスのタイムゾーンに変換し、local_dateとlocal_timeを算出する
+
+    Returns:
+        tuple: (local_date "YYYY-MM-DD", local_time（タイムゾーンなしのdatetime）)
+    """
+    device_tz = pytz.timezone(device_timezone_str)
+    local_dt = recorded_at.astimezone(device_tz)
+    local_date = local_dt.strftime('%Y-%m-%d')
+    # local_time is timestamp without time zone - remove timezone info
+    local_time = local_dt.replace(tzinfo=None)
+    return local_date, local_time
+
+def calculate_time_block(local_time: datetime) -> str:
+    """ローカル時刻から30分単位のタイムブロック（"HH-MM"）を算出する"""
+    return f"{local_time.hour:02d}-{(local_time.minute // 30) * 30:02d}"
+
+def is_stored_file_path(file_path: Optional[str]) -> bool:
+    """
+    audio_files.file_path のオブジェクトがS3に保存されているか
+
+    discard ポリシーの行は SKIP_DISCARD_PREFIX 配下のキーを記録している。
+    それ以前に登録された discard の行は skipped/ 配下のキーのため、
+    読み出す側はオブジェクトが存在しない場合も許容すること。
+    """
+    return bool(file_path) and not file_path.startswith(f"{SKIP_DISCARD_PREFIX}/")
+
+
+def determine_initial_status(device_id: str, time_block: str) -> str:
+    """
+    デバイスIDとタイムブロックから処理ステータスの初期値を決定する
+
+    Args:
+        device_id: デバイスID
+        time_block: ローカル時刻のタイムブロック（"HH-MM"形式）
+
+    Returns:
+        str: "skipped"（スキップ対象）または "pending"
+    """
+    if not SKIP_ENABLED or device_id not in SKIP_DEVICE_IDS:
+        return "pending"
+
+    try:
+        hour = int(time_block.split('-')[0])
+    except (ValueError, IndexError):
+        print(f"⚠️ Invalid time_block for SKIP check: {time_block}")
+        return "pending"
+
+    if hour in SKIP_HOURS:
+        print(f"⏭️ SKIP対象: device_id={device_id}, time_block={time_block}")
+        return "skipped"
+
+    return "pending"
+
+# =========================================
+# 日次マニフェスト（デバイス×ローカル日付）
+# =========================================
+# 1日分の録音一覧（キー・サイズ・長さ・ハッシュ）を1オブジェクトにまとめ、
+# 下流処理が1回のGETで1日分を取得できるようにする
+_manifest_cache: "OrderedDict[tuple[str, str], dict]" = OrderedDict()
+_manifest_lock = threading.Lock()
+_manifest_update_locks = [threading.RLock() for _ in range(MANIFEST_LOCK_STRIPES)]
+
+def get_manifest_key(device_id: str, local_date: str) -> str:
+    """マニフェストのS3キーを生成する"""
+    return f"{MANIFEST_PREFIX}/{device_id}/{local_date}/manifest.json"
+
+def _cache_manifest(device_id: str, local_date: str, manifest: dict) -> None:
+    _manifest_cache[(device_id, local_date)] = manifest
+    _manifest_cache.move_to_end((device_id, local_date))
+    while len(_manifest_cache) > MANIFEST_CACHE_MAX_ENTRIES:
+        _manifest_cache.popitem(last=False)
+
+def _manifest_update_lock(device_id: str, local_date: str) -> threading.RLock:
+    """デバイス×日のマニフェストの読み込み→更新→書き戻しを直列化するロック"""
+    return _manifest_update_locks[hash((device_id, local_date)) % MANIFEST_LOCK_STRIPES]
+
+def normalize_recorded_at(value) -> str:
+    """recorded_at をUTCのISO 8601文字列に揃える（同じ時刻をオフセット違いで二重に登録しないため）"""
+    if isinstance(value, str):
+        value = date_parser.isoparse(value)
+    if value.tzinfo is None:
+        value = pytz.UTC.localize(value)
+    return value.astimezone(pytz.UTC).isoformat()
+
+def _new_daily_manifest(device_id: str, local_date: str) -> dict:
+    return {"device_id": device_id, "local_date": local_date, "files": []}
+
+def _store_daily_manifest(device_id: str, local_date: str, manifest: dict, files: list[dict]) -> dict:
+    """エントリをrecorded_at（UTC）で重複排除・整列して集計を付け直し、S3とキャッシュに書き込む"""
+    by_recorded_at = {}
+    for f in files:
+        recorded_at = normalize_recorded_at(f["recorded_at"])
+        by_recorded_at[recorded_at] = {**f, "recorded_at": recorded_at}
+    files = [by_recorded_at[key] for key in sorted(by_recorded_at)]
+
+    manifest = {
+        **manifest,
+        "files": files,
+        "total_count": len(files),
+        "total_size_bytes": sum(f.get("size_bytes") or 0 for f in files),
+        "updated_at": datetime.now(pytz.UTC).isoformat()
+    }
+
+    s3_client.put_object(
+        Bucket=S3_BUCKET_NAME,
+        Key=get_manifest_key(device_id, local_date),
+        Body=json.dumps(manifest, ensure_ascii=False).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+    with _manifest_lock:
+        _cache_manifest(device_id, local_date, manifest)
+    return manifest
+
+def build_daily_manifest(device_id: str, local_date: str, page_size: int = 1000) -> list[dict]:
+    """
+    audio_filesから1日分のマニフェストのエントリを作る
+
+    duration_seconds は audio_files にないため None（既存のマニフェストにあればそちらを引き継ぐ）
+    """
+    files = []
+    offset = 0
+    while True:
+        rows = supabase_client.table("audio_files") \
+            .select("recorded_at, local_time, file_path, file_size_bytes, sha256, transcriptions_status") \
+            .eq("device_id", device_id) \
+            .eq("local_date", local_date) \
+            .order("recorded_at") \
+            .range(offset, offset + page_size - 1) \
+            .execute().data
+        for row in rows:
+            files.append({
+                "recorded_at": normalize_recorded_at(row["recorded_at"]),
+                "local_time": row.get("local_time"),
+                "s3_key": row["file_path"],
+                "stored": is_stored_file_path(row["file_path"]),
+                "size_bytes": row.get("file_size_bytes"),
+                "duration_seconds": None,
+                "sha256": row.get("sha256"),
+                "status": row.get("transcriptions_status")
+            })
+        if len(rows) < page_size:
+            break
+        offset += page_size
+    return files
+
+def load_daily_manifest(device_id: str, local_date: str) -> Optional[dict]:
+    """
+    マニフェストを取得する（メモリキャッシュ → S3 → audio_filesの順に参照）
+
+    S3にない日はaudio_filesから作成し、録音があればS3に保存する
+
+    Returns:
+        dict: マニフェスト（録音がない場合はNone）
+    """
+    with _manifest_lock:
+        cached = _manifest_cache.get((device_id, local_date))
+        if cached is not None:
+            _manifest_cache.move_to_end((device_id, local_date))
+            return cached
+
+    with _manifest_update_lock(device_id, local_date):
+        # ロック待ちの間に別スレッドが作成・更新した場合はそちらを使う
+        with _manifest_lock:
+            cached = _manifest_cache.get((device_id, local_date))
+        if cached is not None:
+            return cached
+
+        try:
+            response = s3_client.get_object(
+                Bucket=S3_BUCKET_NAME,
+                Key=get_manifest_key(device_id, local_date)
+            )
+            manifest = json.loads(response["Body"].read())
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            files = build_daily_manifest(device_id, local_date)
+            if not files:
+                return None
+            return _store_daily_manifest(device_id, local_date, _new_daily_manifest(device_id, local_date), files)
+
+        with _manifest_lock:
+            _cache_manifest(device_id, local_date, manifest)
+        return manifest
+
+def update_daily_manifest(device_id: str, local_date: str, entry: dict) -> dict:
+    """
+    マニフェストに1スロット分のエントリを追加（同じrecorded_atは置き換え）してS3に書き戻す
+
+    Args:
+        device_id: デバイスID
+        local_date: ローカル日付（YYYY-MM-DD）
+        entry: recorded_at, s3_key, size_bytes, duration_seconds, sha256 などを含む辞書
+
+    Returns:
+        dict: 更新後のマニフェスト
+    """
+    with _manifest_update_lock(device_id, local_date):
+        try:
+            manifest = load_daily_manifest(device_id, local_date) or _new_daily_manifest(device_id, local_date)
+            return _store_daily_manifest(device_id, local_date, manifest, [*manifest["files"], entry])
+        except Exception:
+            # 書き戻せなかった内容をキャッシュから返さないよう捨てる（次回はS3から読み直す）
+            with _manifest_lock:
+                _manifest_cache.pop((device_id, local_date), None)
+            raise
+
+def rebuild_daily_manifest(device_id: str, local_date: str) -> Optional[dict]:
+    """
+    audio_filesからマニフェストを作り直す（書き戻しに失敗したエントリの修復用）
+
+    既存のマニフェストにあるエントリの duration_seconds は引き継ぐ
+
+    Returns:
+        dict: 作り直したマニフェスト（録音がない場合はNone）
+    """
+    with _manifest_update_lock(device_id, local_date):
+        files = build_daily_manifest(device_id, local_date)
+        if not files:
+            return None
+
+        try:
+            response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=get_manifest_key(device_id, local_date))
+            manifest = json.loads(response["Body"].read())
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            manifest = _new_daily_manifest(device_id, local_date)
+
+        durations = {
+            normalize_recorded_at(f["recorded_at"]): f.get("duration_seconds")
+            for f in manifest.get("files", [])
+        }
+        for f in files:
+            f["duration_seconds"] = durations.get(f["recorded_at"])
+        return _store_daily_manifest(device_id, local_date, manifest, files)
+
+# =========================================
+# 録音カバレッジインデックス（デバイス×ローカル月）
+# =========================================
+# 1日48スロット（30分単位）の録音有無を1日1ビットマップで表し、1か月分を1オブジェクトに保存する。
+# アップロードごとに該当ビットを立てるため、欠損スロットの確認にaudio_filesを全件読む必要がない。
+_coverage_cache: "OrderedDict[tuple[str, str], dict]" = OrderedDict()
+_coverage_lock = threading.Lock()
+_coverage_update_locks = [threading.RLock() for _ in range(COVERAGE_LOCK_STRIPES)]
+
+def get_coverage_key(device_id: str, month: str) -> str:
+    """カバレッジインデックスのS3キーを生成する（month: YYYY-MM）"""
+    return f"{COVERAGE_PREFIX}/{device_id}/{month}.json"
+
+def coverage_slot_index(time_block: str) -> int:
+    """タイムブロック（"HH-MM"）をスロット番号（0〜47）に変換する"""
+    hour, minute = time_block.split('-')
+    return int(hour) * 2 + int(minute) // 30
+
+def coverage_slot_label(slot: int) -> str:
+    """スロット番号をタイムブロック（"HH-MM"）に変換する"""
+    return f"{slot // 2:02d}-{(slot % 2) * 30:02d}"
+
+def _coverage_update_lock(device_id: str, month: str) -> threading.RLock:
+    """デバイス×月のインデックスの作成（audio_filesからの作成・保存）とビット更新を直列化するロック"""
+    return _coverage_update_locks[hash((device_id, month)) % COVERAGE_LOCK_STRIPES]
+
+def _cache_coverage(device_id: str, month: str, coverage: dict) -> None:
+    _coverage_cache[(device_id, month)] = coverage
+    _coverage_cache.move_to_end((device_id, month))
+    while len(_coverage_cache) > COVERAGE_CACHE_MAX_ENTRIES:
+        _coverage_cache.popitem(last=False)
+
+def _store_coverage(coverage: dict) -> None:
+    s3_client.put_object(
+        Bucket=S3_BUCKET_NAME,
+        Key=get_coverage_key(coverage["device_id"], coverage["month"]),
+        Body=json.dumps(coverage, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+def build_coverage_month(device_id: str, month: str, page_size: int = 1000) -> dict:
+    """audio_filesからカバレッジインデックスを作り直す（インデックス未作成の月用）"""
+    first_day = datetime.strptime(f"{month}-01", "%Y-%m-%d")
+    next_month = (first_day + timedelta(days=32)).replace(day=1)
+
+    bitmaps = {}
+    offset = 0
+    while True:
+        rows = supabase_client.table("audio_files") \
+            .select("local_date, local_time") \
+            .eq("device_id", device_id) \
+            .gte("local_date", first_day.strftime("%Y-%m-%d")) \
+            .lt("local_date", next_month.strftime("%Y-%m-%d")) \
+            .order("recorded_at") \
+            .range(offset, offset + page_size - 1) \
+            .execute().data
+        for row in rows:
+            if not row.get("local_date") or not row.get("local_time"):
+                continue
+            slot = coverage_slot_index(calculate_time_block(datetime.fromisoformat(row["local_time"])))
+            bitmaps[row["local_date"]] = bitmaps.get(row["local_date"], 0) | (1 << slot)
+        if len(rows) < page_size:
+            break
+        offset += page_size
+
+    return {
+        "device_id": device_id,
+        "month": month,
+        "slots_per_day": COVERAGE_SLOTS_PER_DAY,
+        "days": {day: f"{bitmap:012x}" for day, bitmap in sorted(bitmaps.items())},
+        "updated_at": datetime.now(pytz.UTC).isoformat()
+    }
+
+def load_coverage_month(device_id: str, month: str) -> dict:
+    """
+    1か月分のカバレッジインデックスを取得する（メモリキャッシュ → S3 → audio_filesの順）
+
+    S3にない月はaudio_filesから作成し、録音があればS3に保存する
+    """
+    with _coverage_lock:
+        cached = _coverage_cache.get((device_id, month))
+        if cached is not None:
+            _coverage_cache.move_to_end((device_id, month))
+            return cached
+
+    with _coverage_update_lock(device_id, month):
+        # ロック待ちの間に別スレッドが作成・更新した場合はそちらを使う
+        with _coverage_lock:
+            cached = _coverage_cache.get((device_id, month))
+        if cached is not None:
+            return cached
+
+        try:
+            response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=get_coverage_key(device_id, month))
+            coverage = json.loads(response["Body"].read())
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            coverage = build_coverage_month(device_id, month)
+            if coverage["days"]:
+                _store_coverage(coverage)
+
+        with _coverage_lock:
+            _cache_coverage(device_id, month, coverage)
+        return coverage
+
+def update_coverage(device_id: str, local_date: str, time_block: str) -> dict:
+    """アップロードされたスロットのビットを立て、変化があればS3に書き戻す"""
+    month = local_date[:7]
+    with _coverage_update_lock(device_id, month):
+        coverage = load_coverage_month(device_id, month)
+        bitmap = int(coverage["days"].get(local_date, "0"), 16)
+        updated = bitmap | (1 << coverage_slot_index(time_block))
+        if updated == bitmap:
+            return coverage
+
+        coverage = {
+            **coverage,
+            "days": dict(sorted({**coverage["days"], local_date: f"{updated:012x}"}.items())),
+            "updated_at": datetime.now(pytz.UTC).isoformat()
+        }
+        _store_coverage(coverage)
+
+        with _coverage_lock:
+            _cache_coverage(device_id, month, coverage)
+        return coverage
+
+def update_day_indexes(device_id: str, local_date: str, time_block: Optional[str], manifest_entry: Optional[dict]) -> None:
+    """アップロード1件分の日次マニフェストとカバレッジを更新する（失敗は警告のみ）"""
+    if manifest_entry is not None:
+        try:
+            update_daily_manifest(device_id, local_date, manifest_entry)
+        except Exception as e:
+            print(f"⚠️ Warning: Failed to update daily manifest for {device_id}/{local_date}: {e}")
+
+    if time_block:
+        try:
+            update_coverage(device_id, local_date, time_block)
+        except Exception as e:
+            print(f"⚠️ Warning: Failed to update coverage for {device_id}/{local_date}: {e}")
+
+def get_coverage_range(device_id: str, date_from: datetime, date_to: datetime, include_missing: bool = True) -> CoverageRange:
+    """期間内の日ごとのカバレッジ（録音済みスロット数・欠損スロット）を集計する"""
+    months = []
+    month = date_from.replace(day=1)
+    while month <= date_to:
+        months.append(month.strftime("%Y-%m"))
+        month = (month + timedelta(days=32)).replace(day=1)
+
+    bitmaps = {}
+    for month in months:
+        bitmaps.update(load_coverage_month(device_id, month)["days"])
+
+    full_day = (1 << COVERAGE_SLOTS_PER_DAY) - 1
+    days = []
+    covered_total = 0
+    day = date_from
+    while day <= date_to:
+        local_date = day.strftime("%Y-%m-%d")
+        bitmap = int(bitmaps.get(local_date, "0"), 16)
+        covered = bin(bitmap).count("1")
+        covered_total += covered
+        entry: CoverageDay = {"local_date": local_date, "bitmap": f"{bitmap:012x}", "covered_slots": covered}
+        if include_missing:
+            missing = full_day & ~bitmap
+            entry["missing_slots"] = [coverage_slot_label(slot) for slot in range(COVERAGE_SLOTS_PER_DAY) if missing >> slot & 1]
+        days.append(entry)
+        day += timedelta(days=1)
+
+    total_slots = len(days) * COVERAGE_SLOTS_PER_DAY
+    return {
+        "device_id": device_id,
+        "from": date_from.strftime("%Y-%m-%d"),
+        "to": date_to.strftime("%Y-%m-%d"),
+        "slot_minutes": 30,
+        "slots_per_day": COVERAGE_SLOTS_PER_DAY,
+        "days": days,
+        "total_slots": total_slots,
+        "covered_slots": covered_total,
+        "coverage_ratio": round(covered_total / total_slots, 4) if total_slots else None
+    }
+
+# =========================================
+# 音声ストリーミング用ディスクキャッシュ（LRU）
+# =========================================
+# 再生済みオブジェクトをローカルディスクに保持し、シーク（Rangeリクエスト）や
+# 再再生のたびにS3 GET・転送料金が発生しないようにする
+_stream_cache: "OrderedDict[str, dict]" = OrderedDict()
+_stream_cache_bytes = 0
+_stream_cache_lock = threading.Lock()
+# 取り込み中のオブジェクト（同じオブジェクトへの同時リクエストでS3 GETを重複させない）
+_stream_cache_fills: "dict[str, Future]" = {}
+_stream_cache_fill_executor = ThreadPoolExecutor(max_workers=STREAM_CACHE_FILL_WORKERS, thread_name_prefix="stream-cache-fill")
+
+def _stream_cache_path(file_path: str) -> str:
+    return os.path.join(STREAM_CACHE_DIR, hashlib.sha256(file_path.encode('utf-8')).hexdigest())
+
+def get_cached_stream_object(file_path: str) -> Optional[dict]:
+    """キャッシュ済みオブジェクトの情報（path, size, etag, content_type）を取得する"""
+    with _stream_cache_lock:
+        entry = _stream_cache.get(file_path)
+        if entry is None:
+            return None
+        if not os.path.exists(entry["path"]):
+            _drop_stream_cache_entry(file_path)
+            return None
+        _stream_cache.move_to_end(file_path)
+        return entry
+
+def _drop_stream_cache_entry(file_path: str) -> None:
+    global _stream_cache_bytes
+    entry = _stream_cache.pop(file_path, None)
+    if entry is None:
+        return
+    _stream_cache_bytes -= entry["size"]
+    try:
+        os.unlink(entry["path"])
+    except FileNotFoundError:
+        pass
+
+def invalidate_stream_cache(file_path: str) -> None:
+    """オブジェクトが更新された場合にキャッシュを破棄する"""
+    with _stream_cache_lock:
+        _drop_stream_cache_entry(file_path)
+
+def fetch_stream_object_to_cache(file_path: str) -> dict:
+    """
+    S3からオブジェクトをチャンク単位でディスクキャッシュに書き出す
+
+    Returns:
+        dict: キャッシュエントリ（path, size, etag, content_type）
+    """
+    global _stream_cache_bytes
+    os.makedirs(STREAM_CACHE_DIR, exist_ok=True)
+
+    response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=file_path)
+    cache_path = _stream_cache_path(file_path)
+    fd, temp_path = tempfile.mkstemp(dir=STREAM_CACHE_DIR, suffix='.part')
+    size = 0
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in response["Body"].iter_chunks(STREAM_CHUNK_SIZE):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(temp_path, cache_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    entry = {
+        "path": cache_path,
+        "size": size,
+        "etag": response.get("ETag"),
+        "content_type": response.get("ContentType") or 'audio/wav'
+    }
+
+    with _stream_cache_lock:
+        _drop_stream_cache_entry(file_path)
+        _stream_cache[file_path] = entry
+        _stream_cache_bytes += size
+        # 上限を超えた分を古い順に削除（今追加したエントリは残す）
+        while _stream_cache_bytes > STREAM_CACHE_MAX_BYTES and len(_stream_cache) > 1:
+            _drop_stream_cache_entry(next(iter(_stream_cache)))
+
+    return entry
+
+def schedule_stream_cache_fill(file_path: str) -> Future:
+    """オブジェクトのディスクキャッシュへの取り込みをバックグラウンドで開始する（取り込み中なら同じFutureを返す）"""
+    with _stream_cache_lock:
+        future = _stream_cache_fills.get(file_path)
+        if future is None:
+            future = _stream_cache_fill_executor.submit(_fill_stream_cache, file_path)
+            _stream_cache_fills[file_path] = future
+    return future
+
+def _fill_stream_cache(file_path: str) -> Optional[dict]:
+    try:
+        return fetch_stream_object_to_cache(file_path)
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to cache stream object {file_path}: {e}")
+        return None
+    finally:
+        with _stream_cache_lock:
+            _stream_cache_fills.pop(file_path, None)
+
+def flush_stream_cache_fills(timeout: float) -> bool:
+    """取り込み中のオブジェクトがなくなるまで待つ"""
+    with _stream_cache_lock:
+        futures = list(_stream_cache_fills.values())
+    _, not_done = wait(futures, timeout=timeout)
+    return not not_done
+
+def reset_stream_cache_dir() -> None:
+    """
+    起動時にディスクキャッシュのディレクトリを空にする
+
+    前回のプロセスが残したファイルはLRUの管理外で STREAM_CACHE_MAX_BYTES に数えられないため削除する
+    """
+    global _stream_cache_bytes
+    with _stream_cache_lock:
+        _stream_cache.clear()
+        _stream_cache_bytes = 0
+        if not os.path.isdir(STREAM_CACHE_DIR):
+            return
+        removed = 0
+        for name in os.listdir(STREAM_CACHE_DIR):
+            path = os.path.join(STREAM_CACHE_DIR, name)
+            if os.path.isfile(path):
+                os.unlink(path)
+                removed += 1
+    if removed:
+        print(f"🧹 Cleared {removed} stale files from stream cache: {STREAM_CACHE_DIR}")
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    """If-None-MatchヘッダーがETagに一致するか判定する（弱いETag比較）"""
+    if not if_none_match or not etag:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    normalized = etag.removeprefix('W/')
+    return any(tag.strip().removeprefix('W/') == normalized for tag in if_none_match.split(','))
+
+# =========================================
+# 波形サマリー（peaks）の保存・キャッシュ
+# =========================================
+# API Managerの一覧画面が音声本体をダウンロードせずに波形を描画できるよう、
+# 数十KBの波形サマリーを音声と同じパス構造で保存する
+_peaks_cache: "OrderedDict[str, dict]" = OrderedDict()
+_peaks_lock = threading.Lock()
+
+def get_peaks_key(file_path: str) -> str:
+    """音声ファイルのS3キーから波形サマリーのS3キーを生成する"""
+    # files/{device_id}/{date}/{HH-MM-SS}/audio.wav -> peaks/files/{device_id}/{date}/{HH-MM-SS}/audio.peaks.json
+    base, dot, extension = file_path.rpartition('.')
+    return f"{PEAKS_PREFIX}/{base if dot and '/' not in extension else file_path}.peaks.json"
+
+def _cache_peaks(file_path: str, peaks: dict) -> None:
+    with _peaks_lock:
+        _peaks_cache[file_path] = peaks
+        _peaks_cache.move_to_end(file_path)
+        while len(_peaks_cache) > PEAKS_CACHE_MAX_ENTRIES:
+            _peaks_cache.popitem(last=False)
+
+def store_peaks(file_path: str, wav_content: bytes) -> dict:
+    """波形サマリーを計算してS3に保存し、キャッシュに登録する"""
+    peaks = {"file_path": file_path, **compute_peaks(wav_content)}
+    s3_client.put_object(
+        Bucket=S3_BUCKET_NAME,
+        Key=get_peaks_key(file_path),
+        Body=json.dumps(peaks, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json'
+    )
+    _cache_peaks(file_path, peaks)
+    return peaks
+
+def load_peaks(file_path: str) -> dict:
+    """
+    波形サマリーを取得する（メモリキャッシュ → S3 → 音声から生成 の順）
+
+    Raises:
+        ClientError: 音声ファイルが存在しない場合（NoSuchKey）
+    """
+    with _peaks_lock:
+        cached = _peaks_cache.get(file_path)
+        if cached is not None:
+            _peaks_cache.move_to_end(file_path)
+            return cached
+
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=get_peaks_key(file_path))
+        peaks = json.loads(response["Body"].read())
+        _cache_peaks(file_path, peaks)
+        return peaks
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+            raise
+
+    # 未生成の場合は音声から生成する（アップロード時に生成していない古い録音など）
+    print(f"🔄 Generating peaks on demand: {file_path}")
+    response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=file_path)
+    return store_peaks(file_path, response["Body"].read())
+
+def invalidate_peaks_cache(file_path: str) -> None:
+    with _peaks_lock:
+        _peaks_cache.pop(file_path, None)
+
+# =========================================
+# 日次アーカイブ（デバイス×ローカル日付のバンドル）
+# =========================================
+# compact_archives.py が1日分の録音を1つのバンドルに連結し、オフセットのインデックスを保存する。
+# 各スロットは元のWAVのままバンドル内に並ぶため、Range GETで1件だけ取り出しても再生できる。
+_archive_index_cache: "OrderedDict[tuple[str, str], dict]" = OrderedDict()
+_archive_index_lock = threading.Lock()
+
+def get_archive_key(device_id: str, local_date: str) -> str:
+    """アーカイブバンドルのS3キーを生成する"""
+    return f"{ARCHIVE_PREFIX}/{device_id}/{local_date}/bundle.bin"
+
+def get_archive_index_key(device_id: str, local_date: str) -> str:
+    """アーカイブインデックスのS3キーを生成する"""
+    return f"{ARCHIVE_PREFIX}/{device_id}/{local_date}/index.json"
+
+def archive_byte_range(offset: int, length: int) -> str:
+    """バンドル内のスロットを取り出すためのRangeヘッダー値"""
+    return f"bytes={offset}-{offset + length - 1}"
+
+def load_archive_index(device_id: str, local_date: str) -> Optional[dict]:
+    """
+    アーカイブインデックスを取得する（メモリキャッシュ → S3の順に参照）
+
+    Returns:
+        dict: インデックス（未作成の場合はNone）
+    """
+    with _archive_index_lock:
+        cached = _archive_index_cache.get((device_id, local_date))
+        if cached is not None:
+            _archive_index_cache.move_to_end((device_id, local_date))
+            return cached
+
+    try:
+        response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=get_archive_index_key(device_id, local_date))
+        index = json.loads(response["Body"].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return None
+        raise
+
+    cache_archive_index(device_id, local_date, index)
+    return index
+
+def cache_archive_index(device_id: str, local_date: str, index: dict) -> None:
+    with _archive_index_lock:
+        _archive_index_cache[(device_id, local_date)] = index
+        _archive_index_cache.move_to_end((device_id, local_date))
+        while len(_archive_index_cache) > ARCHIVE_INDEX_CACHE_MAX_ENTRIES:
+            _archive_index_cache.popitem(last=False)
+
+def resolve_archive_range(file_path: str) -> Optional[dict]:
+    """audio_filesからスロットのアーカイブ内の位置を取得する（未アーカイブの場合はNone）"""
+    rows = supabase_client.table("audio_files") \
+        .select("archive_path, archive_offset, archive_length") \
+        .eq("file_path", file_path) \
+        .limit(1) \
+        .execute().data
+    if not rows or not rows[0].get("archive_path"):
+        return None
+    row = rows[0]
+    return {
+        "archive_path": row["archive_path"],
+        "offset": row["archive_offset"],
+        "length": row["archive_length"],
+        "range": archive_byte_range(row["archive_offset"], row["archive_length"])
+    }
+
+# =========================================
+# ストレージ階層（アーカイブ済みオブジェクトの復元）
+# =========================================
+# tier_storage.py が GLACIER などへ移したオブジェクトは、そのままではGETできない。
+# /api/audio-files/presigned-url へのアクセス時に復元（RestoreObject）を要求し、
+# 復元が終わるまでは 202 と復元状況を返す。
+_storage_restore_lock = threading.Lock()
+_storage_restore_stats = {"requested": 0, "in_progress": 0, "restored": 0}
+
+
+def storage_class_rank(storage_class: Optional[str]) -> int:
+    """ストレージクラスの階層（head_object で StorageClass が省略された場合は STANDARD）"""
+    try:
+        return STORAGE_CLASS_ORDER.index(storage_class or "STANDARD")
+    except ValueError:
+        return 0
+
+
+def parse_restore_header(restore: Optional[str]) -> Optional[dict]:
+    """
+    head_object の Restore ヘッダーを解析する
+
+    例: 'ongoing-request="false", expiry-date="Fri, 21 Dec 2012 00:00:00 GMT"'
+
+    Returns:
+        dict: status（in_progress / restored）と expiry_date。復元を要求していない場合はNone
+    """
+    if not restore:
+        return None
+    values = dict(re.findall(r'([\w-]+)="([^"]*)"', restore))
+    if values.get("ongoing-request") == "true":
+        return {"status": "in_progress", "expiry_date": None}
+    return {"status": "restored", "expiry_date": values.get("expiry-date")}
+
+
+def request_object_restore(file_path: str) -> str:
+    """
+    アーカイブ済みオブジェクトの復元を要求する
+
+    Returns:
+        str: "requested"（新たに要求した）または "in_progress"（既に復元中）
+    """
+    try:
+        with start_span("s3.restore_object", **{"s3.key": file_path}):
+            s3_client.restore_object(
+                Bucket=S3_BUCKET_NAME,
+                Key=file_path,
+                RestoreRequest={
+                    "Days": STORAGE_RESTORE_DAYS,
+                    "GlacierJobParameters": {"Tier": STORAGE_RESTORE_TIER}
+                }
+            )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'RestoreAlreadyInProgress':
+            raise
+        return "in_progress"
+    print(f"🧊 Restore requested: {file_path} ({STORAGE_RESTORE_TIER}, {STORAGE_RESTORE_DAYS} days)")
+    return "requested"
+
+
+def record_restore_status(status: str) -> None:
+    with _storage_restore_lock:
+        _storage_restore_stats[status] += 1
+
+
+def get_storage_restore_stats() -> dict:
+    with _storage_restore_lock:
+        return dict(_storage_restore_stats)
+
+
+def check_object_restore(file_path: str, head: dict, restore: bool = True) -> Optional[dict]:
+    """
+    head_object の結果から、復元が必要なクラスのオブジェクトの復元状況を確認する
+
+    Args:
+        restore: 復元を要求していない場合に要求する（Falseの場合は状況のみ返す）
+
+    Returns:
+        dict: storage_class, restore_status（requested / in_progress / archived / restored）, expiry_date。
+              そのままGETできるクラスの場合はNone
+    """
+    storage_class = head.get("StorageClass") or "STANDARD"
+    if storage_class not in STORAGE_RESTORE_CLASSES:
+        return None
+
+    restore_info = parse_restore_header(head.get("Restore"))
+    if restore_info is None:
+        restore_status = request_object_restore(file_path) if restore else "archived"
+        expiry_date = None
+    else:
+        restore_status = restore_info["status"]
+        expiry_date = restore_info["expiry_date"]
+    if restore_status != "archived":
+        record_restore_status(restore_status)
+    return {"storage_class": storage_class, "restore_status": restore_status, "expiry_date": expiry_date}
+
+
+def restore_pending_response(file_path: str, state: dict) -> FastJSONResponse:
+    """復元が終わっていないオブジェクトへのアクセスに返す202（Retry-After付き）"""
+    return FastJSONResponse(
+        status_code=202,
+        content=RestorePendingResponse(
+            file_path=file_path,
+            storage_class=state["storage_class"],
+            restore_status=state["restore_status"],
+            retry_after_seconds=STORAGE_RESTORE_RETRY_AFTER_SECONDS,
+            bucket=S3_BUCKET_NAME
+        ),
+        headers={"Retry-After": str(STORAGE_RESTORE_RETRY_AFTER_SECONDS)}
+    )
+
+# =========================================
+# audio_files ストリーム読み出し
+# =========================================
+def iter_audio_file_rows(
+    columns: str,
+    device_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    page_size: int = 1000
+):
+    """
+    audio_filesを (recorded_at, device_id) 順にキーセットページングで1行ずつ返す
+
+    OFFSETを使わないため、範囲が広くても各ページの取得コストは一定。
+    columns には device_id と recorded_at を含めること。
+    """
+    last_recorded_at = None
+    seen_at_last = set()
+
+    while True:
+        query = supabase_client.table("audio_files").select(columns)
+        if device_id:
+            query = query.eq("device_id", device_id)
+        if date_from:
+            query = query.gte("local_date", date_from)
+        if date_to:
+            query = query.lte("local_date", date_to)
+        if last_recorded_at is not None:
+            query = query.gte("recorded_at", last_recorded_at)
+
+        rows = query.order("recorded_at").order("device_id").limit(page_size).execute().data
+
+        # 前ページ末尾と同じrecorded_atの行は、既に返したdevice_idを除外する
+        new_rows = [
+            row for row in rows
+            if not (row["recorded_at"] == last_recorded_at and row["device_id"] in seen_at_last)
+        ]
+        yield from new_rows
+
+        if len(rows) < page_size:
+            return
+        if not new_rows:
+            # 同一recorded_atの行がページサイズを超える場合はページを広げて進める
+            page_size *= 2
+            continue
+
+        last = rows[-1]["recorded_at"]
+        if last != last_recorded_at:
+            seen_at_last = set()
+        seen_at_last.update(row["device_id"] for row in rows if row["recorded_at"] == last)
+        last_recorded_at = last
+
+def get_s3_file_info(file_path: str) -> dict:
+    """S3オブジェクトの存在・サイズ・更新日時を取得する"""
+    try:
+        response = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=file_path)
+        return {
+            "file_exists": True,
+            "s3_size_bytes": response["ContentLength"],
+            "last_modified": response["LastModified"].isoformat()
+        }
+    except ClientError:
+        return {"file_exists": False, "s3_size_bytes": None, "last_modified": None}
+
+def iter_with_s3_info(rows, chunk_size: int = EXPORT_S3_CHUNK_SIZE, concurrency: int = EXPORT_S3_CONCURRENCY):
+    """行ストリームをチャンク単位でまとめ、S3メタデータを並列に付与して返す"""
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield from _with_s3_info(executor, chunk)
+                chunk = []
+        if chunk:
+            yield from _with_s3_info(executor, chunk)
+
+def _with_s3_info(executor: ThreadPoolExecutor, chunk: list):
+    for row, info in zip(chunk, executor.map(lambda r: get_s3_file_info(r["file_path"]), chunk)):
+        row.update(info)
+        yield row
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield encode_json(row) + b"\n"
+
+def iter_csv(rows, columns: list, batch_size: int = 500):
+    """行ストリームをCSVに変換する（batch_size行ごとにまとめて送信）"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+# =========================================
+# レスポンスキャッシュ（ETag / 304 Not Modified）
+# =========================================
+# API Managerのポーリングで、アップロードがない限りSupabase・S3への問い合わせを行わない。
+# エントリは対象範囲（device_id, local_dateの範囲）を保持し、/upload 成功時に
+# 影響するエントリだけを無効化する
+_response_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+_response_cache_lock = threading.Lock()
+_response_cache_stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0, "stale_skips": 0}
+# 無効化ごとに進める世代と、直近の無効化 (世代, device_id, local_date)
+# アップロード（レプリケーションのワーカーを含む）と一覧の読み込みが並行した場合に、
+# 無効化より前に読んだ内容を後からキャッシュに登録しないよう照合する
+_response_cache_generation = 0
+_response_cache_invalidations: "deque[tuple]" = deque(maxlen=RESPONSE_CACHE_INVALIDATION_LOG_SIZE)
+
+def response_cache_generation() -> int:
+    """現在の無効化の世代（読み込みを始める前に取得して cache_response に渡す）"""
+    with _response_cache_lock:
+        return _response_cache_generation
+
+def _response_cache_affected(entry: dict, device_id: str, local_date: str) -> bool:
+    """デバイス・ローカル日付の変更がキャッシュエントリの範囲に影響するか"""
+    if entry["device_ids"] is not None:
+        # デバイス一覧は新しいデバイスが追加された場合のみ変わる
+        return device_id not in entry["device_ids"]
+    if entry["device_id"] is not None and entry["device_id"] != device_id:
+        return False
+    if entry["date_from"] and local_date < entry["date_from"]:
+        return False
+    if entry["date_to"] and local_date > entry["date_to"]:
+        return False
+    return True
+
+def get_cached_response(cache_key: tuple) -> Optional[dict]:
+    """キャッシュ済みレスポンスを取得する（期限切れの場合はNone）"""
+    with _response_cache_lock:
+        entry = _response_cache.get(cache_key)
+        if entry is not None and entry["expires_at"] <= datetime.now(pytz.UTC):
+            del _response_cache[cache_key]
+            entry = None
+        if entry is None:
+            _response_cache_stats["misses"] += 1
+            return None
+        _response_cache.move_to_end(cache_key)
+        _response_cache_stats["hits"] += 1
+        return entry
+
+def cache_response(cache_key: tuple, content, device_id: Optional[str] = None,
+                   date_from: Optional[str] = None, date_to: Optional[str] = None,
+                   device_ids: Optional[set] = None, generation: Optional[int] = None) -> dict:
+    """
+    レスポンスをシリアライズしてキャッシュに登録する
+
+    Args:
+        cache_key: 正規化したクエリパラメータ
+        content: レスポンス本体（dict またはレスポンスモデル）
+        device_id / date_from / date_to: このレスポンスが対象とする範囲（Noneは全範囲）
+        device_ids: レスポンスに含まれるデバイスID（/api/devices用、新規デバイスの判定に使用）
+        generation: 読み込み前に取得した response_cache_generation()。
+                    以降にこの範囲が無効化されていた場合は登録せずにエントリだけ返す
+    """
+    body = encode_json(content)
+    entry = {
+        "body": body,
+        "etag": f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+        "device_id": device_id,
+        "date_from": date_from,
+        "date_to": date_to,
+        "device_ids": device_ids,
+        "expires_at": datetime.now(pytz.UTC) + timedelta(seconds=RESPONSE_CACHE_TTL_SECONDS)
+    }
+    with _response_cache_lock:
+        if generation is not None and generation != _response_cache_generation:
+            newer = [record for record in _response_cache_invalidations if record[0] > generation]
+            # 記録が溢れて照合できない場合も古い可能性があるため登録しない
+            if len(newer) < _response_cache_generation - generation or \
+                    any(_response_cache_affected(entry, record[1], record[2]) for record in newer):
+                _response_cache_stats["stale_skips"] += 1
+                return entry
+        _response_cache[cache_key] = entry
+        _response_cache.move_to_end(cache_key)
+        while len(_response_cache) > RESPONSE_CACHE_MAX_ENTRIES:
+            _response_cache.popitem(last=False)
+    return entry
+
+def invalidate_response_cache(device_id: str, local_date: str) -> int:
+    """
+    アップロードされたデバイス・ローカル日付に影響するキャッシュだけを無効化する
+
+    Returns:
+        int: 無効化したエントリ数
+    """
+    global _response_cache_generation
+    with _response_cache_lock:
+        _response_cache_generation += 1
+        _response_cache_invalidations.append((_response_cache_generation, device_id, local_date))
+        keys = [key for key, entry in _response_cache.items()
+                if _response_cache_affected(entry, device_id, local_date)]
+        for key in keys:
+            del _response_cache[key]
+        _response_cache_stats["invalidations"] += len(keys)
+    return len(keys)
+
+def cached_json_response(request: Request, entry: dict, cache_status: str) -> Response:
+    """キャッシュエントリからレスポンスを生成する（If-None-Match一致時は304）"""
+    headers = {"ETag": entry["etag"], "Cache-Control": "no-cache", "X-Cache": cache_status}
+    if etag_matches(request.headers.get("if-none-match"), entry["etag"]):
+        with _response_cache_lock:
+            _response_cache_stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry["body"], media_type="application/json", headers=headers)
+
+def get_response_cache_stats() -> dict:
+    with _response_cache_lock:
+        lookups = _response_cache_stats["hits"] + _response_cache_stats["misses"]
+        return {
+            **_response_cache_stats,
+            "entries": len(_response_cache),
+            "hit_ratio": round(_response_cache_stats["hits"] / lookups, 4) if lookups else None
+        }
+
+# =========================================
+# グレースフルシャットダウン（ドレイン）
+# =========================================
+# SIGTERMを受けたら新規アップロードを503で断り（/readyもfalseにする）、
+# 実行中のアップロードが終わるのを DRAIN_TIMEOUT_SECONDS まで待ってから
+# uvicorn本来の終了処理に引き渡す。
+# アップロード数はイベントループ上のミドルウェアでのみ増減するためロック不要。
+_drain_state = {
+    "draining": False,
+    "started_at": None,
+    "deadline": None,
+    "in_flight_uploads": 0,
+    "rejected_uploads": 0
+}
+
+# 終了時にフラッシュするバックグラウンド処理（残り秒数を受け取る同期関数）
+_drain_hooks = []
+
+def register_drain_hook(hook) -> None:
+    """ドレイン完了時に呼び出すフラッシュ処理を登録する"""
+    _drain_hooks.append(hook)
+
+def begin_drain() -> None:
+    """ドレインを開始する（新規アップロードの受付を停止）"""
+    if _drain_state["draining"]:
+        return
+    _drain_state["draining"] = True
+    _drain_state["started_at"] = time.monotonic()
+    _drain_state["deadline"] = _drain_state["started_at"] + DRAIN_TIMEOUT_SECONDS
+    print(f"🛑 Draining: {_drain_state['in_flight_uploads']} uploads in flight (timeout {DRAIN_TIMEOUT_SECONDS:.0f}s)")
+
+def drain_remaining_seconds() -> float:
+    if _drain_state["deadline"] is None:
+        return DRAIN_TIMEOUT_SECONDS
+    return max(_drain_state["deadline"] - time.monotonic(), 0.0)
+
+async def wait_for_in_flight_uploads(poll_interval: float = 0.05) -> bool:
+    """実行中のアップロードが0件になるまで待つ（期限内に終わればTrue）"""
+    while _drain_state["in_flight_uploads"] > 0:
+        if drain_remaining_seconds() <= 0:
+            print(f"⚠️ Drain timeout: {_drain_state['in_flight_uploads']} uploads still in flight")
+            return False
+        await asyncio.sleep(poll_interval)
+    return True
+
+async def drain_uploads() -> None:
+    """ドレインを完了させる（実行中アップロードの待機とバックグラウンド処理のフラッシュ）"""
+    begin_drain()
+    await wait_for_in_flight_uploads()
+    for hook in _drain_hooks:
+        try:
+            await run_in_threadpool(hook, drain_remaining_seconds())
+        except Exception as e:
+            print(f"⚠️ Drain hook failed: {e}")
+    print(f"✅ Drain complete in {time.monotonic() - _drain_state['started_at']:.1f}s")
+
+def install_drain_signal_handler() -> None:
+    """
+    SIGTERMのハンドラーを差し替え、ドレインしてからuvicornの終了処理を呼ぶ
+
+    uvicornは起動時に自前のSIGTERMハンドラーを設定するため、lifespanの開始時に
+    それを取得してラップする。メインスレッド以外（TestClientなど）では何もしない。
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+
+    loop = asyncio.get_running_loop()
+    original_handler = signal.getsignal(signal.SIGTERM)
+
+    async def drain_then_exit(sig: int) -> None:
+        await wait_for_in_flight_uploads()
+        if callable(original_handler):
+            original_handler(sig, None)
+        else:
+            signal.signal(signal.SIGTERM, original_handler)
+            signal.raise_signal(sig)
+
+    def handle_sigterm(sig, frame):
+        if _drain_state["draining"]:
+            return
+        begin_drain()
+        loop.call_soon_threadsafe(lambda: asyncio.ensure_future(drain_then_exit(sig)))
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+@app.middleware("http")
+async def drain_uploads_middleware(request: Request, call_next):
+    """ドレイン中は新規アップロードを503で断り、実行中のアップロード数を数える"""
+    if request.url.path != "/upload":
+        return await call_next(request)
+
+    if _drain_state["draining"]:
+        _drain_state["rejected_uploads"] += 1
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Server is shutting down. Please retry."},
+            headers={"Retry-After": str(DRAIN_RETRY_AFTER_SECONDS), "Connection": "close"}
+        )
+
+    _drain_state["in_flight_uploads"] += 1
+    try:
+        return await call_next(request)
+    finally:
+        _drain_state["in_flight_uploads"] -= 1
+
+def get_drain_stats() -> dict:
+    return {
+        "draining": _drain_state["draining"],
+        "in_flight_uploads": _drain_state["in_flight_uploads"],
+        "rejected_uploads": _drain_state["rejected_uploads"]
+    }
 
 # =========================================
-# デバイススキップ設定（夜間停止機能）
+# ローカルファーストのアップロードとS3への非同期レプリケーション
 # =========================================
-# 注意: これらは運用設定なので、環境変数ではなくコード内で管理する
-# 必要に応じて直接このファイルを編集してください
+# LOCAL_INGEST_DIR が設定されている場合、/upload は音声をローカルに永続化（fsync）して即座に応答し、
+# バックグラウンドのワーカーが S3 へ転送して audio_files.replication_status を "replicated" にする。
+#   {LOCAL_INGEST_DIR}/objects/{job_id}.bin  … 音声本体
+#   {LOCAL_INGEST_DIR}/queue/{job_id}.json   … 転送ジョブ（転送完了時に削除、再起動時に再投入）
+_replication_queue: "queue.Queue[Optional[dict]]" = queue.Queue()
+_replication_transfer_config = TransferConfig(
+    multipart_threshold=REPLICATION_MULTIPART_THRESHOLD,
+    multipart_chunksize=REPLICATION_MULTIPART_CHUNKSIZE
+)
+_replication_lock = threading.Lock()
+_replication_pending = {}  # job_id -> job（転送待ち・転送中・再投入待ち）
+_replication_requeue_timers = {}  # job_id -> threading.Timer（再投入待ち）
+_replication_state = {
+    "workers": [],
+    "in_flight": 0,
+    "replicated": 0,
+    "retries": 0,
+    "failed": 0,
+    "rejected_uploads": 0,
+    "last_lag_seconds": None
+}
 
-# スキップ機能を有効にするかどうか
-SKIP_ENABLED = True
+def _write_durably(path: str, content: bytes) -> None:
+    """一時ファイルに書き込んでfsyncしてから置き換える（途中で落ちても壊れたファイルを残さない）"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    directory = os.open(os.path.dirname(path), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
 
-# スキップ対象のデバイスID（複数指定可能）
-SKIP_DEVICE_IDS = [
-    '9f7d6e27-98c3-4c19-bdfb-f7fda58b9a93'  # 特定のオブザーバーデバイス
-]
+def _replication_paths(job_id: str) -> tuple[str, str]:
+    return (
+        os.path.join(LOCAL_INGEST_DIR, "objects", f"{job_id}.bin"),
+        os.path.join(LOCAL_INGEST_DIR, "queue", f"{job_id}.json")
+    )
 
-# スキップする時間帯（0-23の整数で指定）
-# 例：23,0,1,2,3,4,5 = 夜23時から朝5時台まで
-SKIP_HOURS = [23, 0, 1, 2, 3, 4, 5]
+def _pending_ingest_bytes() -> int:
+    # _replication_lock を保持して呼ぶこと
+    return sum(job["size_bytes"] for job in _replication_pending.values())
 
-# S3クライアントの初期化
-s3_client = None
-if AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY:
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION
-    )
+def get_local_ingest_bytes() -> int:
+    with _replication_lock:
+        return _pending_ingest_bytes()
 
-# Supabaseクライアントの初期化
-supabase_client: Optional[Client] = None
-if SUPABASE_URL and SUPABASE_KEY:
+def stage_local_object(s3_key: str, content: bytes, content_type: str, sha256: str,
+                       device_id: str, recorded_at: str, storage_class: Optional[str] = None) -> dict:
+    """
+    音声をローカルストアに永続化し、転送ジョブを作成する（キューへの投入は enqueue_replication）
+
+    Raises:
+        HTTPException: ローカルストアの容量上限を超える場合（503、端末に再送を促す）
+    """
+    job_id = f"{int(time.time() * 1000):013d}-{os.urandom(6).hex()}"
+    job = {
+        "job_id": job_id,
+        "s3_key": s3_key,
+        "content_type": content_type,
+        "storage_class": storage_class,
+        "sha256": sha256,
+        "size_bytes": len(content),
+        "device_id": device_id,
+        "recorded_at": recorded_at,
+        "enqueued_at": time.time(),
+        # S3への転送をアップロードと同じトレースに記録する
+        "traceparent": current_traceparent()
+    }
+
+    # 容量の確認と予約を同じロック内で行う（同時のアップロードがそれぞれ確認を通って上限を超えないように）
+    with _replication_lock:
+        if _pending_ingest_bytes() + len(content) > LOCAL_INGEST_MAX_BYTES:
+            _replication_state["rejected_uploads"] += 1
+            full = True
+        else:
+            _replication_pending[job_id] = job
+            full = False
+    if full:
+        print(f"⚠️ Local ingest store is full ({LOCAL_INGEST_MAX_BYTES} bytes): rejecting {s3_key}")
+        raise HTTPException(
+            status_code=503,
+            detail="Local ingest store is full. Please retry later.",
+            headers={"Retry-After": str(REPLICATION_RETRY_AFTER_SECONDS)}
+        )
+
+    object_path, job_path = _replication_paths(job_id)
     try:
-        supabase_client = create_client(SUPABASE_URL, SUPABASE_KEY)
-    except Exception as e:
-        print(f"⚠️ Supabase client initialization failed: {e}")
-        # テスト環境などでは継続可能にする
-        supabase_client = None
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        os.makedirs(os.path.dirname(job_path), exist_ok=True)
+        _write_durably(object_path, content)
+        _write_durably(job_path, json.dumps(job).encode('utf-8'))
+    except Exception:
+        discard_local_object(job)
+        raise
+    return job
 
-# =========================================
-# Audio Conversion Utility
-# =========================================
-def convert_m4a_to_wav(file_content: bytes, original_filename: str) -> tuple[bytes, str]:
+def store_audio_object(s3_key: str, content: bytes, content_type: str, sha256: str,
+                       device_id: str, recorded_at: str, storage_class: Optional[str] = None) -> Optional[dict]:
     """
-    Convert M4A audio to WAV format with WatchMe specifications.
+    音声オブジェクトを保存する
 
-    Args:
-        file_content: M4A file content
-        original_filename: Original filename (for logging)
+    ローカルファーストモードではローカルに永続化して転送ジョブを返し、
+    それ以外はS3へ同期的にPUTしてNoneを返す
+    """
+    if LOCAL_INGEST_DIR:
+        with start_span("local_ingest.stage", **{"s3.key": s3_key, "size_bytes": len(content)}):
+            return stage_local_object(s3_key, content, content_type, sha256, device_id, recorded_at, storage_class)
 
-    Returns:
-        tuple: (wav_content, content_type)
+    # ChecksumSHA256: S3側で受信内容を検証し、オブジェクトにチェックサムを保存する
+    put_params = {
+        "Bucket": S3_BUCKET_NAME,
+        "Key": s3_key,
+        "Body": content,
+        "ContentType": content_type,
+        "ChecksumSHA256": s3_checksum_sha256(sha256)
+    }
+    if storage_class:
+        put_params["StorageClass"] = storage_class
+    with start_span("s3.put_object", **{"s3.key": s3_key, "size_bytes": len(content)}) as span:
+        response = s3_client.put_object(**put_params)
+        # botocore が内部で行った再試行の回数
+        span.set_attribute("s3.retry_attempts", response.get("ResponseMetadata", {}).get("RetryAttempts", 0))
+    return None
 
-    Raises:
-        Exception: If conversion fails
+def discard_local_object(job: dict) -> None:
+    """転送前のジョブを破棄して予約した容量を解放する（メタデータ登録に失敗した場合など）"""
+    with _replication_lock:
+        _replication_pending.pop(job["job_id"], None)
+        timer = _replication_requeue_timers.pop(job["job_id"], None)
+    if timer is not None:
+        timer.cancel()
+    for path in _replication_paths(job["job_id"]):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def enqueue_replication(job: dict) -> None:
+    start_replicator()
+    _replication_queue.put(job)
+
+def _requeue_replication(job: dict) -> None:
+    with _replication_lock:
+        if _replication_requeue_timers.pop(job["job_id"], None) is None:
+            return
+    _replication_queue.put(job)
+
+def schedule_replication_retry(job: dict) -> float:
     """
-    print(f"🔄 Converting M4A to WAV: {original_filename}")
+    最大試行回数まで失敗したジョブを、指数バックオフ（上限 REPLICATION_REQUEUE_MAX_DELAY_SECONDS）の後にキューへ戻す
+
+    Returns:
+        float: 再投入までの秒数
+    """
+    with _replication_lock:
+        job["requeues"] = job.get("requeues", 0) + 1
+        delay = min(REPLICATION_REQUEUE_MAX_DELAY_SECONDS,
+                    REPLICATION_REQUEUE_BASE_SECONDS * 2 ** (job["requeues"] - 1))
+        timer = threading.Timer(delay, _requeue_replication, args=(job,))
+        timer.daemon = True
+        previous = _replication_requeue_timers.get(job["job_id"])
+        _replication_requeue_timers[job["job_id"]] = timer
+    if previous is not None:
+        previous.cancel()
+    timer.start()
+    return delay
+
+def replicate_job(job: dict) -> bool:
+    """ジョブを1件S3へ転送し、audio_filesを更新する（成功した場合True）"""
+    object_path, job_path = _replication_paths(job["job_id"])
+    if not os.path.exists(object_path):
+        # 音声本体が失われたジョブは転送できないため破棄する（audio_files は pending のまま突合で検出される）
+        print(f"❌ Local object missing, dropping replication job: {job['s3_key']}")
+        discard_local_object(job)
+        return False
+
+    extra_args = {"ContentType": job["content_type"], "ChecksumAlgorithm": "SHA256"}
+    if job.get("storage_class"):
+        extra_args["StorageClass"] = job["storage_class"]
+
+    for attempt in range(1, REPLICATION_MAX_ATTEMPTS + 1):
+        try:
+            # 閾値（単一PUTの上限）以下のファイルは PutObject 1回で転送される
+            with start_span("s3.upload_file", **{"s3.key": job["s3_key"], "attempt": attempt}):
+                s3_client.upload_file(
+                    object_path, S3_BUCKET_NAME, job["s3_key"],
+                    ExtraArgs=extra_args,
+                    Config=_replication_transfer_config
+                )
+            break
+        except Exception as e:
+            if attempt == REPLICATION_MAX_ATTEMPTS:
+                # ローカルのジョブと容量の予約は残し、待ってからキューに戻す
+                with _replication_lock:
+                    _replication_state["failed"] += 1
+                delay = schedule_replication_retry(job)
+                print(f"❌ Replication failed after {attempt} attempts, retrying in {delay:.0f}s: {job['s3_key']}: {e}")
+                return False
+            with _replication_lock:
+                _replication_state["retries"] += 1
+            print(f"⚠️ Replication attempt {attempt} failed for {job['s3_key']}: {e}")
+            time.sleep(REPLICATION_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+
+    if PEAKS_ON_INGEST:
+        try:
+            with open(object_path, "rb") as f:
+                store_peaks(job["s3_key"], f.read())
+        except Exception as e:
+            print(f"⚠️ Warning: Failed to generate peaks for {job['s3_key']}: {e}")
 
     try:
-        with tempfile.NamedTemporaryFile(suffix='.m4a', delete=False) as temp_m4a:
-            temp_m4a.write(file_content)
-            temp_m4a_path = temp_m4a.name
+        supabase_client.table("audio_files").update({
+            "replication_status": "replicated"
+        }).eq("device_id", job["device_id"]).eq("recorded_at", job["recorded_at"]).execute()
+    except Exception as e:
+        # オブジェクトはS3にあるため、ステータスは突合（reconcile_storage.py）で追跡できる
+        print(f"⚠️ Warning: Failed to mark {job['s3_key']} as replicated: {e}")
 
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_wav:
-            temp_wav_path = temp_wav.name
+    # S3に揃ってから日次マニフェスト・カバレッジを更新する（アップロードのリクエストではS3に書き込まない）
+    if job.get("local_date"):
+        update_day_indexes(job["device_id"], job["local_date"], job.get("time_block"), job.get("manifest_entry"))
+        invalidate_response_cache(job["device_id"], job["local_date"])
 
-        audio = AudioSegment.from_file(temp_m4a_path, format='m4a')
+    # S3に揃ってから処理開始イベントを発行する（ジョブ再投入時は再送される）
+    try:
+        publish_event(job.get("event"))
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to publish ready event for {job['s3_key']}: {e}")
 
-        # Convert to WatchMe specifications: 16kHz, mono, 16-bit
-        audio = audio.set_frame_rate(16000)
-        audio = audio.set_channels(1)
-        audio = audio.set_sample_width(2)  # 2 bytes = 16-bit
+    os.remove(job_path)
+    os.remove(object_path)
+    with _replication_lock:
+        _replication_pending.pop(job["job_id"], None)
+        _replication_state["replicated"] += 1
+        _replication_state["last_lag_seconds"] = round(time.time() - job["enqueued_at"], 3)
+    return True
 
-        audio.export(temp_wav_path, format='wav')
+def _replication_worker() -> None:
+    while True:
+        job = _replication_queue.get()
+        if job is None:
+            return
+        with _replication_lock:
+            _replication_state["in_flight"] += 1
+        span = start_trace("replication.job", job.get("traceparent"), **{"s3.key": job.get("s3_key")})
+        try:
+            span.set_attribute("replicated", replicate_job(job))
+            end_span(span)
+        except Exception as e:
+            end_span(span, e)
+            print(f"❌ Replication worker error for {job.get('s3_key')}: {e}")
+        finally:
+            with _replication_lock:
+                _replication_state["in_flight"] -= 1
 
-        with open(temp_wav_path, 'rb') as f:
-            wav_content = f.read()
+def start_replicator() -> None:
+    """レプリケーションのワーカーを起動し、ローカルに残っているジョブを再投入する（1回のみ）"""
+    with _replication_lock:
+        if _replication_state["workers"] or not LOCAL_INGEST_DIR:
+            return
+        queue_dir = os.path.join(LOCAL_INGEST_DIR, "queue")
+        recovered = []
+        if os.path.isdir(queue_dir):
+            for name in sorted(os.listdir(queue_dir)):
+                if not name.endswith(".json"):
+                    continue
+                with open(os.path.join(queue_dir, name), encoding="utf-8") as f:
+                    job = json.load(f)
+                # このプロセスで作成済みのジョブは作成元が enqueue_replication で投入する
+                if job["job_id"] in _replication_pending:
+                    continue
+                _replication_pending[job["job_id"]] = job
+                recovered.append(job)
+        for _ in range(REPLICATION_CONCURRENCY):
+            worker = threading.Thread(target=_replication_worker, name="s3-replicator", daemon=True)
+            worker.start()
+            _replication_state["workers"].append(worker)
 
-        os.unlink(temp_m4a_path)
-        os.unlink(temp_wav_path)
+    for job in recovered:
+        _replication_queue.put(job)
+    print(f"🔁 Replicator started ({REPLICATION_CONCURRENCY} workers, {len(recovered)} pending jobs recovered)")
 
-        print(f"✅ Conversion successful: M4A ({len(file_content)} bytes) -> WAV ({len(wav_content)} bytes)")
+def flush_replication(timeout: float) -> bool:
+    """
+    転送待ちのジョブがなくなるまで待つ（ドレイン時に使用、残りは次回起動時に転送）
 
-        return wav_content, 'audio/wav'
+    再投入待ちのジョブも完了していないものとして待つ
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with _replication_lock:
+            if _replication_state["in_flight"] == 0 and not _replication_pending:
+                return True
+        time.sleep(0.05)
+    print(f"⚠️ Replication flush timed out: {len(_replication_pending)} jobs remain on local disk")
+    return False
+
+def shutdown_replicator(timeout: float) -> None:
+    """転送待ちのジョブを期限まで転送してからワーカーを停止する"""
+    flush_replication(timeout)
+    with _replication_lock:
+        workers, _replication_state["workers"] = _replication_state["workers"], []
+        timers = list(_replication_requeue_timers.values())
+        _replication_requeue_timers.clear()
+    for timer in timers:
+        timer.cancel()
+    for _ in workers:
+        _replication_queue.put(None)
+    for worker in workers:
+        worker.join(timeout=1.0)
+
+register_drain_hook(shutdown_replicator)
+
+def get_replication_stats() -> dict:
+    with _replication_lock:
+        pending_bytes = sum(job["size_bytes"] for job in _replication_pending.values())
+        oldest = min((job["enqueued_at"] for job in _replication_pending.values()), default=None)
+        return {
+            "enabled": bool(LOCAL_INGEST_DIR),
+            "queue_depth": len(_replication_pending) - len(_replication_requeue_timers),
+            "awaiting_retry": len(_replication_requeue_timers),
+            "in_flight": _replication_state["in_flight"],
+            "pending_bytes": pending_bytes,
+            "capacity_bytes": LOCAL_INGEST_MAX_BYTES,
+            "capacity_used_ratio": round(pending_bytes / LOCAL_INGEST_MAX_BYTES, 4) if LOCAL_INGEST_MAX_BYTES else None,
+            "replicated": _replication_state["replicated"],
+            "retries": _replication_state["retries"],
+            "failed": _replication_state["failed"],
+            "rejected_uploads": _replication_state["rejected_uploads"],
+            "oldest_pending_age_seconds": round(time.time() - oldest, 3) if oldest is not None else None,
+            "last_lag_seconds": _replication_state["last_lag_seconds"]
+        }
+
+# =========================================
+# 処理開始イベント（file ready）の発行
+# =========================================
+# S3のPUTイベントの代わりに、vaultが計算済みのメタデータ（local_date, status, duration など）を
+# 載せたイベントを下流のワーカーへ通知する。イベントはデバイスごとに1メッセージへまとめ、
+# 複数メッセージを1回の送信でバッチ配送する。配送は at-least-once（失敗時は再送し、破棄しない）
+# なので、受信側は event_id（device_id/recorded_at）で重複を除外すること。
+class SQSNotifier:
+    """SQS（互換）キューへ send_message_batch で送信する"""
+
+    def __init__(self, queue_url: str, client=None):
+        self.queue_url = queue_url
+        self.client = client or boto3.client(
+            'sqs',
+            aws_access_key_id=AWS_ACCESS_KEY_ID,
+            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+            region_name=AWS_REGION
+        )
+        self.fifo = queue_url.endswith(".fifo")
+
+    def send(self, messages: list[dict]) -> list[dict]:
+        """メッセージを送信し、送信に失敗したメッセージを返す"""
+        entries = []
+        for i, message in enumerate(messages):
+            entry = {"Id": str(i), "MessageBody": json.dumps(message, ensure_ascii=False)}
+            if self.fifo:
+                # FIFOキューではデバイス単位で順序を保証する
+                entry["MessageGroupId"] = message["device_id"]
+                entry["MessageDeduplicationId"] = message["message_id"]
+            entries.append(entry)
+        response = self.client.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+        return [messages[int(failed["Id"])] for failed in response.get("Failed", [])]
+
+
+class WebhookNotifier:
+    """Webhookへ {"messages": [...]} をPOSTする（2xx以外は全件を再送対象にする）"""
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, messages: list[dict]) -> list[dict]:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"messages": messages}, ensure_ascii=False).encode('utf-8'),
+            headers={"Content-Type": "application/json"},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                if 200 <= response.status < 300:
+                    return []
+        except OSError as e:
+            print(f"⚠️ Webhook delivery failed: {e}")
+        return messages
+
+
+class LocalQueueNotifier:
+    """プロセス内のキューに積む（開発・テスト用のスタンドイン）"""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+
+    def send(self, messages: list[dict]) -> list[dict]:
+        for message in messages:
+            self.queue.put(message)
+        return []
+
+
+def create_notifier():
+    """EVENT_NOTIFIER の設定からNotifierを作成する（未設定時はNone = イベントを発行しない）"""
+    if EVENT_NOTIFIER == "sqs":
+        if not EVENT_SQS_QUEUE_URL:
+            print("⚠️ EVENT_NOTIFIER=sqs but EVENT_SQS_QUEUE_URL is not set: events disabled")
+            return None
+        return SQSNotifier(EVENT_SQS_QUEUE_URL)
+    if EVENT_NOTIFIER == "webhook":
+        if not EVENT_WEBHOOK_URL:
+            print("⚠️ EVENT_NOTIFIER=webhook but EVENT_WEBHOOK_URL is not set: events disabled")
+            return None
+        return WebhookNotifier(EVENT_WEBHOOK_URL)
+    if EVENT_NOTIFIER == "local":
+        return LocalQueueNotifier()
+    if EVENT_NOTIFIER:
+        print(f"⚠️ Unknown EVENT_NOTIFIER: {EVENT_NOTIFIER}: events disabled")
+    return None
+
+
+event_notifier = create_notifier()
+
+_event_lock = threading.Condition()
+_event_buffer = []   # 未送信のイベント（到着順、再送分は先頭に戻す）
+_event_state = {
+    "worker": None,
+    "published": 0,
+    "messages": 0,
+    "batches": 0,
+    "failed_attempts": 0,
+    "last_delivery_lag_seconds": None
+}
+
+def build_ready_event(audio_file_data: dict, time_block: str, duration_seconds: Optional[float],
+                      stored: bool, skip_policy: str) -> dict:
+    """audio_filesに登録した内容から file ready イベントを作成する"""
+    return {
+        # 同じ録音をオフセット違いで送り直しても同じ event_id になるよう、UTCに揃える
+        "event_id": f"{audio_file_data['device_id']}/{normalize_recorded_at(audio_file_data['recorded_at'])}",
+        "type": "audio_file.ready",
+        "device_id": audio_file_data["device_id"],
+        "recorded_at": audio_file_data["recorded_at"],
+        "local_date": audio_file_data["local_date"],
+        "local_time": audio_file_data["local_time"],
+        "time_block": time_block,
+        "file_path": audio_file_data["file_path"],
+        "stored": stored,
+        "size_bytes": audio_file_data["file_size_bytes"],
+        "sha256": audio_file_data["sha256"],
+        "duration_seconds": duration_seconds,
+        "status": audio_file_data["transcriptions_status"],
+        "skip_policy": skip_policy,
+        "created_at": datetime.now(pytz.UTC).isoformat()
+    }
 
+def _event_created_timestamp(event: dict) -> float:
+    """イベントの created_at（ISO 8601、旧い送信待ちファイルはエポック秒）をエポック秒で返す"""
+    created_at = event["created_at"]
+    if isinstance(created_at, (int, float)):
+        return float(created_at)
+    return date_parser.isoparse(created_at).timestamp()
+
+def _event_outbox_path(event_id: str) -> str:
+    return os.path.join(EVENT_OUTBOX_DIR, f"{hashlib.sha256(event_id.encode('utf-8')).hexdigest()}.json")
+
+def publish_event(event: Optional[dict]) -> None:
+    """イベントを送信バッファに追加する（送信はバックグラウンドでまとめて行う）"""
+    if event is None or event_notifier is None:
+        return
+    if event["status"] == "skipped" and not EVENT_PUBLISH_SKIPPED:
+        return
+    if EVENT_OUTBOX_DIR:
+        # 送信前にプロセスが落ちても、次回起動時に再送できるようにする
+        os.makedirs(EVENT_OUTBOX_DIR, exist_ok=True)
+        _write_durably(_event_outbox_path(event["event_id"]), json.dumps(event).encode('utf-8'))
+    start_event_publisher()
+    with _event_lock:
+        _event_buffer.append({**event, "queued_at": time.monotonic()})
+        _event_lock.notify()
+
+def coalesce_events(events: list[dict]) -> list[dict]:
+    """イベントをデバイスごとのメッセージ（最大 EVENT_MESSAGE_MAX_EVENTS 件）にまとめる"""
+    by_device = OrderedDict()
+    for event in events:
+        by_device.setdefault(event["device_id"], []).append(event)
+
+    messages = []
+    for device_id, device_events in by_device.items():
+        for start in range(0, len(device_events), EVENT_MESSAGE_MAX_EVENTS):
+            chunk = device_events[start:start + EVENT_MESSAGE_MAX_EVENTS]
+            event_ids = "|".join(e["event_id"] for e in chunk)
+            messages.append({
+                "message_id": hashlib.sha256(event_ids.encode('utf-8')).hexdigest()[:32],
+                "device_id": device_id,
+                "events": [{k: v for k, v in e.items() if k != "queued_at"} for e in chunk]
+            })
+    return messages
+
+def deliver_events(events: list[dict]) -> list[dict]:
+    """イベントをまとめて送信し、再送が必要なイベントを返す"""
+    messages = coalesce_events(events)
+    failed_ids = set()
+    for start in range(0, len(messages), EVENT_SEND_BATCH_MESSAGES):
+        batch = messages[start:start + EVENT_SEND_BATCH_MESSAGES]
+        try:
+            failed = event_notifier.send(batch)
+        except Exception as e:
+            print(f"⚠️ Event delivery failed: {e}")
+            failed = batch
+        for message in failed:
+            failed_ids.update(e["event_id"] for e in message["events"])
+        with _event_lock:
+            _event_state["batches"] += 1
+            _event_state["messages"] += len(batch) - len(failed)
+
+    delivered = [e for e in events if e["event_id"] not in failed_ids]
+    if EVENT_OUTBOX_DIR:
+        for event in delivered:
+            try:
+                os.remove(_event_outbox_path(event["event_id"]))
+            except FileNotFoundError:
+                pass
+    with _event_lock:
+        _event_state["published"] += len(delivered)
+        if delivered:
+            _event_state["last_delivery_lag_seconds"] = round(time.time() - min(_event_created_timestamp(e) for e in delivered), 3)
+        if failed_ids:
+            _event_state["failed_attempts"] += 1
+    return [e for e in events if e["event_id"] in failed_ids]
+
+def _event_publisher_worker() -> None:
+    me = threading.current_thread()
+    failures = 0
+    while True:
+        with _event_lock:
+            while not _event_buffer and _event_state["worker"] is me:
+                _event_lock.wait()
+            # 最初のイベントから最大 EVENT_BATCH_MAX_WAIT_SECONDS 待ち、まとめて送る
+            while _event_state["worker"] is me and len(_event_buffer) < EVENT_BATCH_MAX_EVENTS:
+                remaining = _event_buffer[0]["queued_at"] + EVENT_BATCH_MAX_WAIT_SECONDS - time.monotonic()
+                if remaining <= 0:
+                    break
+                _event_lock.wait(remaining)
+            if _event_state["worker"] is not me:
+                return
+            events = _event_buffer[:]
+            _event_buffer.clear()
+
+        retry = deliver_events(events)
+        if not retry:
+            failures = 0
+            continue
+        with _event_lock:
+            # 順序を保つため、再送分は後続のイベントより前に戻す
+            _event_buffer[:0] = retry
+        failures += 1
+        time.sleep(min(EVENT_RETRY_BASE_SECONDS * 2 ** (failures - 1), EVENT_RETRY_MAX_SECONDS))
+
+def start_event_publisher() -> None:
+    """イベント送信スレッドを起動し、アウトボックスに残っているイベントを再投入する（1回のみ）"""
+    with _event_lock:
+        if _event_state["worker"] is not None or event_notifier is None:
+            return
+        recovered = []
+        if EVENT_OUTBOX_DIR and os.path.isdir(EVENT_OUTBOX_DIR):
+            for name in os.listdir(EVENT_OUTBOX_DIR):
+                if not name.endswith(".json"):
+                    continue
+                with open(os.path.join(EVENT_OUTBOX_DIR, name), encoding="utf-8") as f:
+                    recovered.append({**json.load(f), "queued_at": time.monotonic()})
+            recovered.sort(key=_event_created_timestamp)
+            _event_buffer[:0] = recovered
+        worker = threading.Thread(target=_event_publisher_worker, name="event-publisher", daemon=True)
+        _event_state["worker"] = worker
+    worker.start()
+    print(f"📣 Event publisher started ({type(event_notifier).__name__}, {len(recovered)} pending events recovered)")
+
+def flush_events(timeout: float) -> bool:
+    """送信スレッドを止め、未送信のイベントを期限まで送信する（ドレイン時に使用）"""
+    deadline = time.monotonic() + timeout
+    with _event_lock:
+        worker, _event_state["worker"] = _event_state["worker"], None
+        _event_lock.notify_all()
+    if worker is not None:
+        worker.join(timeout=max(deadline - time.monotonic(), 0))
+
+    while True:
+        with _event_lock:
+            events = _event_buffer[:]
+            _event_buffer.clear()
+        if not events:
+            return True
+        retry = deliver_events(events)
+        with _event_lock:
+            _event_buffer[:0] = retry
+        if retry and time.monotonic() + EVENT_RETRY_BASE_SECONDS >= deadline:
+            break
+        if retry:
+            time.sleep(EVENT_RETRY_BASE_SECONDS)
+    # アウトボックスを使っている場合は次回起動時に再送される
+    print(f"⚠️ Event flush timed out: {len(_event_buffer)} events were not delivered")
+    return False
+
+# レプリケーター（転送完了時にイベントを発行する）の後にフラッシュする
+register_drain_hook(flush_events)
+
+def get_event_stats() -> dict:
+    with _event_lock:
+        oldest = min((_event_created_timestamp(e) for e in _event_buffer), default=None)
+        return {
+            "notifier": type(event_notifier).__name__ if event_notifier else None,
+            "pending": len(_event_buffer),
+            "published": _event_state["published"],
+            "messages": _event_state["messages"],
+            "batches": _event_state["batches"],
+            "failed_attempts": _event_state["failed_attempts"],
+            "oldest_pending_age_seconds": round(time.time() - oldest, 3) if oldest is not None else None,
+            "last_delivery_lag_seconds": _event_state["last_delivery_lag_seconds"]
+        }
+
+# =========================================
+# 分散トレーシング（スパンの記録・出力）
+# =========================================
+# OpenTelemetry と同じ形式（trace_id / span_id / parent_span_id）のスパンを記録する。
+# リクエストごとにルートスパンを作成し、X-Trace-Id と traceparent（W3C Trace Context）を
+# レスポンスヘッダーで返す。サンプリングされなかったリクエストでは子スパンは何もしない。
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "start_ns", "end_ns",
+                 "attributes", "status", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, parent_span_id: Optional[str], name: str,
+                 attributes: dict, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = "OK"
+        self.sampled = sampled
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "status": self.status,
+            "attributes": self.attributes
+        }
+
+
+class _NoopSpan:
+    """サンプリングされなかったトレースの子スパン（何も記録しない）"""
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class InMemorySpanExporter:
+    """直近のスパンをメモリに保持する（オフラインでの調査・テスト用）"""
+
+    def __init__(self, max_spans: int = TRACE_MEMORY_MAX_SPANS):
+        self.spans = deque(maxlen=max_spans)
+
+    def export(self, span: dict) -> None:
+        self.spans.append(span)
+
+    def get_trace(self, trace_id: str) -> list[dict]:
+        return sorted((s for s in list(self.spans) if s["trace_id"] == trace_id),
+                      key=lambda s: s["start_time_unix_nano"])
+
+
+class FileSpanExporter:
+    """スパンをJSON Lines形式でファイルに追記する"""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def export(self, span: dict) -> None:
+        line = json.dumps(span, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+
+def create_span_exporter():
+    """TRACE_EXPORTER の設定からエクスポーターを作成する（未設定時はNone = 記録しない）"""
+    if TRACE_EXPORTER == "memory":
+        return InMemorySpanExporter()
+    if TRACE_EXPORTER == "file":
+        try:
+            return FileSpanExporter(TRACE_FILE_PATH)
+        except OSError as e:
+            print(f"⚠️ Failed to open trace file {TRACE_FILE_PATH}: {e}: tracing disabled")
+            return None
+    if TRACE_EXPORTER:
+        print(f"⚠️ Unknown TRACE_EXPORTER: {TRACE_EXPORTER}: tracing disabled")
+    return None
+
+
+span_exporter = create_span_exporter()
+
+_trace_lock = threading.Lock()
+_trace_stats = {"traces": 0, "sampled_traces": 0, "exported_spans": 0, "export_errors": 0}
+
+def parse_traceparent(header: Optional[str]) -> Optional[tuple[str, str, bool]]:
+    """traceparent ヘッダーから (trace_id, parent_span_id, sampled) を取り出す"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32:
+        return None
+    return parts[1].lower(), parts[2].lower(), bool(flags & 1)
+
+def start_trace(name: str, traceparent: Optional[str] = None, **attributes) -> Span:
+    """ルートスパン（またはリモートの親を持つスパン）を開始し、現在のスパンにする"""
+    parent = parse_traceparent(traceparent)
+    if parent is not None:
+        trace_id, parent_span_id, sampled = parent
+    else:
+        trace_id, parent_span_id = os.urandom(16).hex(), None
+        sampled = random.random() < TRACE_SAMPLE_RATE
+    span = Span(trace_id, os.urandom(8).hex(), parent_span_id, name, attributes,
+                sampled and span_exporter is not None)
+    with _trace_lock:
+        _trace_stats["traces"] += 1
+        _trace_stats["sampled_traces"] += int(span.sampled)
+    _current_span.set(span)
+    return span
+
+def end_span(span, error: Optional[BaseException] = None) -> None:
+    """スパンを終了してエクスポーターに渡す（サンプリングされていない場合は何もしない）"""
+    if not isinstance(span, Span) or not span.sampled:
+        return
+    span.end_ns = time.time_ns()
+    if error is not None:
+        span.status = "ERROR"
+        span.attributes["error"] = f"{type(error).__name__}: {error}"
+    exporter = span_exporter
+    if exporter is None:
+        return
+    try:
+        exporter.export(span.to_dict())
+        with _trace_lock:
+            _trace_stats["exported_spans"] += 1
     except Exception as e:
-        print(f"❌ M4A to WAV conversion failed: {str(e)}")
-        raise Exception(f"Audio conversion failed: {str(e)}")
+        with _trace_lock:
+            _trace_stats["export_errors"] += 1
+        print(f"⚠️ Span export failed: {e}")
+
+@contextmanager
+def start_span(name: str, **attributes):
+    """現在のスパンの子スパンを記録する（サンプリングされていない場合は何もしない）"""
+    parent = _current_span.get()
+    if parent is None or not parent.sampled:
+        yield _NOOP_SPAN
+        return
+
+    span = Span(parent.trace_id, os.urandom(8).hex(), parent.span_id, name, attributes, True)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        _current_span.reset(token)
+        end_span(span, e)
+        raise
+    _current_span.reset(token)
+    end_span(span)
+
+def record_span(name: str, start_ns: int, **attributes) -> None:
+    """開始時刻を指定して、現在までの子スパンを記録する（フレームワーク内の処理時間の記録用）"""
+    parent = _current_span.get()
+    if parent is None or not parent.sampled:
+        return
+    span = Span(parent.trace_id, os.urandom(8).hex(), parent.span_id, name, attributes, True)
+    span.start_ns = start_ns
+    end_span(span)
+
+def current_traceparent() -> Optional[str]:
+    """現在のスパンの traceparent（バックグラウンド処理にトレースを引き継ぐ場合に使用）"""
+    span = _current_span.get()
+    return span.traceparent if isinstance(span, Span) else None
+
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    """リクエストごとにルートスパンを作成し、トレースIDをレスポンスヘッダーで返す"""
+    span = start_trace(
+        f"{request.method} {request.url.path}",
+        request.headers.get("traceparent"),
+        **{"http.method": request.method, "http.target": request.url.path}
+    )
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        end_span(span, e)
+        raise
+    span.set_attribute("http.status_code", response.status_code)
+    if response.status_code >= 500:
+        span.status = "ERROR"
+    end_span(span)
+    response.headers["X-Trace-Id"] = span.trace_id
+    response.headers["traceparent"] = span.traceparent
+    return response
+
+def get_tracing_stats() -> dict:
+    with _trace_lock:
+        return {
+            "exporter": type(span_exporter).__name__ if span_exporter else None,
+            "sample_rate": TRACE_SAMPLE_RATE,
+            **_trace_stats
+        }
+
+# =========================================
+# 本番診断（サンプリングプロファイラー・tracemalloc）
+# =========================================
+_profile_lock = threading.Lock()
+_tracemalloc_state = {"baseline": None}
+
+def require_admin(request: Request) -> None:
+    """管理者トークン（X-Admin-Token ヘッダー）を検証する"""
+    # トークン未設定の環境では管理用エンドポイントを公開しない（存在自体を返さない）
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("x-admin-token") or ""
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def sample_stacks(seconds: float, interval: float) -> tuple[Counter, int]:
+    """
+    全スレッドのスタックを一定間隔でサンプリングし、折り畳みスタックごとの件数を返す
+
+    sys._current_frames() を読むだけなので、対象スレッドを止めずに計測できる。
+    戻り値の各キーは "root;caller;callee" 形式（flamegraph.pl / speedscope 互換）。
+    """
+    own_thread_id = threading.get_ident()
+    stacks = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_thread_id:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            stacks[";".join(reversed(labels))] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+def tracemalloc_top(limit: int, group_by: str, diff: bool) -> list[dict]:
+    """
+    tracemallocのスナップショットを取り、確保量の多い箇所を返す
+
+    diff=True の場合は前回のスナップショットとの差分を返す。
+    取得したスナップショットは次回の差分の基準として保持する。
+    """
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    ))
+    baseline = _tracemalloc_state["baseline"]
+    _tracemalloc_state["baseline"] = snapshot
+
+    if diff and baseline is not None:
+        stats = snapshot.compare_to(baseline, group_by)
+    else:
+        stats = snapshot.statistics(group_by)
+
+    top = []
+    for stat in stats[:limit]:
+        entry = {
+            "traceback": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+            "size_bytes": stat.size,
+            "count": stat.count
+        }
+        if isinstance(stat, tracemalloc.StatisticDiff):
+            entry["size_diff_bytes"] = stat.size_diff
+            entry["count_diff"] = stat.count_diff
+        top.append(entry)
+    return top
 
 # =========================================
 # ヘルスチェックエンドポイント
@@ -149,19 +3061,38 @@ def convert_m4a_to_wav(file_content: bytes, original_filename: str) -> tuple[byt
 @app.get("/health")
 async def health_check():
     """APIの死活監視用エンドポイント"""
-    status = {
-        "status": "healthy",
-        "timestamp": datetime.now(pytz.UTC).isoformat(),
-        "s3_configured": s3_client is not None,
-        "supabase_configured": supabase_client is not None
-    }
-    return JSONResponse(content=status)
+    return FastJSONResponse(HealthResponse(
+        status="draining" if _drain_state["draining"] else "healthy",
+        timestamp=datetime.now(pytz.UTC),
+        s3_configured=s3_client is not None,
+        supabase_configured=supabase_client is not None
+    ))
 
 @app.get("/status")
 async def status():
     """APIステータス確認用エンドポイント（/healthのエイリアス）"""
     return await health_check()
 
+@app.get("/ready")
+async def readiness_check():
+    """新規アップロードを受け付け可能か（ドレイン中は503）"""
+    if _drain_state["draining"]:
+        return FastJSONResponse(status_code=503, content={"ready": False, **get_drain_stats()})
+    return {"ready": True, **get_drain_stats()}
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """キャッシュなどの内部メトリクスを取得（運用監視用）"""
+    return FastJSONResponse(MetricsResponse(
+        timestamp=datetime.now(pytz.UTC),
+        response_cache=get_response_cache_stats(),
+        drain=get_drain_stats(),
+        replication=get_replication_stats(),
+        events=get_event_stats(),
+        tracing=get_tracing_stats(),
+        storage_restore=get_storage_restore_stats()
+    ))
+
 # =========================================
 # メインアップロードエンドポイント
 # =========================================
@@ -178,6 +3109,10 @@ async def upload_file(
     - metadata: JSON形式のメタデータ（device_id, recorded_atを含む）
     - file: WAVファイル
     """
+    # リクエスト受信からここまで（本体の受信とmultipartの解析）をスパンとして記録する
+    request_span = _current_span.get()
+    if request_span is not None:
+        record_span("upload.receive_multipart", request_span.start_ns)
     
     # S3クライアントの確認
     if not s3_client:
@@ -243,10 +3178,11 @@ async def upload_file(
             detail=f"Invalid recorded_at format. Expected ISO 8601: {str(e)}"
         )
     
-    # S3 path generation using UTC timestamp
-    # Example: "2025-11-11T14:15:32+00:00" -> "files/.../2025-11-11/14-15-32/audio.wav"
+    # S3 path generation using the recorded_at components as sent (not converted to UTC)
+    # Example: "2025-11-11T14:15:32+09:00" -> "files/.../2025-11-11/14-15-32/audio.wav"
+    # reconcile_storage.py parses these components in the device timezone
 
-    # Extract date and time components from recorded_at (UTC)
+    # Extract date and time components from recorded_at (client offset)
     year = recorded_at.year
     month = recorded_at.month
     day = recorded_at.day
@@ -261,7 +3197,7 @@ async def upload_file(
     # Example: 14:15:32 -> "14-15-32"
     time_str = f"{hour:02d}-{minute:02d}-{second:02d}"
 
-    print(f"📊 S3 path generation (UTC timestamp):")
+    print(f"📊 S3 path generation (recorded_at components):")
     print(f"   Input: {recorded_at_str}")
     print(f"   Date: {date}, Time: {time_str}")
 
@@ -270,66 +3206,65 @@ async def upload_file(
     s3_key = f"files/{device_id}/{date}/{time_str}/audio.wav"
     
     try:
-        # ファイルサイズ制限チェック（100MB）
-        file_content = await file.read()
-        file_size = len(file_content)
+        # ファイルサイズ制限チェック（100MB）とSHA-256の計算（読み込みと同時に実行）
+        with start_span("upload.read") as span:
+            file_content, upload_sha256 = await read_upload_with_checksum(file)
+            file_size = len(file_content)
+            span.set_attribute("size_bytes", file_size)
 
-        if file_size > 100 * 1024 * 1024:  # 100MB
+        # クライアントがチェックサムを送信している場合は受信内容を検証する
+        expected_sha256 = metadata_dict.get("sha256")
+        if expected_sha256 and expected_sha256.lower() != upload_sha256:
             raise HTTPException(
-                status_code=413,
-                detail="File size exceeds limit (100MB)"
+                status_code=400,
+                detail=f"Checksum mismatch: expected sha256={expected_sha256}, received sha256={upload_sha256}"
             )
 
+        # 保存するコンテンツのSHA-256（変換しない場合は受信時の値をそのまま使う）
+        content_sha256 = upload_sha256
+
         # Determine file format and convert if necessary
         filename = file.filename or "unknown"
         file_extension = filename.lower().split('.')[-1]
 
         if file_extension == 'm4a':
             print(f"📊 M4A file detected: {filename}")
-            file_content, content_type = convert_m4a_to_wav(file_content, filename)
-        elif file_extension == 'wav':
-            print(f"📊 WAV file detected: {filename}")
-            content_type = 'audio/wav'
+            with start_span("upload.convert", format="m4a"):
+                file_content, content_type = await run_in_threadpool(convert_m4a_to_wav, file_content, filename)
+                content_sha256 = await run_in_threadpool(lambda: hashlib.sha256(file_content).hexdigest())
         else:
-            print(f"⚠️ Unknown file format: {file_extension}, assuming WAV")
+            if file_extension == 'wav':
+                print(f"📊 WAV file detected: {filename}")
+            else:
+                print(f"⚠️ Unknown file format: {file_extension}, assuming WAV")
             content_type = 'audio/wav'
 
-        # S3へアップロード
-        s3_client.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=s3_key,
-            Body=file_content,
-            ContentType=content_type
-        )
-        
+            # 16kHz / mono / 16-bit 以外のWAVは仕様に揃える（仕様どおりならそのまま）
+            if WAV_NORMALIZE_ON_INGEST:
+                # リサンプリングはCPUを使うため、イベントループを止めないようスレッドプールで実行する
+                with start_span("upload.convert", format="wav") as span:
+                    try:
+                        file_content, converted = await run_in_threadpool(normalize_wav, file_content)
+                    except (ValueError, struct.error) as e:
+                        print(f"⚠️ WAV normalization skipped for {filename}: {e}")
+                        converted = False
+                    if converted:
+                        content_sha256 = await run_in_threadpool(lambda: hashlib.sha256(file_content).hexdigest())
+                    span.set_attribute("converted", converted)
+
         # recorded_atは既にmetadataから取得済み
 
         # Get device timezone to calculate local_date and local_time
         try:
-            device_result = supabase_client.table("devices").select("timezone").eq(
-                "device_id", device_id
-            ).execute()
-
-            if not device_result.data or len(device_result.data) == 0:
-                print(f"⚠️ Warning: Device {device_id} not found in devices table, using UTC")
-                device_timezone_str = "UTC"
-            else:
-                device_timezone_str = device_result.data[0].get("timezone")
-                if not device_timezone_str:
-                    print(f"⚠️ Warning: Device {device_id} has no timezone set, using UTC")
-                    device_timezone_str = "UTC"
+            with start_span("upload.device_lookup", device_id=device_id):
+                device_timezone_str = get_device_timezone(device_id)
 
             # Convert recorded_at to device timezone and extract local_date and local_time
-            device_tz = pytz.timezone(device_timezone_str)
-            local_dt = recorded_at.astimezone(device_tz)
-            local_date = local_dt.strftime('%Y-%m-%d')
-            # local_time is timestamp without time zone - remove timezone info
-            local_time = local_dt.replace(tzinfo=None)
+            local_date, local_time = calculate_local_datetime(recorded_at, device_timezone_str)
 
             print(f"📊 Local date/time calculation:")
             print(f"   UTC: {recorded_at}")
             print(f"   Timezone: {device_timezone_str}")
-            print(f"   Local: {local_dt}")
             print(f"   local_date: {local_date}")
             print(f"   local_time: {local_time}")
 
@@ -339,40 +3274,151 @@ async def upload_file(
             # Raise error instead of silent UTC fallback
             raise ValueError(f"Failed to calculate local_date/local_time for device {device_id}: {e}")
 
+        # SKIP判定（デバイスのローカル時刻で判定）
+        time_block = calculate_time_block(local_time)
+        initial_status = determine_initial_status(device_id, time_block)
+
+        skip_policy = "store"
+        if initial_status == "skipped":
+            skip_policy = SKIP_STORAGE_POLICY if SKIP_STORAGE_POLICY in SKIP_STORAGE_POLICIES else "store"
+            print(f"⏭️ SKIP storage policy: {skip_policy}")
+
+        # S3へアップロード（スキップ時はポリシーに従う）
+        # ローカルファーストモードではローカルに永続化し、S3へは登録後に非同期で転送する
+        stored = True
+        staged_job = None
+        # S3へのPUT・ローカルへのfsync・波形やプレビューの計算はイベントループを止めないようスレッドプールで実行する
+        if skip_policy == "store":
+            staged_job = await run_in_threadpool(store_audio_object, s3_key, file_content, content_type, content_sha256,
+                                                 device_id, recorded_at.isoformat())
+        elif skip_policy == "cold":
+            s3_key = f"{SKIP_STORAGE_PREFIX}/{device_id}/{date}/{time_str}/audio.wav"
+            staged_job = await run_in_threadpool(store_audio_object, s3_key, file_content, content_type, content_sha256,
+                                                 device_id, recorded_at.isoformat(), storage_class=SKIP_STORAGE_CLASS)
+        elif skip_policy == "preview":
+            s3_key = f"{SKIP_STORAGE_PREFIX}/{device_id}/{date}/{time_str}/preview.wav"
+            file_content = await run_in_threadpool(create_preview_wav, file_content)
+            content_sha256 = await run_in_threadpool(lambda: hashlib.sha256(file_content).hexdigest())
+            staged_job = await run_in_threadpool(store_audio_object, s3_key, file_content, content_type, content_sha256,
+                                                 device_id, recorded_at.isoformat())
+        else:
+            # discard: 音声は保存しない（file_pathは保存されなかったことが分かるキーを記録）
+            s3_key = f"{SKIP_DISCARD_PREFIX}/{device_id}/{date}/{time_str}/audio.wav"
+            stored = False
+
+        if stored:
+            invalidate_stream_cache(s3_key)
+            invalidate_peaks_cache(s3_key)
+
+            # 波形サマリーの生成（失敗してもアップロード自体は成功扱い）
+            # ローカルファーストモードではS3への転送後にレプリケーターが生成する
+            if PEAKS_ON_INGEST and staged_job is None:
+                try:
+                    with start_span("upload.peaks"):
+                        await run_in_threadpool(store_peaks, s3_key, file_content)
+                except Exception as e:
+                    print(f"⚠️ Warning: Failed to generate peaks for {s3_key}: {e}")
+
         # Register metadata to Supabase audio_files table
         # recorded_at: Primary key (UTC timestamp)
         # local_date: Local date based on device timezone
         # local_time: Local datetime based on device timezone
+        # time_block: 30-minute block of local_time ("HH-MM")
+        # file_size_bytes: Size of the stored S3 object (None if not stored)
+        # sha256: SHA-256 of the stored S3 object (None if not stored)
+        # *_status: Initial processing status ("skipped" for SKIP targets)
         audio_file_data = {
             "device_id": device_id,
             "recorded_at": recorded_at.isoformat(),
             "local_date": local_date,
             "local_time": local_time.isoformat(),  # Convert datetime to ISO string
-            "file_path": s3_key
+            "time_block": time_block,
+            "file_path": s3_key,
+            "file_size_bytes": len(file_content) if stored else None,
+            "sha256": content_sha256 if stored else None,
+            "transcriptions_status": initial_status,
+            "behavior_features_status": initial_status,
+            "emotion_features_status": initial_status
         }
 
+        if staged_job is not None:
+            audio_file_data["replication_status"] = "pending"
+
         # Supabaseへの挿入
-        result = supabase_client.table("audio_files").insert(audio_file_data).execute()
-        
-        # レスポンス
-        response_data = {
-            "status": "ok",
+        try:
+            with start_span("supabase.insert", table="audio_files"):
+                result = supabase_client.table("audio_files").insert(audio_file_data).execute()
+        except Exception:
+            if staged_job is not None:
+                discard_local_object(staged_job)
+            raise
+
+        duration_seconds = get_wav_duration(file_content)
+        ready_event = build_ready_event(audio_file_data, time_block, duration_seconds, stored, skip_policy)
+
+        manifest_entry = {
+            "recorded_at": recorded_at.isoformat(),
+            "local_time": local_time.isoformat(),
             "s3_key": s3_key,
-            "device_id": device_id,
-            "recorded_at": recorded_at.isoformat(),  # ユーザーのローカル時間を返す
-            "local_date": local_date,  # 追加: ローカル日付
-            "file_size_bytes": file_size,
-            "method": "s3_upload",
-            "timezone_info": recorded_at.strftime("%z") if recorded_at.tzinfo else "unknown"
+            "stored": stored,
+            "size_bytes": len(file_content) if stored else None,
+            "duration_seconds": duration_seconds,
+            "sha256": content_sha256 if stored else None,
+            "status": initial_status
         }
+
+        if staged_job is not None:
+            # ローカルファーストモードでは処理開始イベント・日次マニフェスト・カバレッジを
+            # S3への転送完了後にレプリケーションのワーカーで更新する
+            staged_job.update({
+                "local_date": local_date,
+                "time_block": time_block,
+                "manifest_entry": manifest_entry
+            })
+            if event_notifier is not None:
+                staged_job["event"] = ready_event
+            _write_durably(_replication_paths(staged_job["job_id"])[1], json.dumps(staged_job).encode('utf-8'))
+            enqueue_replication(staged_job)
+        else:
+            try:
+                publish_event(ready_event)
+            except Exception as e:
+                print(f"⚠️ Warning: Failed to publish ready event for {s3_key}: {e}")
+
+        # 一覧レスポンスのキャッシュを無効化（このデバイス・日付に関係するものだけ）
+        invalidate_response_cache(device_id, local_date)
+
+        # 日次マニフェスト・録音カバレッジインデックスの更新（失敗してもアップロード自体は成功扱い）
+        if staged_job is None:
+            with start_span("upload.manifest"):
+                await run_in_threadpool(update_day_indexes, device_id, local_date, time_block, manifest_entry)
+        
+        # レスポンス
+        response_data = UploadResponse(
+            status="ok",
+            s3_key=s3_key,
+            device_id=device_id,
+            recorded_at=recorded_at,  # ユーザーのローカル時間を返す
+            local_date=local_date,  # 追加: ローカル日付
+            file_size_bytes=file_size,
+            sha256=content_sha256 if stored else None,
+            method="s3_upload",
+            processing_status=initial_status,
+            skip_policy=skip_policy,
+            stored=stored,
+            replication_status=("pending" if staged_job is not None else "replicated") if stored else None,
+            trace_id=request_span.trace_id if request_span is not None else None,
+            timezone_info=recorded_at.strftime("%z") if recorded_at.tzinfo else "unknown"
+        )
         
         # Supabaseの結果からIDを取得（存在する場合）
         if result.data and len(result.data) > 0:
-            if "id" in result.data[0]:
-                response_data["supabase_id"] = result.data[0]["id"]
+            response_data.supabase_id = result.data[0].get("id")
         
-        return JSONResponse(response_data)
+        return FastJSONResponse(response_data)
 
+    except HTTPException:
+        raise
     except ClientError as e:
         # S3エラー
         error_message = f"S3 upload failed: {str(e)}"
@@ -398,6 +3444,7 @@ async def upload_file(
 
 @app.get("/api/audio-files")
 async def get_audio_files(
+    request: Request,
     device_id: Optional[str] = None,
     date_from: Optional[str] = None,
     date_to: Optional[str] = None,
@@ -419,6 +3466,12 @@ async def get_audio_files(
             status_code=500,
             detail="Supabase client not configured"
         )
+
+    cache_key = ("audio-files", device_id, date_from, date_to, limit, offset)
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        return cached_json_response(request, cached, "HIT")
+    generation = response_cache_generation()
     
     try:
         # クエリ構築
@@ -447,52 +3500,110 @@ async def get_audio_files(
         
         result = query.execute()
         
-        # ファイル情報を取得してS3メタデータを追加
-        files_with_info = []
-        for file_record in result.data:
-            file_info = {
-                **file_record,
-                "file_exists": False,
-                "file_size_bytes": None,
-                "last_modified": None
-            }
+        # S3メタデータを追加（Supabaseの行をコピーせずにそのまま更新する）
+        files: list[AudioFileRow] = result.data
+        for file_record in files:
+            file_record["file_exists"] = False
+            file_record["file_size_bytes"] = None
+            file_record["last_modified"] = None
             
             # S3ファイル存在確認とメタデータ取得
             if s3_client:
                 try:
-                    response = s3_client.head_object(
-                        Bucket=S3_BUCKET_NAME, 
-                        Key=file_record["file_path"]
-                    )
-                    file_info.update({
-                        "file_exists": True,
-                        "file_size_bytes": response["ContentLength"],
-                        "last_modified": response["LastModified"].isoformat()
-                    })
+                    with start_span("s3.head_object", **{"s3.key": file_record["file_path"]}):
+                        response = s3_client.head_object(
+                            Bucket=S3_BUCKET_NAME, 
+                            Key=file_record["file_path"]
+                        )
+                    file_record["file_exists"] = True
+                    file_record["file_size_bytes"] = response["ContentLength"]
+                    file_record["last_modified"] = response["LastModified"]
                 except ClientError:
                     # ファイルが存在しない場合はfile_exists=Falseのまま
                     pass
-            
-            files_with_info.append(file_info)
         
-        return {
-            "files": files_with_info,
-            "total_count": len(result.data),
-            "limit": limit,
-            "offset": offset
-        }
+        entry = cache_response(cache_key, AudioFilesPage(
+            files=files,
+            total_count=len(files),
+            limit=limit,
+            offset=offset
+        ), device_id=device_id, date_from=date_from, date_to=date_to, generation=generation)
+        return cached_json_response(request, entry, "MISS")
         
     except Exception as e:
         raise HTTPException(
             status_code=500,
-            detail=f"Failed to fetch audio files: {str(e)}"
+            detail=f"Failed to fetch audio files: {str(e)}"
+        )
+
+
+@app.get("/api/audio-files/export")
+async def export_audio_files(
+    device_id: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    format: str = "ndjson",
+    include_s3: bool = False,
+    page_size: int = Query(1000, ge=1, le=10000)
+):
+    """
+    音声ファイル一覧をNDJSON/CSVでストリーミングエクスポート（大きな期間向け）
+
+    Supabaseをキーセットページングで読みながら逐次送信するため、
+    メモリ使用量と最初のバイトまでの時間は期間の長さに依存しない
+
+    Args:
+        device_id: デバイスID（指定時はそのデバイスのファイルのみ）
+        date_from: 開始日（YYYY-MM-DD形式、local_date）
+        date_to: 終了日（YYYY-MM-DD形式、local_date）
+        format: "ndjson" または "csv"
+        include_s3: S3の存在・サイズ・更新日時を付与するかどうか
+        page_size: Supabaseから1回に取得する行数
+    """
+    if not supabase_client:
+        raise HTTPException(
+            status_code=500,
+            detail="Supabase client not configured"
+        )
+
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid format. Expected 'ndjson' or 'csv'"
+        )
+
+    if include_s3 and not s3_client:
+        raise HTTPException(
+            status_code=500,
+            detail="S3 client not configured"
         )
 
+    rows = iter_audio_file_rows(
+        ", ".join(EXPORT_COLUMNS),
+        device_id=device_id,
+        date_from=date_from,
+        date_to=date_to,
+        page_size=page_size
+    )
+    columns = EXPORT_COLUMNS
+    if include_s3:
+        rows = iter_with_s3_info(rows)
+        columns = EXPORT_COLUMNS + EXPORT_S3_COLUMNS
+
+    filename = f"audio_files_{device_id or 'all'}_{date_from or 'begin'}_{date_to or 'end'}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    if format == "csv":
+        return StreamingResponse(iter_csv(rows, columns), media_type="text/csv; charset=utf-8", headers=headers)
+    return StreamingResponse(iter_ndjson(rows), media_type="application/x-ndjson", headers=headers)
+
 
 @app.get("/api/audio-files/presigned-url")
 async def get_presigned_url(
     file_path: str,
-    expiration_hours: int = 1
+    expiration_hours: int = 1,
+    use_archive: bool = False,
+    restore: bool = True
 ):
     """
     音声ファイルの署名付きURLを生成（ブラウザ再生・ダウンロード用）
@@ -500,9 +3611,11 @@ async def get_presigned_url(
     Args:
         file_path: S3ファイルパス（例: files/device123/2025-08-25/09-00/audio.wav）
         expiration_hours: URL有効期限（時間、最大24時間）
+        use_archive: アーカイブ済みの場合、日次バンドルのURLとRangeを返す
+        restore: GLACIER などに移されたオブジェクトの場合、復元を要求する（Falseの場合は状況のみ返す）
     
     Returns:
-        署名付きURLとメタデータ
+        署名付きURLとメタデータ（復元が必要・復元中の場合は202と復元状況）
     """
     if not s3_client:
         raise HTTPException(
@@ -517,27 +3630,66 @@ async def get_presigned_url(
         expiration_hours = 1
     
     try:
+        # アーカイブ済みならバンドルのURLと、スロットを取り出すRangeを返す
+        archive = None
+        if use_archive and supabase_client:
+            try:
+                archive = resolve_archive_range(file_path)
+            except Exception as e:
+                print(f"⚠️ Warning: Failed to resolve archive for {file_path}: {e}")
+        if archive:
+            return FastJSONResponse(ArchivePresignedUrlResponse(
+                presigned_url=s3_client.generate_presigned_url(
+                    'get_object',
+                    Params={'Bucket': S3_BUCKET_NAME, 'Key': archive["archive_path"]},
+                    ExpiresIn=expiration_hours * 3600
+                ),
+                file_path=file_path,
+                expires_in_hours=expiration_hours,
+                expires_at=datetime.now(pytz.UTC) + timedelta(hours=expiration_hours),
+                bucket=S3_BUCKET_NAME,
+                archive=archive
+            ))
+
         # ファイル存在確認
-        s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=file_path)
+        with start_span("s3.head_object", **{"s3.key": file_path}):
+            head = s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=file_path)
+        
+        # アーカイブ済み（GLACIER など）の場合は、復元が終わるまで署名付きURLを発行しない
+        restore_state = check_object_restore(file_path, head, restore)
+        if restore_state is not None and restore_state["restore_status"] != "restored":
+            return restore_pending_response(file_path, restore_state)
         
         # 署名付きURL生成
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={
-                'Bucket': S3_BUCKET_NAME,
-                'Key': file_path
-            },
-            ExpiresIn=expiration_hours * 3600
-        )
+        with start_span("s3.generate_presigned_url", **{"s3.key": file_path}):
+            presigned_url = s3_client.generate_presigned_url(
+                'get_object',
+                Params={
+                    'Bucket': S3_BUCKET_NAME,
+                    'Key': file_path
+                },
+                ExpiresIn=expiration_hours * 3600
+            )
         
-        return {
-            "presigned_url": presigned_url,
-            "file_path": file_path,
-            "expires_in_hours": expiration_hours,
-            "expires_at": (datetime.now(pytz.UTC) + 
-                         timedelta(hours=expiration_hours)).isoformat(),
-            "bucket": S3_BUCKET_NAME
-        }
+        expires_at = datetime.now(pytz.UTC) + timedelta(hours=expiration_hours)
+        if restore_state is not None:
+            return FastJSONResponse(RestoredPresignedUrlResponse(
+                presigned_url=presigned_url,
+                file_path=file_path,
+                expires_in_hours=expiration_hours,
+                expires_at=expires_at,
+                bucket=S3_BUCKET_NAME,
+                storage_class=restore_state["storage_class"],
+                restore_status="restored",
+                restore_expiry_date=restore_state["expiry_date"]
+            ))
+        return FastJSONResponse(PresignedUrlResponse(
+            presigned_url=presigned_url,
+            file_path=file_path,
+            expires_in_hours=expiration_hours,
+            expires_at=expires_at,
+            bucket=S3_BUCKET_NAME
+        ))
         
     except ClientError as e:
         if e.response['Error']['Code'] == 'NoSuchKey':
@@ -557,8 +3709,269 @@ async def get_presigned_url(
         )
 
 
+@app.get("/api/audio-files/stream")
+async def stream_audio_file(
+    request: Request,
+    file_path: str
+):
+    """
+    音声ファイルをS3からプロキシ配信（HTTP Range・ETag対応、ブラウザ再生用）
+
+    再生済みのオブジェクトはディスクキャッシュ（LRU）から配信するため、
+    シークや再再生でS3 GETが発生しない。キャッシュにない場合はS3のRange GETをそのまま中継し、
+    キャッシュへの取り込みはバックグラウンドで行う（初回の再生をオブジェクト全体の取得で待たせない）
+
+    Args:
+        file_path: S3ファイルパス（例: files/device123/2025-08-25/09-00-00/audio.wav）
+    """
+    if not s3_client:
+        raise HTTPException(
+            status_code=500,
+            detail="S3 client not configured"
+        )
+
+    if_none_match = request.headers.get("if-none-match")
+    entry = get_cached_stream_object(file_path)
+
+    try:
+        if entry is None:
+            head = await run_in_threadpool(s3_client.head_object, Bucket=S3_BUCKET_NAME, Key=file_path)
+            etag = head.get("ETag")
+            size = head["ContentLength"]
+        else:
+            etag = entry["etag"]
+            size = entry["size"]
+
+        cache_headers = {"Cache-Control": "private, max-age=3600"}
+        if etag:
+            cache_headers["ETag"] = etag
+
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=cache_headers)
+
+        # GLACIER などに移されたオブジェクトは presigned-url と同じく復元を要求して202を返す
+        if entry is None:
+            restore_state = await run_in_threadpool(check_object_restore, file_path, head)
+            if restore_state is not None and restore_state["restore_status"] != "restored":
+                return restore_pending_response(file_path, restore_state)
+
+        if entry is not None:
+            return FileResponse(
+                entry["path"],
+                media_type=entry["content_type"],
+                headers=cache_headers
+            )
+
+        if 0 < size <= STREAM_CACHE_MAX_BYTES:
+            schedule_stream_cache_fill(file_path)
+
+        # キャッシュにない場合はS3のRange GETをそのまま中継する（上限超過・キャッシュ無効の場合も同じ）
+        get_params = {"Bucket": S3_BUCKET_NAME, "Key": file_path}
+        if request.headers.get("range"):
+            get_params["Range"] = request.headers["range"]
+        response = await run_in_threadpool(lambda: s3_client.get_object(**get_params))
+
+        headers = {
+            **cache_headers,
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(response["ContentLength"])
+        }
+        if response.get("ContentRange"):
+            headers["Content-Range"] = response["ContentRange"]
+
+        return StreamingResponse(
+            response["Body"].iter_chunks(STREAM_CHUNK_SIZE),
+            status_code=206 if response.get("ContentRange") else 200,
+            media_type=response.get("ContentType") or 'audio/wav',
+            headers=headers
+        )
+
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            raise HTTPException(
+                status_code=404,
+                detail=f"Audio file not found: {file_path}"
+            )
+        if e.response['Error']['Code'] == 'InvalidRange':
+            raise HTTPException(
+                status_code=416,
+                detail=f"Requested range not satisfiable: {file_path}"
+            )
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to stream audio file: {str(e)}"
+        )
+
+
+@app.get("/api/audio-files/peaks")
+async def get_audio_peaks(
+    file_path: str
+):
+    """
+    音声ファイルの波形サマリー（min/max/RMS）を取得（一覧画面の波形表示用）
+
+    Args:
+        file_path: S3ファイルパス（例: files/device123/2025-08-25/09-00-00/audio.wav）
+
+    Returns:
+        samples_per_peakサンプルごとのmin/max/RMS（-1.0〜1.0に正規化）
+    """
+    if not s3_client:
+        raise HTTPException(
+            status_code=500,
+            detail="S3 client not configured"
+        )
+
+    try:
+        peaks = await run_in_threadpool(load_peaks, file_path)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            raise HTTPException(
+                status_code=404,
+                detail=f"Audio file not found: {file_path}"
+            )
+        if e.response['Error']['Code'] == 'InvalidObjectState':
+            # 波形サマリーが未生成で、音声が GLACIER などに移されている（presigned-url と同じく復元を要求して202）
+            head = await run_in_threadpool(lambda: s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=file_path))
+            restore_state = await run_in_threadpool(check_object_restore, file_path, head)
+            if restore_state is not None and restore_state["restore_status"] != "restored":
+                return restore_pending_response(file_path, restore_state)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch peaks: {str(e)}"
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Unsupported audio format: {str(e)}"
+        )
+
+    return FastJSONResponse(peaks, headers={"Cache-Control": "private, max-age=86400"})
+
+
+@app.get("/api/audio-files/manifest")
+async def get_daily_manifest(
+    device_id: str,
+    local_date: str,
+    rebuild: bool = False
+):
+    """
+    デバイス×ローカル日付の日次マニフェストを取得（メモリキャッシュから返却）
+
+    Args:
+        device_id: デバイスID
+        local_date: ローカル日付（YYYY-MM-DD形式）
+        rebuild: trueの場合はaudio_filesから作り直してから返す（書き戻しに失敗したエントリの修復用）
+
+    Returns:
+        1日分の録音一覧（s3_key, size_bytes, duration_seconds, sha256）
+    """
+    if not s3_client:
+        raise HTTPException(
+            status_code=500,
+            detail="S3 client not configured"
+        )
+
+    if not re.match(r'^\d{4}-\d{2}-\d{2}$', local_date):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid local_date format. Expected YYYY-MM-DD"
+        )
+
+    if rebuild and not supabase_client:
+        raise HTTPException(
+            status_code=500,
+            detail="Supabase client not configured"
+        )
+
+    try:
+        if rebuild:
+            manifest = await run_in_threadpool(rebuild_daily_manifest, device_id, local_date)
+        else:
+            manifest = await run_in_threadpool(load_daily_manifest, device_id, local_date)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch manifest: {str(e)}"
+        )
+
+    if manifest is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Manifest not found: {device_id}/{local_date}"
+        )
+
+    return FastJSONResponse(DailyManifest(
+        device_id=manifest["device_id"],
+        local_date=manifest["local_date"],
+        files=manifest["files"],
+        total_count=manifest["total_count"],
+        total_size_bytes=manifest["total_size_bytes"],
+        updated_at=manifest["updated_at"]
+    ))
+
+
+@app.get("/api/audio-files/archive")
+async def get_daily_archive(
+    device_id: str,
+    local_date: str,
+    expiration_hours: int = 1
+):
+    """
+    デバイス×ローカル日付のアーカイブバンドル（署名付きURL）とオフセットのインデックスを取得
+
+    1日分を一括で読む場合はバンドルを1回GETし、インデックスのoffset/lengthで切り出す。
+    1件だけ読む場合は各エントリのrangeをRangeヘッダーに指定する。
+    """
+    if not s3_client:
+        raise HTTPException(
+            status_code=500,
+            detail="S3 client not configured"
+        )
+
+    if not re.match(r'^\d{4}-\d{2}-\d{2}$', local_date):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid local_date format. Expected YYYY-MM-DD"
+        )
+    expiration_hours = min(max(expiration_hours, 1), 24)
+
+    try:
+        index = load_archive_index(device_id, local_date)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch archive index: {str(e)}"
+        )
+
+    if index is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Archive not found: {device_id}/{local_date}"
+        )
+
+    presigned_url = s3_client.generate_presigned_url(
+        'get_object',
+        Params={'Bucket': S3_BUCKET_NAME, 'Key': index["archive_path"]},
+        ExpiresIn=expiration_hours * 3600
+    )
+    return FastJSONResponse(DailyArchive(
+        device_id=index["device_id"],
+        local_date=index["local_date"],
+        archive_path=index["archive_path"],
+        size_bytes=index["size_bytes"],
+        sha256=index["sha256"],
+        total_count=index["total_count"],
+        entries=index["entries"],
+        missing=index.get("missing", []),   # 欠損の記録がない旧いインデックスは空
+        created_at=index["created_at"],
+        presigned_url=presigned_url,
+        expires_at=datetime.now(pytz.UTC) + timedelta(hours=expiration_hours)
+    ))
+
+
 @app.get("/api/devices")
-async def get_devices():
+async def get_devices(request: Request):
     """
     登録されているデバイス一覧を取得（API Manager用）
     """
@@ -567,6 +3980,12 @@ async def get_devices():
             status_code=500,
             detail="Supabase client not configured"
         )
+
+    cache_key = ("devices",)
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        return cached_json_response(request, cached, "HIT")
+    generation = response_cache_generation()
     
     try:
         result = supabase_client.table("audio_files").select("device_id").execute()
@@ -575,10 +3994,11 @@ async def get_devices():
         device_ids = list(set([row["device_id"] for row in result.data]))
         device_ids.sort()
         
-        return {
-            "devices": [{"device_id": device_id} for device_id in device_ids],
-            "total_count": len(device_ids)
-        }
+        entry = cache_response(cache_key, DevicesPage(
+            devices=[DeviceSummary(device_id) for device_id in device_ids],
+            total_count=len(device_ids)
+        ), device_ids=set(device_ids), generation=generation)
+        return cached_json_response(request, entry, "MISS")
         
     except Exception as e:
         raise HTTPException(
@@ -586,6 +4006,149 @@ async def get_devices():
             detail=f"Failed to fetch devices: {str(e)}"
         )
 
+@app.get("/api/devices/{device_id}/coverage")
+async def get_device_coverage(
+    device_id: str,
+    date_from: str = Query(..., alias="from", description="開始日（YYYY-MM-DD）"),
+    date_to: str = Query(..., alias="to", description="終了日（YYYY-MM-DD）"),
+    include_missing: bool = Query(True, description="欠損スロットの一覧を含める")
+):
+    """
+    デバイスの録音カバレッジ（30分スロットごとの録音有無）を取得
+
+    Returns:
+        日ごとのビットマップ（下位ビットが00-00）、録音済みスロット数、欠損スロット一覧
+    """
+    if not s3_client:
+        raise HTTPException(
+            status_code=500,
+            detail="S3 client not configured"
+        )
+    if not supabase_client:
+        raise HTTPException(
+            status_code=500,
+            detail="Supabase client not configured"
+        )
+
+    try:
+        start = datetime.strptime(date_from, "%Y-%m-%d")
+        end = datetime.strptime(date_to, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid date format. Expected YYYY-MM-DD"
+        )
+    if end < start:
+        raise HTTPException(status_code=400, detail="'to' must not be earlier than 'from'")
+    if (end - start).days + 1 > COVERAGE_MAX_RANGE_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Date range too large (max {COVERAGE_MAX_RANGE_DAYS} days)"
+        )
+
+    try:
+        coverage = await run_in_threadpool(get_coverage_range, device_id, start, end, include_missing)
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to fetch coverage: {str(e)}"
+        )
+
+    return FastJSONResponse(coverage)
+
+# =========================================
+# 管理者用診断エンドポイント
+# =========================================
+@app.get("/api/admin/profile")
+async def profile_process(
+    request: Request,
+    seconds: float = Query(10.0, gt=0, le=PROFILE_MAX_SECONDS, description="計測時間（秒）"),
+    interval_ms: float = Query(PROFILE_INTERVAL_MS, ge=1, le=1000, description="サンプリング間隔（ミリ秒）")
+):
+    """
+    稼働中のプロセスをサンプリングプロファイラーで計測する（管理者用）
+
+    レスポンスは折り畳みスタック形式（1行 = "スタック 件数"）で、
+    flamegraph.pl や speedscope にそのまま読み込める。
+    """
+    require_admin(request)
+    if not _profile_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="Profiler is already running")
+    try:
+        print(f"🔬 Profiling for {seconds}s (interval {interval_ms}ms)")
+        stacks, samples = await run_in_threadpool(sample_stacks, seconds, interval_ms / 1000)
+    finally:
+        _profile_lock.release()
+
+    body = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    return Response(
+        content=body,
+        media_type="text/plain; charset=utf-8",
+        headers={"X-Profile-Samples": str(samples), "Cache-Control": "no-store"}
+    )
+
+@app.post("/api/admin/tracemalloc/start")
+async def start_tracemalloc(
+    request: Request,
+    frames: int = Query(TRACEMALLOC_DEFAULT_FRAMES, ge=1, le=100, description="記録するトレースバックの深さ")
+):
+    """tracemallocによるメモリ確保の追跡を開始する（管理者用）"""
+    require_admin(request)
+    if tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is already tracing")
+    tracemalloc.start(frames)
+    _tracemalloc_state["baseline"] = None
+    print(f"🔬 tracemalloc started ({frames} frames)")
+    return {"tracing": True, "frames": frames}
+
+@app.get("/api/admin/tracemalloc/snapshot")
+async def get_tracemalloc_snapshot(
+    request: Request,
+    limit: int = Query(25, ge=1, le=500, description="返す件数"),
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$", description="集計単位"),
+    diff: bool = Query(False, description="前回のスナップショットとの差分を返す")
+):
+    """メモリ確保の多い箇所（または前回からの差分）を取得する（管理者用）"""
+    require_admin(request)
+    if not tracemalloc.is_tracing():
+        raise HTTPException(status_code=409, detail="tracemalloc is not tracing")
+
+    top = await run_in_threadpool(tracemalloc_top, limit, group_by, diff)
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "timestamp": datetime.now(pytz.UTC).isoformat(),
+        "traced_current_bytes": current,
+        "traced_peak_bytes": peak,
+        "group_by": group_by,
+        "diff": diff,
+        "top": top
+    }
+
+@app.post("/api/admin/tracemalloc/stop")
+async def stop_tracemalloc(request: Request):
+    """tracemallocを停止する（管理者用）"""
+    require_admin(request)
+    tracemalloc.stop()
+    _tracemalloc_state["baseline"] = None
+    print("🔬 tracemalloc stopped")
+    return {"tracing": False}
+
+@app.get("/api/admin/traces/{trace_id}")
+async def get_trace(trace_id: str, request: Request):
+    """
+    トレースのスパン一覧を取得する（管理者用、TRACE_EXPORTER=memory の場合のみ）
+
+    レスポンスヘッダー X-Trace-Id の値を指定する
+    """
+    require_admin(request)
+    if not isinstance(span_exporter, InMemorySpanExporter):
+        raise HTTPException(status_code=500, detail="In-memory trace exporter not configured")
+
+    spans = span_exporter.get_trace(trace_id.lower())
+    if not spans:
+        raise HTTPException(status_code=404, detail=f"Trace not found: {trace_id}")
+    return {"trace_id": trace_id.lower(), "span_count": len(spans), "spans": spans}
+
 # =========================================
 # ルートエンドポイント
 # =========================================
@@ -652,16 +4215,73 @@ async def root():
             <p>/healthのエイリアス。同じ情報を返します。</p>
         </div>
         
+        <div class="endpoint">
+            <span class="method get">GET</span> <code>/ready</code>
+            <p>新規アップロードの受付可否。終了処理（ドレイン）中は503を返します。</p>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method get">GET</span> <code>/api/metrics</code>
+            <p>レスポンスキャッシュのヒット率などの内部メトリクスを取得します。</p>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method get">GET</span> <code>/api/audio-files/archive</code>
+            <p>デバイス×日の録音をまとめたアーカイブバンドルの署名付きURLとオフセットのインデックスを取得します。</p>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method get">GET</span> <code>/api/devices/{device_id}/coverage</code>
+            <p>デバイスの30分スロットごとの録音有無（欠損スロット）を期間指定で取得します。</p>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method get">GET</span> <code>/api/admin/profile</code>
+            <p>稼働中のプロセスをサンプリングプロファイラーで計測します（管理者用、折り畳みスタック形式）。</p>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method post">POST</span> <code>/api/admin/tracemalloc/start</code> ・
+            <span class="method get">GET</span> <code>/api/admin/tracemalloc/snapshot</code> ・
+            <span class="method post">POST</span> <code>/api/admin/tracemalloc/stop</code>
+            <p>tracemallocでメモリ確保の多い箇所やスナップショット間の差分を取得します（管理者用）。</p>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method get">GET</span> <code>/api/admin/traces/{trace_id}</code>
+            <p>X-Trace-Id のトレースのスパン一覧（受信・変換・S3 PUT・登録などの所要時間）を取得します（管理者用）。</p>
+        </div>
+        
         <div class="endpoint">
             <span class="method get">GET</span> <code>/api/audio-files</code>
             <p>音声ファイル一覧を取得します（API Manager用）。日付範囲やデバイスIDでフィルタリング可能。</p>
         </div>
         
+        <div class="endpoint">
+            <span class="method get">GET</span> <code>/api/audio-files/export</code>
+            <p>音声ファイル一覧をNDJSON/CSVでストリーミングエクスポートします（大きな期間向け）。</p>
+        </div>
+        
         <div class="endpoint">
             <span class="method get">GET</span> <code>/api/audio-files/presigned-url</code>
             <p>音声ファイルの署名付きURLを生成します。ブラウザで直接再生・ダウンロード可能。</p>
         </div>
         
+        <div class="endpoint">
+            <span class="method get">GET</span> <code>/api/audio-files/stream</code>
+            <p>音声ファイルをRange対応でプロキシ配信します。再生済みファイルはディスクキャッシュから返します。</p>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method get">GET</span> <code>/api/audio-files/peaks</code>
+            <p>音声ファイルの波形サマリー（min/max/RMS）を取得します。未生成の場合は初回リクエスト時に生成します。</p>
+        </div>
+        
+        <div class="endpoint">
+            <span class="method get">GET</span> <code>/api/audio-files/manifest</code>
+            <p>デバイス×ローカル日付の日次マニフェスト（1日分の録音一覧）を取得します。</p>
+        </div>
+        
         <div class="endpoint">
             <span class="method get">GET</span> <code>/api/devices</code>
             <p>登録されているデバイス一覧を取得します。</p>
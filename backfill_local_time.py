@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+audio_files の local_date / local_time / time_block の一括バックフィル
+
+デバイスのタイムゾーン対応以前にアップロードされた行は local_date / local_time が
+誤っている（UTCのまま）ことがあり、time_block は /upload で設定されていなかった。
+/upload と同じ計算（calculate_local_datetime / calculate_time_block）で値を算出し直し、
+現在の値と異なる行だけを書き戻す。
+
+- デバイスごとに recorded_at のキーセットページングで読み出す（並列数 --workers）
+- デバイスのタイムゾーンは実行開始時に devices テーブルから一括取得する
+- 変更のある行は (device_id, recorded_at) で絞り込んだ update で1行ずつ書き戻す
+  （処理中に削除された行を作り直さない。--rate で1秒あたりの書き込み行数を制限）
+- デバイスごとの進捗（最後に処理した recorded_at）をチェックポイントファイルに保存し、
+  中断しても同じ --checkpoint を指定して再実行すれば続きから再開する
+- 再計算結果が同じ行は書き込まないため、何度実行しても結果は同じ
+
+使用方法:
+    python backfill_local_time.py --dry-run                      # 変更件数の確認のみ
+    python backfill_local_time.py --checkpoint backfill.json     # 全デバイス（再開可能）
+    python backfill_local_time.py --device DEVICE_ID --rate 500
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from postgrest.types import ReturnMethod
+
+import app
+from app import calculate_local_datetime, calculate_time_block
+
+# 1ページあたりの行数
+DEFAULT_PAGE_SIZE = 1000
+
+# 1秒あたりの最大書き込み行数（全ワーカー合計）
+DEFAULT_RATE = 2000
+
+
+# =========================================
+# 書き込みレート制限・チェックポイント
+# =========================================
+class RateLimiter:
+    """全ワーカーで共有するトークンバケット（1秒あたり rate 行）"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_at = time.monotonic()
+
+    def acquire(self, rows: int) -> None:
+        if not self.rate or rows <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next_at, now)
+            self.next_at = start + rows / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class Checkpoint:
+    """デバイスごとの進捗（last_recorded_at / done）をJSONファイルに保存する"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.devices = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.devices = json.load(f).get("devices", {})
+
+    def get(self, device_id: str) -> dict:
+        with self.lock:
+            return dict(self.devices.get(device_id, {}))
+
+    def update(self, device_id: str, last_recorded_at=None, done: bool = False) -> None:
+        with self.lock:
+            state = self.devices.setdefault(device_id, {})
+            if last_recorded_at is not None:
+                state["last_recorded_at"] = last_recorded_at
+            state["done"] = done
+            self._save()
+
+    def _save(self) -> None:
+        if not self.path:
+            return
+        # 途中で落ちても壊れたファイルが残らないよう、一時ファイルから置き換える
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"devices": self.devices, "updated_at": datetime.now().isoformat()}, f)
+        os.replace(temp_path, self.path)
+
+
+# =========================================
+# 読み出し・再計算
+# =========================================
+def load_timezones(supabase) -> dict:
+    """devicesテーブルのタイムゾーンを一括取得する（未設定は"UTC"、get_device_timezone と同じ扱い）"""
+    devices = supabase.table("devices").select("device_id, timezone").execute().data
+    return {row["device_id"]: row.get("timezone") or "UTC" for row in devices}
+
+
+def iter_pages(supabase, device_id: str, after=None, page_size: int = DEFAULT_PAGE_SIZE):
+    """デバイスの audio_files 行を recorded_at 順にキーセットページングでページ単位に返す"""
+    while True:
+        query = supabase.table("audio_files") \
+            .select("device_id, recorded_at, file_path, local_date, local_time, time_block") \
+            .eq("device_id", device_id)
+        if after is not None:
+            query = query.gt("recorded_at", after)
+        rows = query.order("recorded_at").limit(page_size).execute().data
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        after = rows[-1]["recorded_at"]
+
+
+def recompute_page(rows: list[dict], timezone_str: str) -> list[dict]:
+    """1ページ分の行を再計算し、値が変わる行だけを更新用の行として返す"""
+    changes = []
+    for row in rows:
+        recorded_at = datetime.fromisoformat(row["recorded_at"])
+        local_date, local_time = calculate_local_datetime(recorded_at, timezone_str)
+        values = {
+            "local_date": local_date,
+            "local_time": local_time.isoformat(),
+            "time_block": calculate_time_block(local_time)
+        }
+
+        current_time = row.get("local_time")
+        unchanged = (
+            str(row.get("local_date")) == values["local_date"]
+            and current_time is not None
+            and datetime.fromisoformat(current_time).replace(tzinfo=None) == local_time
+            and row.get("time_block") == values["time_block"]
+        )
+        if not unchanged:
+            changes.append({
+                "device_id": row["device_id"],
+                "recorded_at": row["recorded_at"],
+                **values
+            })
+    return changes
+
+
+def backfill_device(supabase, device_id: str, timezone_str: str, checkpoint: Checkpoint,
+                    limiter: RateLimiter, page_size: int = DEFAULT_PAGE_SIZE, dry_run: bool = False) -> dict:
+    """1デバイス分をバックフィルする（チェックポイントの続きから）"""
+    state = checkpoint.get(device_id)
+    result = {"device_id": device_id, "timezone": timezone_str, "rows": 0, "updated": 0}
+    if state.get("done"):
+        return {**result, "status": "skipped"}
+
+    for rows in iter_pages(supabase, device_id, state.get("last_recorded_at"), page_size):
+        changes = recompute_page(rows, timezone_str)
+        if changes and not dry_run:
+            limiter.acquire(len(changes))
+            for change in changes:
+                values = {k: v for k, v in change.items() if k not in ("device_id", "recorded_at")}
+                supabase.table("audio_files").update(values, returning=ReturnMethod.minimal) \
+                    .eq("device_id", change["device_id"]) \
+                    .eq("recorded_at", change["recorded_at"]) \
+                    .execute()
+        result["rows"] += len(rows)
+        result["updated"] += len(changes)
+        # 書き込みが完了したページまでを記録する（ドライランでは進捗を残さない）
+        if not dry_run:
+            checkpoint.update(device_id, last_recorded_at=rows[-1]["recorded_at"])
+
+    if not dry_run:
+        checkpoint.update(device_id, done=True)
+    return {**result, "status": "dry_run" if dry_run else "done"}
+
+
+# =========================================
+# 実行
+# =========================================
+def backfill(supabase, device_ids=None, checkpoint=None, workers: int = 4, page_size: int = DEFAULT_PAGE_SIZE,
+             rate: float = DEFAULT_RATE, dry_run: bool = False, emit=None) -> dict:
+    """
+    audio_files の local_date / local_time / time_block を再計算して書き戻す
+
+    Args:
+        device_ids: 対象デバイスID（Noneの場合はdevicesテーブルの全デバイス）
+        checkpoint: 進捗を保存する Checkpoint（Noneの場合は保存しない）
+        rate: 1秒あたりの最大書き込み行数（0で無制限）
+        emit: デバイスごとの結果を受け取るコールバック（スレッドセーフに呼び出される）
+
+    Returns:
+        dict: 件数の集計
+    """
+    checkpoint = checkpoint or Checkpoint()
+    limiter = RateLimiter(rate)
+    timezones = load_timezones(supabase)
+    if device_ids is None:
+        device_ids = sorted(timezones)
+
+    stats = {"devices": len(device_ids), "done": 0, "skipped": 0, "dry_run": 0,
+             "rows": 0, "updated": 0, "errors": 0}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(backfill_device, supabase, device_id, timezones.get(device_id, "UTC"),
+                            checkpoint, limiter, page_size, dry_run): device_id
+            for device_id in device_ids
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"❌ Backfill failed for device {futures[future]}: {e}", file=sys.stderr)
+                stats["errors"] += 1
+                continue
+            stats[result["status"]] += 1
+            stats["rows"] += result["rows"]
+            stats["updated"] += result["updated"]
+            if emit:
+                emit(result)
+
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="audio_files の local_date / local_time / time_block のバックフィル")
+    parser.add_argument("--device", action="append", dest="devices", help="対象デバイスID（複数指定可）")
+    parser.add_argument("--workers", type=int, default=4, help="並列に処理するデバイス数（デフォルト: 4）")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE,
+                        help=f"1ページあたりの行数（デフォルト: {DEFAULT_PAGE_SIZE}）")
+    parser.add_argument("--rate", type=float, default=DEFAULT_RATE,
+                        help=f"1秒あたりの最大書き込み行数、0で無制限（デフォルト: {DEFAULT_RATE}）")
+    parser.add_argument("--checkpoint", help="進捗を保存するファイル（指定すると中断後に続きから再開できる）")
+    parser.add_argument("--dry-run", action="store_true", help="書き込まずに変更件数のみ表示する")
+    args = parser.parse_args(argv)
+
+    if not app.supabase_client:
+        print("❌ Supabaseの環境変数が設定されていません", file=sys.stderr)
+        return 1
+
+    def emit(result):
+        print(json.dumps(result, ensure_ascii=False))
+
+    started = time.perf_counter()
+    stats = backfill(
+        app.supabase_client,
+        device_ids=args.devices,
+        checkpoint=Checkpoint(args.checkpoint),
+        workers=args.workers,
+        page_size=args.page_size,
+        rate=args.rate,
+        dry_run=args.dry_run,
+        emit=emit
+    )
+    elapsed = time.perf_counter() - started
+    print(f"🕒 バックフィル結果 ({elapsed:.1f}s, {stats['rows'] / max(elapsed, 1e-9):.0f} rows/s): {json.dumps(stats)}",
+          file=sys.stderr)
+    return 0 if stats["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
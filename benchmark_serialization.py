@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+/api/audio-files のレスポンス生成（シリアライズ）のベンチマーク
+
+Supabaseの行を模した10,000行について、以前の方法
+（行ごとに辞書をコピー → last_modified を isoformat() → json.dumps(default=str)）と
+現在の方法（行をそのまま更新 → AudioFilesPage を orjson でエンコード）の
+処理時間と割り当てメモリのピーク（tracemalloc）を比較する。
+
+使用方法:
+    python benchmark_serialization.py
+    python benchmark_serialization.py --rows 50000 --repeat 5
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pytz
+
+import app
+
+
+def make_rows(count: int) -> list[dict]:
+    started = pytz.UTC.localize(datetime(2025, 11, 10))
+    rows = []
+    for i in range(count):
+        recorded_at = started + timedelta(minutes=30 * i)
+        device_id = f"device-{i % 20:04d}"
+        rows.append({
+            "device_id": device_id,
+            "recorded_at": recorded_at.isoformat(),
+            "file_path": f"files/{device_id}/{recorded_at:%Y-%m-%d}/{recorded_at:%H-%M-%S}/audio.wav",
+            "local_date": f"{recorded_at:%Y-%m-%d}",
+            "time_block": f"{recorded_at:%H}-{'00' if recorded_at.minute < 30 else '30'}",
+            "transcriptions_status": "completed",
+            "behavior_features_status": "pending",
+            "emotion_features_status": "pending",
+            "created_at": (recorded_at + timedelta(seconds=54)).isoformat(),
+        })
+    return rows
+
+
+def head_object(row: dict) -> dict:
+    """S3 head_object のレスポンスを模したもの"""
+    return {"ContentLength": 1920044, "LastModified": pytz.UTC.localize(datetime(2025, 11, 10, 2, 1, 55))}
+
+
+def run_dict_copy(rows: list[dict]) -> bytes:
+    files_with_info = []
+    for file_record in rows:
+        file_info = {**file_record, "file_exists": False, "file_size_bytes": None, "last_modified": None}
+        response = head_object(file_record)
+        file_info.update({
+            "file_exists": True,
+            "file_size_bytes": response["ContentLength"],
+            "last_modified": response["LastModified"].isoformat()
+        })
+        files_with_info.append(file_info)
+    content = {"files": files_with_info, "total_count": len(rows), "limit": len(rows), "offset": 0}
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def run_in_place(rows: list[dict]) -> bytes:
+    for file_record in rows:
+        file_record["file_exists"] = False
+        file_record["file_size_bytes"] = None
+        file_record["last_modified"] = None
+        response = head_object(file_record)
+        file_record["file_exists"] = True
+        file_record["file_size_bytes"] = response["ContentLength"]
+        file_record["last_modified"] = response["LastModified"]
+    return app.encode_json(app.AudioFilesPage(files=rows, total_count=len(rows), limit=len(rows), offset=0))
+
+
+def measure(func, row_count: int, repeat: int) -> tuple[float, int]:
+    """最速の処理時間（秒）と割り当てメモリのピーク（バイト）を返す"""
+    best = float("inf")
+    for _ in range(repeat):
+        rows = make_rows(row_count)
+        started = time.perf_counter()
+        func(rows)
+        best = min(best, time.perf_counter() - started)
+
+    # tracemalloc は処理を遅くするため、時間の計測とは別に1回だけ実行する
+    rows = make_rows(row_count)
+    tracemalloc.start()
+    func(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="/api/audio-files のシリアライズのベンチマーク")
+    parser.add_argument("--rows", type=int, default=10000, help="行数（デフォルト: 10000）")
+    parser.add_argument("--repeat", type=int, default=5, help="各計測の繰り返し回数（最速値を採用）")
+    args = parser.parse_args(argv)
+
+    # 両方の方法で同じJSONになることを確認してから計測する
+    if json.loads(run_dict_copy(make_rows(100))) != json.loads(run_in_place(make_rows(100))):
+        print("❌ Serialized output differs between dict_copy and in_place", file=sys.stderr)
+        return 1
+
+    print(f"🔧 {args.rows} rows, best of {args.repeat}")
+    print(f"{'method':<12}{'time':>12}{'peak alloc':>14}")
+    results = {}
+    for name, func in (("dict_copy", run_dict_copy), ("in_place", run_in_place)):
+        elapsed, peak = measure(func, args.rows, args.repeat)
+        results[name] = elapsed
+        print(f"{name:<12}{elapsed * 1000:>10.1f}ms{peak / 1024 / 1024:>12.1f}MB")
+    print(f"⚡ {results['dict_copy'] / results['in_place']:.1f}x faster")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+WAV正規化（normalize_wav）のベンチマーク
+
+さまざまな形式のWAVを生成し、app.normalize_wav（NumPyのポリフェーズフィルター）と
+ffmpeg（サブプロセス）・pydub での 16kHz / mono / 16-bit 変換の処理時間を比較する。
+ffmpegがインストールされていない環境ではffmpegの計測をスキップする。
+
+使用方法:
+    python benchmark_wav_normalize.py
+    python benchmark_wav_normalize.py --seconds 600 --repeat 5
+"""
+
+import sys
+import os
+import io
+import time
+import wave
+import shutil
+import argparse
+import subprocess
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from pydub import AudioSegment
+
+import app
+
+# (サンプリングレート, チャンネル数, サンプル幅)
+FORMATS = [
+    (16000, 1, 2),
+    (16000, 2, 2),
+    (44100, 2, 2),
+    (48000, 1, 2),
+    (48000, 2, 3),
+    (8000, 1, 1),
+]
+
+
+def make_wav(seconds: float, frame_rate: int, channels: int, sample_width: int) -> bytes:
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * frame_rate)) / frame_rate
+    signal = 0.3 * np.sin(2 * np.pi * 440 * t) + 0.05 * rng.standard_normal(t.shape[0])
+    data = np.repeat(signal[:, None], channels, axis=1)
+
+    if sample_width == 1:
+        pcm = (data * 127 + 128).astype(np.uint8).tobytes()
+    elif sample_width == 2:
+        pcm = (data * 32767).astype('<i2').tobytes()
+    else:
+        pcm = (data * 8388607).astype('<i4').view(np.uint8).reshape(-1, 4)[:, :3].tobytes()
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(frame_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def run_numpy(wav_content: bytes) -> bytes:
+    return app.normalize_wav(wav_content)[0]
+
+
+def run_ffmpeg(wav_content: bytes) -> bytes:
+    return subprocess.run(
+        ["ffmpeg", "-v", "error", "-f", "wav", "-i", "pipe:0",
+         "-ar", "16000", "-ac", "1", "-sample_fmt", "s16", "-f", "wav", "pipe:1"],
+        input=wav_content, stdout=subprocess.PIPE, check=True
+    ).stdout
+
+
+def run_pydub(wav_content: bytes) -> bytes:
+    audio = AudioSegment.from_file(io.BytesIO(wav_content), format='wav')
+    audio = audio.set_frame_rate(16000).set_channels(1).set_sample_width(2)
+    buffer = io.BytesIO()
+    audio.export(buffer, format='wav')
+    return buffer.getvalue()
+
+
+def measure(func, wav_content: bytes, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(wav_content)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="normalize_wav のベンチマーク")
+    parser.add_argument("--seconds", type=float, default=60.0, help="生成する音声の長さ（秒）")
+    parser.add_argument("--repeat", type=int, default=3, help="各計測の繰り返し回数（最速値を採用）")
+    args = parser.parse_args(argv)
+
+    runners = {"numpy": run_numpy, "pydub": run_pydub}
+    if shutil.which("ffmpeg"):
+        runners["ffmpeg"] = run_ffmpeg
+    else:
+        print("⚠️ ffmpeg not found: skipping ffmpeg measurements")
+
+    # normalize_wav のログ出力を抑える
+    app.print = lambda *a, **k: None
+
+    print(f"🔧 {args.seconds:.0f}s of audio per format, best of {args.repeat}")
+    print(f"{'format':<20}" + "".join(f"{name:>12}" for name in runners) + f"{'x realtime':>14}")
+    for frame_rate, channels, sample_width in FORMATS:
+        wav_content = make_wav(args.seconds, frame_rate, channels, sample_width)
+        label = f"{frame_rate}Hz/{channels}ch/{sample_width * 8}bit"
+        results = {}
+        for name, func in runners.items():
+            try:
+                results[name] = measure(func, wav_content, args.repeat)
+            except Exception as e:
+                print(f"⚠️ {name} failed for {label}: {e}")
+                results[name] = float("nan")
+        row = "".join(f"{results[name] * 1000:>10.1f}ms" for name in runners)
+        print(f"{label:<20}{row}{args.seconds / results['numpy']:>13.0f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
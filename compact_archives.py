@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+デバイス×ローカル日付の録音を1つのアーカイブバンドルにまとめる日次コンパクション
+
+ローカル日付が終わった（ARCHIVE_GRACE_HOURS の猶予を過ぎた）デバイス×日について、
+audio_files の行（recorded_at 順）に対応するS3オブジェクトを連結して
+archives/{device_id}/{local_date}/bundle.bin に保存し、各スロットの
+オフセット・長さを index.json と audio_files（archive_path / archive_offset / archive_length）に記録する。
+
+- 1日分を読む場合: バンドルを1回GETしてインデックスで切り出す
+- 1件だけ読む場合: バンドルに対してRange GET（各スロットは元のWAVのまま）
+- 元の files/ のオブジェクトは削除しない（S3イベント連携・既存の読み出し経路はそのまま）
+- --date を省略した場合は、直近の確定日までで archive_path が未設定の行が残っている日をすべて対象にする
+  （後回しにした日・失敗した日・実行しなかった日も次回の実行で処理される）
+- 既に同じ内容のインデックスがある場合はスキップする（--force で作り直し）
+- S3へのレプリケーション待ち（replication_status = pending）の行がある日は後回しにする（次回の実行で処理）
+- オブジェクトのない行（discard ポリシーの旧形式 skipped/ の行など）はバンドルに含めず、インデックスの missing に記録する
+
+使用方法:
+    python compact_archives.py                                   # 全デバイスの未アーカイブの確定日
+    python compact_archives.py --device DEVICE_ID --date 2025-11-10
+    python compact_archives.py --dry-run
+"""
+
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import pytz
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+import app
+from app import get_archive_key, get_archive_index_key, archive_byte_range
+
+# バンドルのアップロード設定（大きなバンドルはマルチパートで転送）
+BUNDLE_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=64 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024
+)
+
+# S3から読み出す際のチャンクサイズ
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+# =========================================
+# 対象デバイス×日の決定
+# =========================================
+def last_closed_local_date(timezone_str: str, now: datetime, grace_hours: int = app.ARCHIVE_GRACE_HOURS) -> str:
+    """猶予時間を過ぎて確定した直近のローカル日付を返す"""
+    try:
+        tz = pytz.timezone(timezone_str or "UTC")
+    except pytz.UnknownTimeZoneError:
+        tz = pytz.UTC
+    local_now = now.astimezone(tz) - timedelta(hours=grace_hours)
+    return (local_now.date() - timedelta(days=1)).isoformat()
+
+
+def list_devices(supabase) -> list[dict]:
+    return supabase.table("devices").select("device_id, timezone").execute().data
+
+
+def is_archivable_row(row: dict) -> bool:
+    """バンドルに入る可能性のある行か（discard ポリシーの行は除く）"""
+    file_path = row.get("file_path")
+    if row.get("file_size_bytes") is None and (file_path or "").startswith(f"{app.SKIP_STORAGE_PREFIX}/"):
+        return False
+    return app.is_stored_file_path(file_path)
+
+
+def list_uncompacted_dates(supabase, device_id: str, up_to: str, page_size: int = 1000) -> list[str]:
+    """up_to（確定日）までで、archive_path が未設定の保存済みの行が残っているローカル日付を古い順に返す"""
+    dates = set()
+    offset = 0
+    while True:
+        page = supabase.table("audio_files") \
+            .select("local_date, file_path, file_size_bytes") \
+            .eq("device_id", device_id) \
+            .is_("archive_path", "null") \
+            .lte("local_date", up_to) \
+            .order("local_date") \
+            .order("recorded_at") \
+            .range(offset, offset + page_size - 1) \
+            .execute().data
+        # discard ポリシーの行（旧形式の skipped/ でサイズのない行を含む）はバンドルに入らず
+        # archive_path が付かないため、対象の判定に使わない
+        dates.update(row["local_date"] for row in page if is_archivable_row(row))
+        if len(page) < page_size:
+            return sorted(dates)
+        offset += page_size
+
+
+def list_day_rows(supabase, device_id: str, local_date: str, page_size: int = 1000) -> list[dict]:
+    """デバイス×日の音声を保存している行を recorded_at 順に取得する"""
+    rows = []
+    offset = 0
+    while True:
+        page = supabase.table("audio_files") \
+            .select("device_id, recorded_at, file_path, file_size_bytes, sha256, replication_status") \
+            .eq("device_id", device_id) \
+            .eq("local_date", local_date) \
+            .order("recorded_at") \
+            .range(offset, offset + page_size - 1) \
+            .execute().data
+        # discard ポリシーで保存しなかった行は対象外（file_size_bytes が NULL の旧い行は対象に含める）
+        rows.extend(row for row in page if app.is_stored_file_path(row.get("file_path")))
+        if len(page) < page_size:
+            return rows
+        offset += page_size
+
+
+# =========================================
+# コンパクション
+# =========================================
+def index_matches(index: dict, rows: list[dict]) -> bool:
+    """既存インデックスが同じスロット構成（パス・サイズ）かどうか（サイズが NULL の行はパスのみ比較）"""
+    missing = set(index.get("missing", []))
+    entries = index.get("entries", [])
+    rows = [row for row in rows if row["file_path"] not in missing]
+    return len(entries) == len(rows) and all(
+        entry["file_path"] == row["file_path"] and row.get("file_size_bytes") in (None, entry["length"])
+        for entry, row in zip(entries, rows)
+    )
+
+
+def read_object_chunks(s3, bucket: str, file_path: str):
+    """オブジェクトをチャンク単位で読み出す（オブジェクトがない場合はNone）"""
+    try:
+        body = s3.get_object(Bucket=bucket, Key=file_path)["Body"]
+    except ClientError as e:
+        if e.response['Error']['Code'] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    return body.iter_chunks(READ_CHUNK_SIZE)
+
+
+def compact_device_day(s3, supabase, bucket: str, device_id: str, local_date: str,
+                       force: bool = False, dry_run: bool = False) -> dict:
+    """
+    デバイス×日の録音を1つのバンドルにまとめる
+
+    Returns:
+        dict: status（compacted / skipped / empty / deferred / dry_run）と件数・サイズ
+    """
+    rows = list_day_rows(supabase, device_id, local_date)
+    result = {"device_id": device_id, "local_date": local_date, "slots": len(rows), "bytes": 0}
+    if not rows:
+        return {**result, "status": "empty"}
+
+    # S3に揃っていない日はまとめない（ローカルファーストモードの転送待ち）
+    pending = sum(1 for row in rows if row.get("replication_status") == "pending")
+    if pending:
+        return {**result, "status": "deferred", "pending": pending}
+
+    if not force:
+        existing = app.load_archive_index(device_id, local_date)
+        if existing is not None and index_matches(existing, rows):
+            return {**result, "status": "skipped", "bytes": existing["size_bytes"]}
+
+    if dry_run:
+        return {**result, "status": "dry_run", "bytes": sum(row.get("file_size_bytes") or 0 for row in rows)}
+
+    archive_path = get_archive_key(device_id, local_date)
+    entries = []
+    missing = []
+    with tempfile.NamedTemporaryFile(suffix=".bin") as bundle:
+        bundle_sha256 = hashlib.sha256()
+        offset = 0
+        for row in rows:
+            chunks = read_object_chunks(s3, bucket, row["file_path"])
+            if chunks is None:
+                print(f"⚠️ Object not found, leaving out of bundle: {row['file_path']}", file=sys.stderr)
+                missing.append(row["file_path"])
+                continue
+
+            digest = hashlib.sha256()
+            length = 0
+            for chunk in chunks:
+                bundle.write(chunk)
+                digest.update(chunk)
+                bundle_sha256.update(chunk)
+                length += len(chunk)
+
+            sha256 = digest.hexdigest()
+            if row.get("sha256") and row["sha256"] != sha256:
+                raise ValueError(f"Checksum mismatch for {row['file_path']}: expected {row['sha256']}, got {sha256}")
+
+            entries.append({
+                "recorded_at": row["recorded_at"],
+                "file_path": row["file_path"],
+                "offset": offset,
+                "length": length,
+                "range": archive_byte_range(offset, length),
+                "sha256": sha256
+            })
+            offset += length
+        bundle.flush()
+
+        if not entries:
+            return {**result, "status": "empty", "slots": 0, "missing": len(missing)}
+
+        s3.upload_file(
+            bundle.name, bucket, archive_path,
+            ExtraArgs={"ContentType": "application/octet-stream", "ChecksumAlgorithm": "SHA256"},
+            Config=BUNDLE_TRANSFER_CONFIG
+        )
+
+    index = {
+        "device_id": device_id,
+        "local_date": local_date,
+        "archive_path": archive_path,
+        "size_bytes": offset,
+        "sha256": bundle_sha256.hexdigest(),
+        "total_count": len(entries),
+        "entries": entries,
+        "missing": missing,
+        "created_at": datetime.now(pytz.UTC).isoformat()
+    }
+    s3.put_object(
+        Bucket=bucket,
+        Key=get_archive_index_key(device_id, local_date),
+        Body=json.dumps(index, ensure_ascii=False).encode("utf-8"),
+        ContentType="application/json"
+    )
+    app.cache_archive_index(device_id, local_date, index)
+
+    # バンドルとインデックスを保存してから行を更新する（途中で失敗しても再実行で揃う）
+    for entry in entries:
+        supabase.table("audio_files").update({
+            "archive_path": archive_path,
+            "archive_offset": entry["offset"],
+            "archive_length": entry["length"]
+        }).eq("device_id", device_id).eq("recorded_at", entry["recorded_at"]).execute()
+
+    return {**result, "status": "compacted", "slots": len(entries), "bytes": offset, "missing": len(missing)}
+
+
+# =========================================
+# 実行
+# =========================================
+def compact(s3, supabase, bucket: str, device_ids=None, local_date=None, workers: int = 4,
+            force: bool = False, dry_run: bool = False, now=None, emit=None) -> dict:
+    """
+    対象のデバイス×日をまとめてコンパクションする
+
+    Args:
+        device_ids: 対象デバイスID（Noneの場合はdevicesテーブルの全デバイス）
+        local_date: 対象ローカル日付（Noneの場合はデバイスごとに、直近の確定日までで未アーカイブの行が残っている日）
+        emit: デバイス×日ごとの結果を受け取るコールバック（スレッドセーフに呼び出される）
+
+    Returns:
+        dict: 件数の集計
+    """
+    now = now or datetime.now(pytz.UTC)
+    devices = list_devices(supabase)
+    timezones = {row["device_id"]: row.get("timezone") for row in devices}
+    if device_ids is None:
+        device_ids = sorted(timezones)
+
+    if local_date:
+        targets = [(device_id, local_date) for device_id in device_ids]
+    else:
+        targets = [(device_id, date) for device_id in device_ids
+                   for date in list_uncompacted_dates(supabase, device_id,
+                                                      last_closed_local_date(timezones.get(device_id), now))]
+
+    stats = {"targets": len(targets), "compacted": 0, "skipped": 0, "empty": 0, "deferred": 0, "dry_run": 0,
+             "slots": 0, "bytes": 0, "missing": 0, "errors": 0}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(compact_device_day, s3, supabase, bucket, device_id, date, force, dry_run): (device_id, date)
+            for device_id, date in targets
+        }
+        for future in as_completed(futures):
+            device_id, date = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"❌ Compaction failed for {device_id}/{date}: {e}", file=sys.stderr)
+                stats["errors"] += 1
+                continue
+            stats[result["status"]] += 1
+            if result["status"] in ("compacted", "dry_run"):
+                stats["slots"] += result["slots"]
+                stats["bytes"] += result["bytes"]
+            stats["missing"] += result.get("missing", 0)
+            if emit:
+                emit(result)
+
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="デバイス×日の録音をアーカイブバンドルにまとめる")
+    parser.add_argument("--device", action="append", dest="devices", help="対象デバイスID（複数指定可）")
+    parser.add_argument("--date", help="対象ローカル日付（YYYY-MM-DD、省略時は確定日までの未アーカイブの日すべて）")
+    parser.add_argument("--workers", type=int, default=4, help="並列に処理するデバイス数（デフォルト: 4）")
+    parser.add_argument("--force", action="store_true", help="既存のアーカイブがあっても作り直す")
+    parser.add_argument("--dry-run", action="store_true", help="対象の件数とサイズのみ表示する")
+    args = parser.parse_args(argv)
+
+    if not app.s3_client or not app.supabase_client:
+        print("❌ S3またはSupabaseの環境変数が設定されていません", file=sys.stderr)
+        return 1
+
+    def emit(result):
+        print(json.dumps(result, ensure_ascii=False))
+
+    started = time.perf_counter()
+    stats = compact(
+        app.s3_client,
+        app.supabase_client,
+        app.S3_BUCKET_NAME,
+        device_ids=args.devices,
+        local_date=args.date,
+        workers=args.workers,
+        force=args.force,
+        dry_run=args.dry_run,
+        emit=emit
+    )
+    print(f"📦 コンパクション結果 ({time.perf_counter() - started:.1f}s): {json.dumps(stats)}", file=sys.stderr)
+    return 0 if stats["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
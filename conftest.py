@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+テスト共通の設定とフィクスチャ
+
+app.py はインポート時に環境変数からS3・Supabaseクライアントを初期化するため、
+テストモジュールより先にダミーの環境変数を設定する。
+各テストでは backends フィクスチャでフェイクのクライアントに差し替える
+（登録するデバイスはテストモジュールで devices フィクスチャを上書きして指定する）。
+"""
+
+import sys
+import os
+import json
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# 環境変数の設定（テスト用）
+os.environ['SUPABASE_URL'] = 'https://dummy.supabase.co'
+os.environ['SUPABASE_KEY'] = 'dummy_key'
+os.environ['AWS_ACCESS_KEY_ID'] = 'dummy_key'
+os.environ['AWS_SECRET_ACCESS_KEY'] = 'dummy_key'
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as vault
+from fake_backends import FakeS3Client, FakeSupabaseClient, make_wav
+
+
+@pytest.fixture
+def devices():
+    """devices テーブルの行（テストモジュールで上書きする）"""
+    return []
+
+
+@pytest.fixture
+def backends(monkeypatch, devices):
+    """フェイクのS3・Supabaseに差し替え、インメモリのキャッシュを空にする"""
+    s3 = FakeS3Client()
+    supabase = FakeSupabaseClient({"devices": [dict(device) for device in devices], "audio_files": []})
+    monkeypatch.setattr(vault, "s3_client", s3)
+    monkeypatch.setattr(vault, "supabase_client", supabase)
+    for cache in (vault._response_cache, vault._manifest_cache, vault._coverage_cache,
+                  vault._peaks_cache, vault._archive_index_cache):
+        cache.clear()
+    return s3, supabase
+
+
+@pytest.fixture
+def upload():
+    """/upload にWAVを送信する関数（content を省略すると1秒のWAV）"""
+    client = TestClient(vault.app)
+
+    def post(device_id: str, recorded_at: str, content: bytes = None, filename: str = "audio.wav",
+             headers: dict = None, **metadata):
+        return client.post(
+            "/upload",
+            files={"file": (filename, make_wav() if content is None else content, "audio/wav")},
+            data={"metadata": json.dumps({"device_id": device_id, "recorded_at": recorded_at, **metadata})},
+            headers=headers,
+        )
+
+    return post
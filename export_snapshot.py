@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+audio_files の分析用スナップショット（Parquet）出力
+
+audio_files の行に、S3上のサイズと日次マニフェストの再生時間を付加して、
+デバイス×ローカル日付でパーティション分割した Parquet に書き出す。
+フリート全体の集計は /api/audio-files を経由せず、このスナップショットを読む。
+
+出力レイアウト（Hiveパーティション形式、DuckDB / Athena / pyarrow.dataset でそのまま読める）:
+    {dest}/device_id={device_id}/local_date={YYYY-MM-DD}/part-00000.parquet
+    {dest}/_export_state.json   （デバイスごとに出力済みの最終ローカル日付）
+
+- 既定では前回の出力以降に確定した日（ARCHIVE_GRACE_HOURS を過ぎたローカル日付）を追加し、
+  遅れて届いた行・ステータスの更新を反映するため、出力済みの直近 EXPORT_REEXPORT_DAYS 日も出し直す
+- S3への転送待ち（replication_status = pending）の行がある日は出力するが、出力済みとして記録しない
+  （転送が終わるまで次回以降も出し直す）
+- パーティションは日単位で上書きするため、同じ日を何度出力しても結果は同じ（--force で全期間を出し直し）
+- 出力先は S3（s3://bucket/prefix、既定は vault バケットの analytics/audio_files）またはローカルディレクトリ
+- Parquet の書き出しには pyarrow が必要（APIサーバーの依存関係には含めない）:
+    pip install -r requirements-export.txt
+
+使用方法:
+    python export_snapshot.py                                     # 全デバイスの新しい確定日を追加
+    python export_snapshot.py --dest ./snapshot --device DEVICE_ID
+    python export_snapshot.py --from 2025-11-01 --to 2025-11-10 --force
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import pytz
+from botocore.exceptions import ClientError
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+import app
+from compact_archives import last_closed_local_date, list_devices
+
+# 既定の出力先（files/ 配下ではないためS3イベント通知は発火しない）
+DEFAULT_PREFIX = "analytics/audio_files"
+
+STATE_FILE = "_export_state.json"
+
+# Parquet の圧縮方式
+PARQUET_COMPRESSION = "zstd"
+
+# 前回までに出力済みの日のうち、毎回出し直す直近の日数（遅れて届いた録音・ステータスの更新の反映用）
+EXPORT_REEXPORT_DAYS = 3
+
+AUDIO_FILE_COLUMNS = (
+    "device_id, recorded_at, local_date, local_time, time_block, file_path, file_size_bytes, sha256, "
+    "replication_status, transcriptions_status, behavior_features_status, emotion_features_status, created_at"
+)
+
+# 出力するカラム（順序もこのとおり）
+SNAPSHOT_COLUMNS = [
+    "device_id", "recorded_at", "local_date", "local_time", "time_block", "file_path", "stored",
+    "size_bytes", "duration_seconds", "sha256", "replication_status",
+    "transcriptions_status", "behavior_features_status", "emotion_features_status", "created_at"
+]
+
+
+# =========================================
+# 出力先（S3 / ローカル）
+# =========================================
+class S3Destination:
+    def __init__(self, s3, bucket: str, prefix: str):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def write(self, path: str, body: bytes, content_type: str) -> None:
+        self.s3.put_object(Bucket=self.bucket, Key=f"{self.prefix}/{path}", Body=body, ContentType=content_type)
+
+    def read(self, path: str):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}/{path}")["Body"].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+            raise
+
+
+class LocalDestination:
+    def __init__(self, root: str):
+        self.root = root
+
+    def write(self, path: str, body: bytes, content_type: str) -> None:
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        temp_path = f"{full_path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(body)
+        os.replace(temp_path, full_path)
+
+    def read(self, path: str):
+        try:
+            with open(os.path.join(self.root, path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+def open_destination(dest, s3, bucket: str):
+    """--dest（s3://bucket/prefix またはディレクトリ）から出力先を作成する"""
+    if dest is None:
+        return S3Destination(s3, bucket, DEFAULT_PREFIX)
+    if dest.startswith("s3://"):
+        dest_bucket, _, prefix = dest[len("s3://"):].partition("/")
+        return S3Destination(s3, dest_bucket, prefix or DEFAULT_PREFIX)
+    return LocalDestination(dest)
+
+
+def partition_path(device_id: str, local_date: str) -> str:
+    return f"device_id={device_id}/local_date={local_date}/part-00000.parquet"
+
+
+# =========================================
+# 行の収集
+# =========================================
+def iter_device_rows(supabase, device_id: str, date_from=None, date_to=None, page_size: int = 1000):
+    """デバイスの audio_files 行を recorded_at 順にキーセットページングで返す"""
+    last_recorded_at = None
+    while True:
+        query = supabase.table("audio_files").select(AUDIO_FILE_COLUMNS).eq("device_id", device_id)
+        if date_from:
+            query = query.gte("local_date", date_from)
+        if date_to:
+            query = query.lte("local_date", date_to)
+        if last_recorded_at is not None:
+            query = query.gt("recorded_at", last_recorded_at)
+        rows = query.order("recorded_at").limit(page_size).execute().data
+        yield from rows
+        if len(rows) < page_size:
+            return
+        last_recorded_at = rows[-1]["recorded_at"]
+
+
+def list_object_sizes(s3, bucket: str, prefix: str) -> dict:
+    """プレフィックス配下のオブジェクトサイズを {key: size} で返す"""
+    sizes = {}
+    params = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = s3.list_objects_v2(**params)
+        for obj in response.get("Contents", []):
+            sizes[obj["Key"]] = obj["Size"]
+        if not response.get("IsTruncated"):
+            return sizes
+        params["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def load_manifest_durations(s3, bucket: str, device_id: str, local_date: str) -> dict:
+    """
+    日次マニフェストの再生時間を {recorded_at（UTCのdatetime）: duration_seconds} で返す
+
+    APIサーバーのキャッシュは使わず、出力対象のバケットから直接読む（マニフェストがない日は空）
+    """
+    try:
+        response = s3.get_object(Bucket=bucket, Key=app.get_manifest_key(device_id, local_date))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return {}
+        raise
+    manifest = json.loads(response["Body"].read())
+    # 古いマニフェストの recorded_at はオフセット付きのまま保存されているため、UTCに揃えて照合する
+    return {
+        _parse_timestamp(entry["recorded_at"], utc=True): entry.get("duration_seconds")
+        for entry in manifest.get("files", [])
+    }
+
+
+def build_day_records(s3, bucket: str, device_id: str, local_date: str, rows: list[dict]) -> list[dict]:
+    """
+    1デバイス×日の行にサイズと再生時間を付加してスナップショットの行にする
+
+    - サイズ: audio_files.file_size_bytes（未記録の古い行はS3の一覧から取得）
+    - 再生時間: 日次マニフェストの duration_seconds（マニフェストがない日はNone）
+    """
+    durations = load_manifest_durations(s3, bucket, device_id, local_date)
+
+    # S3パスの日付はUTCのため、1ローカル日は最大2つの日付プレフィックスにまたがる
+    listed = {}
+    records = []
+    for row in rows:
+        file_path = row["file_path"]
+        size_bytes = row.get("file_size_bytes")
+        # discard ポリシーで保存しなかった行は一覧しない（旧形式の skipped/ の行は一覧にないため stored=False になる）
+        if size_bytes is None and app.is_stored_file_path(file_path):
+            prefix = file_path.rsplit("/", 2)[0] + "/"
+            if prefix not in listed:
+                listed[prefix] = list_object_sizes(s3, bucket, prefix)
+            size_bytes = listed[prefix].get(file_path)
+
+        records.append({
+            **{column: row.get(column) for column in SNAPSHOT_COLUMNS},
+            "local_date": local_date,
+            "stored": size_bytes is not None,
+            "size_bytes": size_bytes,
+            "duration_seconds": durations.get(_parse_timestamp(row["recorded_at"], utc=True))
+        })
+    return records
+
+
+# =========================================
+# Parquet
+# =========================================
+def _parse_timestamp(value, utc: bool):
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if utc:
+        return parsed.astimezone(pytz.UTC) if parsed.tzinfo else pytz.UTC.localize(parsed)
+    return parsed.replace(tzinfo=None)
+
+
+def snapshot_schema():
+    return pa.schema([
+        ("device_id", pa.string()),
+        ("recorded_at", pa.timestamp("us", tz="UTC")),
+        ("local_date", pa.date32()),
+        ("local_time", pa.timestamp("us")),
+        ("time_block", pa.string()),
+        ("file_path", pa.string()),
+        ("stored", pa.bool_()),
+        ("size_bytes", pa.int64()),
+        ("duration_seconds", pa.float64()),
+        ("sha256", pa.string()),
+        ("replication_status", pa.string()),
+        ("transcriptions_status", pa.string()),
+        ("behavior_features_status", pa.string()),
+        ("emotion_features_status", pa.string()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+    ])
+
+
+def encode_parquet(records: list[dict]) -> bytes:
+    """スナップショットの行を Parquet（列指向・圧縮）にエンコードする"""
+    if pa is None:
+        raise RuntimeError("pyarrow is required to write Parquet snapshots (pip install -r requirements-export.txt)")
+
+    columns = {column: [record[column] for record in records] for column in SNAPSHOT_COLUMNS}
+    columns["recorded_at"] = [_parse_timestamp(v, utc=True) for v in columns["recorded_at"]]
+    columns["created_at"] = [_parse_timestamp(v, utc=True) for v in columns["created_at"]]
+    columns["local_time"] = [_parse_timestamp(v, utc=False) for v in columns["local_time"]]
+    columns["local_date"] = [datetime.strptime(v, "%Y-%m-%d").date() for v in columns["local_date"]]
+
+    table = pa.Table.from_pydict(columns, schema=snapshot_schema())
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=PARQUET_COMPRESSION)
+    return buffer.getvalue()
+
+
+# =========================================
+# 実行
+# =========================================
+def load_state(destination) -> dict:
+    body = destination.read(STATE_FILE)
+    return json.loads(body) if body else {"devices": {}}
+
+
+def export_device(supabase, s3, bucket: str, destination, device_id: str, date_from, date_to,
+                  dry_run: bool = False) -> dict:
+    """
+    1デバイス分の [date_from, date_to] のローカル日付を出力する
+
+    行は recorded_at 順に読み、デバイスの行を読み終えてからローカル日付ごとにパーティションを書き出す
+    （タイムゾーンの変更でローカル日付が前の日に戻ることがあるため、途中では書き出さない）
+    """
+    result = {"device_id": device_id, "date_from": date_from, "date_to": date_to,
+              "partitions": 0, "rows": 0, "bytes": 0, "last_local_date": None, "first_pending_date": None}
+
+    def flush(local_date: str, rows: list[dict]) -> None:
+        records = build_day_records(s3, bucket, device_id, local_date, rows)
+        result["partitions"] += 1
+        result["rows"] += len(records)
+        result["last_local_date"] = max(result["last_local_date"] or local_date, local_date)
+        if dry_run:
+            return
+        body = encode_parquet(records)
+        destination.write(partition_path(device_id, local_date), body, "application/vnd.apache.parquet")
+        result["bytes"] += len(body)
+
+    days = {}
+    for row in iter_device_rows(supabase, device_id, date_from, date_to):
+        local_date = str(row["local_date"])[:10] if row.get("local_date") else None
+        if local_date is None:
+            # local_date がない行は backfill_local_time.py で補完してから出力する
+            continue
+        if row.get("replication_status") == "pending" and \
+                (result["first_pending_date"] is None or local_date < result["first_pending_date"]):
+            result["first_pending_date"] = local_date
+        days.setdefault(local_date, []).append(row)
+    for local_date in sorted(days):
+        flush(local_date, days.pop(local_date))
+
+    return result
+
+
+def export(supabase, s3, bucket: str, destination, device_ids=None, date_from=None, date_to=None,
+           force: bool = False, workers: int = 4, dry_run: bool = False, now=None, emit=None) -> dict:
+    """
+    スナップショットを出力する
+
+    Args:
+        destination: 出力先（S3Destination / LocalDestination）
+        date_from: 出力する最初のローカル日付（Noneの場合は前回出力した日の EXPORT_REEXPORT_DAYS 日前から）
+        date_to: 出力する最後のローカル日付（Noneの場合はデバイスごとの直近の確定日）
+        force: 前回の出力状態を無視して出力し直す
+        emit: デバイスごとの結果を受け取るコールバック（スレッドセーフに呼び出される）
+
+    Returns:
+        dict: 件数の集計
+    """
+    now = now or datetime.now(pytz.UTC)
+    devices = list_devices(supabase)
+    timezones = {row["device_id"]: row.get("timezone") for row in devices}
+    if device_ids is None:
+        device_ids = sorted(timezones)
+
+    state = load_state(destination)
+    state_lock = threading.Lock()
+    stats = {"devices": len(device_ids), "partitions": 0, "rows": 0, "bytes": 0, "errors": 0}
+
+    def plan(device_id: str):
+        start = date_from
+        last_exported = state["devices"].get(device_id, {}).get("last_local_date")
+        if start is None and last_exported and not force:
+            start = (datetime.strptime(last_exported, "%Y-%m-%d")
+                     - timedelta(days=EXPORT_REEXPORT_DAYS - 1)).strftime("%Y-%m-%d")
+        end = date_to or last_closed_local_date(timezones.get(device_id), now)
+        return start, end
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for device_id in device_ids:
+            start, end = plan(device_id)
+            if start is not None and start > end:
+                continue
+            future = executor.submit(export_device, supabase, s3, bucket, destination, device_id, start, end, dry_run)
+            futures[future] = device_id
+
+        for future in as_completed(futures):
+            device_id = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"❌ Export failed for device {device_id}: {e}", file=sys.stderr)
+                stats["errors"] += 1
+                continue
+            stats["partitions"] += result["partitions"]
+            stats["rows"] += result["rows"]
+            stats["bytes"] += result["bytes"]
+
+            # 確定日まで出力したデバイスは次回その日まで出力済みとして扱う（範囲指定の出し直しでは後退させない）
+            # S3への転送待ちの行がある日は、その前日までを出力済みとする
+            if not dry_run:
+                exported_to = result["date_to"]
+                if result["first_pending_date"]:
+                    exported_to = min(exported_to, (datetime.strptime(result["first_pending_date"], "%Y-%m-%d")
+                                                    - timedelta(days=1)).strftime("%Y-%m-%d"))
+                with state_lock:
+                    device_state = state["devices"].setdefault(device_id, {})
+                    watermark = max(filter(None, [device_state.get("last_local_date"), exported_to]))
+                    device_state["last_local_date"] = watermark
+                    device_state["exported_at"] = now.isoformat()
+            if emit:
+                emit(result)
+
+    if not dry_run:
+        destination.write(STATE_FILE, json.dumps(state, ensure_ascii=False, indent=2).encode("utf-8"), "application/json")
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="audio_files の Parquet スナップショットを出力する")
+    parser.add_argument("--dest", help=f"出力先（s3://bucket/prefix またはディレクトリ、省略時は s3://{{S3_BUCKET_NAME}}/{DEFAULT_PREFIX}）")
+    parser.add_argument("--device", action="append", dest="devices", help="対象デバイスID（複数指定可）")
+    parser.add_argument("--from", dest="date_from", help="出力する最初のローカル日付（YYYY-MM-DD、省略時は前回の続き＋直近の出し直し）")
+    parser.add_argument("--to", dest="date_to", help="出力する最後のローカル日付（YYYY-MM-DD、省略時は直近の確定日）")
+    parser.add_argument("--force", action="store_true", help="前回の出力状態を無視して出力し直す")
+    parser.add_argument("--workers", type=int, default=4, help="並列に処理するデバイス数（デフォルト: 4）")
+    parser.add_argument("--dry-run", action="store_true", help="書き込まずに対象のパーティション数・行数のみ表示する")
+    args = parser.parse_args(argv)
+
+    if not app.s3_client or not app.supabase_client:
+        print("❌ S3またはSupabaseの環境変数が設定されていません", file=sys.stderr)
+        return 1
+    if pa is None and not args.dry_run:
+        print("❌ pyarrow がインストールされていません（pip install -r requirements-export.txt）", file=sys.stderr)
+        return 1
+
+    def emit(result):
+        print(json.dumps(result, ensure_ascii=False))
+
+    started = time.perf_counter()
+    stats = export(
+        app.supabase_client,
+        app.s3_client,
+        app.S3_BUCKET_NAME,
+        open_destination(args.dest, app.s3_client, app.S3_BUCKET_NAME),
+        device_ids=args.devices,
+        date_from=args.date_from,
+        date_to=args.date_to,
+        force=args.force,
+        workers=args.workers,
+        dry_run=args.dry_run,
+        emit=emit
+    )
+    print(f"📦 スナップショット出力結果 ({time.perf_counter() - started:.1f}s): {json.dumps(stats)}", file=sys.stderr)
+    return 0 if stats["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+テスト・ベンチマーク用のS3/SQS/Supabaseフェイク実装
+
+app.py が使用する boto3 S3・SQSクライアントと Supabase クライアントの
+インターフェースのうち、必要な部分だけをインメモリで再現する。
+テスト用の音声データ（make_wav）もここで生成する。
+"""
+
+from datetime import datetime
+import copy
+import hashlib
+import base64
+import bisect
+import io
+import re
+import time
+import wave
+
+import pytz
+from botocore.exceptions import ClientError
+
+
+def _client_error(code: str, operation: str, message: str = "") -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message or code}}, operation)
+
+
+# =========================================
+# 音声データ
+# =========================================
+def make_wav(seconds: float = 1.0, frame_rate: int = 16000) -> bytes:
+    """WatchMe仕様（mono / 16-bit）の無音に近いWAVを生成する"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(frame_rate)
+        wav.writeframes(b'\x01\x00' * int(seconds * frame_rate))
+    return buffer.getvalue()
+
+
+# =========================================
+# S3
+# =========================================
+class FakeStreamingBody(io.BytesIO):
+    """botocore.response.StreamingBody 相当（read / iter_chunks）"""
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+class FakeS3Client:
+    """boto3 S3クライアントのインメモリ実装"""
+
+    # 復元するまでGET・コピーできないストレージクラス
+    RESTORE_CLASSES = ("GLACIER", "DEEP_ARCHIVE")
+
+    def __init__(self, put_delay: float = 0.0):
+        # {(bucket, key): {"Body": bytes, "ContentType": str, ...}}
+        self.objects = {}
+        self.calls = []
+        self._sorted_keys = None
+        # put_object ごとの擬似的な転送時間（秒）
+        self.put_delay = put_delay
+        # get_bucket_notification_configuration が返す設定
+        self.notification_configuration = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, StorageClass="STANDARD", ChecksumSHA256=None, **kwargs):
+        self.calls.append(("put_object", Key))
+        if self.put_delay:
+            time.sleep(self.put_delay)
+        if hasattr(Body, "read"):
+            Body = Body.read()
+        if ChecksumSHA256 is not None and base64.b64encode(hashlib.sha256(Body).digest()).decode() != ChecksumSHA256:
+            raise _client_error("BadDigest", "PutObject", "The SHA256 you specified did not match the calculated checksum.")
+        if (Bucket, Key) not in self.objects:
+            self._sorted_keys = None
+        self.objects[(Bucket, Key)] = {
+            "Body": bytes(Body),
+            "ContentType": ContentType,
+            "StorageClass": StorageClass,
+            "LastModified": datetime.now(pytz.UTC),
+            "ETag": f'"{hashlib.md5(bytes(Body)).hexdigest()}"',
+            "ChecksumSHA256": ChecksumSHA256,
+            **kwargs,
+        }
+        return {"ETag": self.objects[(Bucket, Key)]["ETag"], "ResponseMetadata": {"HTTPStatusCode": 200, "RetryAttempts": 0}}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        """boto3 の upload_file 相当（マルチパートは区別せず1回のPUTとして保存）"""
+        self.calls.append(("upload_file", Key))
+        extra_args = {k: v for k, v in (ExtraArgs or {}).items() if k != "ChecksumAlgorithm"}
+        with open(Filename, "rb") as f:
+            self.put_object(Bucket=Bucket, Key=Key, Body=f.read(), **extra_args)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self.calls.append(("head_object", Key))
+        obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise _client_error("404", "HeadObject", "Not Found")
+        return {
+            "ContentLength": len(obj["Body"]),
+            "ContentType": obj["ContentType"],
+            "LastModified": obj["LastModified"],
+            "StorageClass": obj["StorageClass"],
+            "ETag": obj["ETag"],
+            **({"Restore": obj["Restore"]} if obj.get("Restore") else {}),
+        }
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.calls.append(("get_object", Key))
+        obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise _client_error("NoSuchKey", "GetObject", "The specified key does not exist.")
+        if obj["StorageClass"] in self.RESTORE_CLASSES and 'ongoing-request="false"' not in (obj.get("Restore") or ""):
+            raise _client_error("InvalidObjectState", "GetObject", "The operation is not valid for the object's storage class")
+        body = obj["Body"]
+        response = {
+            "ContentType": obj["ContentType"],
+            "LastModified": obj["LastModified"],
+            "ETag": obj["ETag"],
+        }
+        match = re.match(r"bytes=(\d*)-(\d*)$", kwargs.get("Range") or "")
+        if match:
+            size = len(body)
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start, end = max(size - int(match.group(2)), 0), size - 1
+            response["ContentRange"] = f"bytes {start}-{end}/{size}"
+            body = body[start:end + 1]
+        response["Body"] = FakeStreamingBody(body)
+        response["ContentLength"] = len(body)
+        return response
+
+    def copy_object(self, Bucket, Key, CopySource, StorageClass="STANDARD", **kwargs):
+        """同一バケット内のコピー（ストレージクラスの変更）のみ再現する"""
+        self.calls.append(("copy_object", Key))
+        source = self.objects.get((CopySource["Bucket"], CopySource["Key"]))
+        if source is None:
+            raise _client_error("NoSuchKey", "CopyObject", "The specified key does not exist.")
+        if source["StorageClass"] in self.RESTORE_CLASSES:
+            raise _client_error("InvalidObjectState", "CopyObject", "The source object is archived")
+        self.objects[(Bucket, Key)] = {
+            **source,
+            "StorageClass": StorageClass,
+            "LastModified": datetime.now(pytz.UTC),
+        }
+        return {"CopyObjectResult": {"ETag": source["ETag"]}}
+
+    def restore_object(self, Bucket, Key, RestoreRequest=None, **kwargs):
+        """復元を要求すると復元中になる（complete_restore で完了させる）"""
+        self.calls.append(("restore_object", Key))
+        obj = self.objects.get((Bucket, Key))
+        if obj is None:
+            raise _client_error("NoSuchKey", "RestoreObject", "The specified key does not exist.")
+        if obj["StorageClass"] not in self.RESTORE_CLASSES:
+            raise _client_error("InvalidObjectState", "RestoreObject", "Restore is not allowed for the object's storage class")
+        if obj.get("Restore") == 'ongoing-request="true"':
+            raise _client_error("RestoreAlreadyInProgress", "RestoreObject", "Object restore is already in progress")
+        obj["Restore"] = 'ongoing-request="true"'
+        return {"ResponseMetadata": {"HTTPStatusCode": 202}}
+
+    def complete_restore(self, Bucket, Key, expiry_date="Fri, 21 Nov 2025 00:00:00 GMT"):
+        self.objects[(Bucket, Key)]["Restore"] = f'ongoing-request="false", expiry-date="{expiry_date}"'
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.calls.append(("delete_object", Key))
+        if self.objects.pop((Bucket, Key), None) is not None:
+            self._sorted_keys = None
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, MaxKeys=1000, ContinuationToken=None, StartAfter=None, **kwargs):
+        self.calls.append(("list_objects_v2", Prefix))
+        if self._sorted_keys is None:
+            self._sorted_keys = sorted(self.objects)
+        start_after = ContinuationToken or StartAfter or ""
+        index = bisect.bisect_right(self._sorted_keys, (Bucket, max(Prefix, start_after)))
+        if not start_after or start_after < Prefix:
+            index = bisect.bisect_left(self._sorted_keys, (Bucket, Prefix))
+
+        contents, prefixes, last_key = [], [], None
+        while index < len(self._sorted_keys) and len(contents) + len(prefixes) < MaxKeys:
+            bucket, key = self._sorted_keys[index]
+            if bucket != Bucket or not key.startswith(Prefix):
+                break
+            if Delimiter and Delimiter in key[len(Prefix):]:
+                common = key[:key.index(Delimiter, len(Prefix)) + len(Delimiter)]
+                prefixes.append({"Prefix": common})
+                last_key = common + "\U0010ffff"
+                index = bisect.bisect_right(self._sorted_keys, (Bucket, last_key))
+                continue
+            obj = self.objects[(bucket, key)]
+            contents.append({
+                "Key": key,
+                "Size": len(obj["Body"]),
+                "LastModified": obj["LastModified"],
+                "ETag": obj["ETag"],
+                "StorageClass": obj["StorageClass"],
+            })
+            last_key = key
+            index += 1
+
+        truncated = (
+            index < len(self._sorted_keys)
+            and self._sorted_keys[index][0] == Bucket
+            and self._sorted_keys[index][1].startswith(Prefix)
+        )
+        response = {"KeyCount": len(contents) + len(prefixes), "IsTruncated": truncated}
+        if contents:
+            response["Contents"] = contents
+        if prefixes:
+            response["CommonPrefixes"] = prefixes
+        if truncated:
+            response["NextContinuationToken"] = last_key
+        return response
+
+    def get_bucket_notification_configuration(self, Bucket, **kwargs):
+        self.calls.append(("get_bucket_notification_configuration", Bucket))
+        return copy.deepcopy(self.notification_configuration)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return f"https://fake-s3/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+# =========================================
+# SQS
+# =========================================
+class FakeSQSClient:
+    """send_message_batch のみを再現する（fail_ids に含まれるIdのエントリは失敗として返す）"""
+
+    def __init__(self):
+        self.messages = []
+        self.calls = []
+        self.fail_ids = set()
+
+    def send_message_batch(self, QueueUrl, Entries):
+        if len(Entries) > 10:
+            raise _client_error("AWS.SimpleQueueService.TooManyEntriesInBatchRequest", "SendMessageBatch")
+        self.calls.append(("send_message_batch", QueueUrl, len(Entries)))
+        successful, failed = [], []
+        for entry in Entries:
+            if entry["Id"] in self.fail_ids:
+                failed.append({"Id": entry["Id"], "SenderFault": False, "Code": "InternalError"})
+            else:
+                self.messages.append(entry)
+                successful.append({"Id": entry["Id"], "MessageId": f"msg-{len(self.messages)}"})
+        response = {"Successful": successful}
+        if failed:
+            response["Failed"] = failed
+        return response
+
+
+# =========================================
+# Supabase
+# =========================================
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    """supabase-py のクエリビルダーのインメモリ実装"""
+
+    def __init__(self, client, table_name):
+        self.client = client
+        self.table_name = table_name
+        self.equals = []
+        self.filters = []
+        self.orders = []
+        self.start = None
+        self.end = None
+        self.operation = "select"
+        self.payload = None
+        self.columns = "*"
+
+    @property
+    def rows(self):
+        return self.client.tables.setdefault(self.table_name, [])
+
+    # --- 操作 ---
+    def select(self, columns="*", **kwargs):
+        self.operation = "select"
+        self.columns = columns
+        return self
+
+    def insert(self, payload):
+        self.operation = "insert"
+        self.payload = payload
+        return self
+
+    def update(self, payload, **kwargs):
+        self.operation = "update"
+        self.payload = payload
+        return self
+
+    def upsert(self, payload, on_conflict="", **kwargs):
+        self.operation = "upsert"
+        self.payload = payload
+        self.conflict_columns = [c.strip() for c in on_conflict.split(",") if c.strip()]
+        return self
+
+    # --- フィルター ---
+    def eq(self, column, value):
+        self.equals.append((column, value))
+        return self
+
+    def neq(self, column, value):
+        self.filters.append(lambda row: row.get(column) != value)
+        return self
+
+    def gt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) > value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) < value)
+        return self
+
+    def is_(self, column, value):
+        # PostgREST の is.null のみ対応
+        self.filters.append(lambda row: row.get(column) is None if value == "null" else row.get(column) == value)
+        return self
+
+    def in_(self, column, values):
+        values = set(values)
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def gte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) >= value)
+        return self
+
+    def lte(self, column, value):
+        self.filters.append(lambda row: row.get(column) is not None and row.get(column) <= value)
+        return self
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def range(self, start, end):
+        self.start, self.end = start, end
+        return self
+
+    def limit(self, count):
+        self.start, self.end = 0, count - 1
+        return self
+
+    # --- 実行 ---
+    def _filtered(self):
+        rows = self.rows
+        for column, value in self.equals:
+            rows = [row for row in rows if row.get(column) == value]
+        return [row for row in rows if all(f(row) for f in self.filters)]
+
+    def _matching(self):
+        rows = self._filtered()
+        for column, desc in reversed(self.orders):
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        if self.start is not None:
+            rows = rows[self.start:self.end + 1]
+        return rows
+
+    def _project(self, row):
+        columns = [c.strip() for c in self.columns.replace("\n", " ").split(",") if c.strip()]
+        if columns == ["*"]:
+            return dict(row)
+        return {c: row.get(c) for c in columns}
+
+    def execute(self):
+        self.client.calls.append((self.operation, self.table_name))
+        if self.operation == "insert":
+            payloads = self.payload if isinstance(self.payload, list) else [self.payload]
+            inserted = []
+            for payload in payloads:
+                row = copy.deepcopy(payload)
+                row.setdefault("created_at", datetime.now(pytz.UTC).isoformat())
+                self.rows.append(row)
+                inserted.append(dict(row))
+            return FakeResult(inserted)
+        if self.operation == "upsert":
+            payloads = self.payload if isinstance(self.payload, list) else [self.payload]
+            upserted = []
+            for payload in payloads:
+                key = tuple(payload.get(c) for c in self.conflict_columns)
+                existing = next((row for row in self.rows
+                                 if tuple(row.get(c) for c in self.conflict_columns) == key), None)
+                if existing is None:
+                    existing = {"created_at": datetime.now(pytz.UTC).isoformat()}
+                    self.rows.append(existing)
+                existing.update(copy.deepcopy(payload))
+                upserted.append(dict(existing))
+            return FakeResult(upserted)
+        if self.operation == "update":
+            updated = []
+            for row in self._filtered():
+                row.update(copy.deepcopy(self.payload))
+                updated.append(dict(row))
+            return FakeResult(updated)
+        return FakeResult([self._project(row) for row in self._matching()])
+
+
+class FakeSupabaseClient:
+    """supabase-py クライアントのインメモリ実装"""
+
+    def __init__(self, tables=None):
+        self.tables = tables or {}
+        self.calls = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
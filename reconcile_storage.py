@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+S3（files/）とSupabase（audio_files）の一括突合スクリプト
+
+デバイスごとに S3 の files/{device_id}/ プレフィックスと audio_files の行を
+どちらも file_path 順のストリームとして読み出し、ソート済みマージジョインで比較する。
+デバイス単位で並列に処理し、メモリ使用量はページサイズ×並列数に収まる。
+
+検出する不整合:
+    - orphan_object : S3にあるがaudio_filesに行がない
+    - missing_object: audio_filesに行があるがS3にオブジェクトがない
+    - size_mismatch : audio_files.file_size_bytes とS3のサイズが異なる
+
+--repair を指定すると以下を自動修復する:
+    - orphan_object : パス（デバイスのタイムゾーンの日時）からrecorded_atを復元し、
+                      local_date / local_time / time_block / sha256 を付けてaudio_filesに登録
+    - size_mismatch : audio_files.file_size_bytes をS3のサイズで更新
+    （missing_object は復元できないためレポートのみ）
+
+使用方法:
+    python reconcile_storage.py                          # 全デバイス
+    python reconcile_storage.py --device DEVICE_ID       # 特定デバイスのみ
+    python reconcile_storage.py --repair --output findings.ndjson
+"""
+
+import sys
+import re
+import hashlib
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import pytz
+
+import app
+from app import calculate_local_datetime, calculate_time_block
+
+S3_FILES_PREFIX = "files/"
+
+# orphan_object の sha256 を計算するときの読み出しチャンクサイズ
+READ_CHUNK_SIZE = 1024 * 1024
+
+# files/{device_id}/{YYYY-MM-DD}/{HH-MM-SS}/audio.wav
+FILE_PATH_PATTERN = re.compile(
+    r'^files/(?P<device_id>[^/]+)/(?P<date>\d{4}-\d{2}-\d{2})/(?P<time>\d{2}-\d{2}-\d{2})/audio\.wav$'
+)
+
+
+# =========================================
+# ストリーム読み出し
+# =========================================
+def list_device_ids(s3, bucket: str, prefix: str = S3_FILES_PREFIX) -> list[str]:
+    """S3の files/ 直下のプレフィックス（デバイスID）一覧を取得する"""
+    device_ids = []
+    params = {"Bucket": bucket, "Prefix": prefix, "Delimiter": "/"}
+    while True:
+        response = s3.list_objects_v2(**params)
+        for common in response.get("CommonPrefixes", []):
+            device_ids.append(common["Prefix"][len(prefix):].rstrip("/"))
+        if not response.get("IsTruncated"):
+            return device_ids
+        params["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def iter_s3_objects(s3, bucket: str, prefix: str):
+    """プレフィックス配下のオブジェクトを (key, size) としてキー順に返す"""
+    params = {"Bucket": bucket, "Prefix": prefix}
+    while True:
+        response = s3.list_objects_v2(**params)
+        for obj in response.get("Contents", []):
+            yield obj["Key"], obj["Size"]
+        if not response.get("IsTruncated"):
+            return
+        params["ContinuationToken"] = response["NextContinuationToken"]
+
+
+def iter_audio_file_rows(supabase, device_id: str, page_size: int = 1000):
+    """
+    デバイスのaudio_files行を file_path 順にキーセットページングで返す
+
+    files/ 以外のパス（SKIP時の skipped/ など）は突合対象外として読み飛ばす
+    """
+    last_file_path = None
+    while True:
+        query = supabase.table("audio_files").select("*").eq("device_id", device_id)
+        if last_file_path is not None:
+            query = query.gt("file_path", last_file_path)
+        rows = query.order("file_path").limit(page_size).execute().data
+
+        for row in rows:
+            if row["file_path"].startswith(S3_FILES_PREFIX):
+                yield row
+
+        if len(rows) < page_size:
+            return
+        last_file_path = rows[-1]["file_path"]
+
+
+# =========================================
+# 突合（ソート済みマージジョイン）
+# =========================================
+def merge_join(objects, rows):
+    """
+    (key, size) のストリームと audio_files 行のストリームを突き合わせ、不整合を返す
+
+    どちらの入力も file_path（キー）の昇順であること
+    """
+    sentinel = object()
+    obj = next(objects, sentinel)
+    row = next(rows, sentinel)
+
+    while obj is not sentinel or row is not sentinel:
+        if row is sentinel or (obj is not sentinel and obj[0] < row["file_path"]):
+            yield {"type": "orphan_object", "file_path": obj[0], "s3_size_bytes": obj[1]}
+            obj = next(objects, sentinel)
+        elif obj is sentinel or row["file_path"] < obj[0]:
+            yield {"type": "missing_object", "file_path": row["file_path"], "device_id": row["device_id"], "recorded_at": row.get("recorded_at")}
+            row = next(rows, sentinel)
+        else:
+            recorded_size = row.get("file_size_bytes")
+            if recorded_size is not None and recorded_size != obj[1]:
+                yield {
+                    "type": "size_mismatch",
+                    "file_path": obj[0],
+                    "device_id": row["device_id"],
+                    "recorded_at": row.get("recorded_at"),
+                    "s3_size_bytes": obj[1],
+                    "recorded_size_bytes": recorded_size
+                }
+            obj = next(objects, sentinel)
+            row = next(rows, sentinel)
+
+
+# =========================================
+# 自動修復
+# =========================================
+def recorded_at_from_path(file_path: str, timezone: str = "UTC") -> datetime:
+    """
+    S3パスからrecorded_at（UTC）を復元する
+
+    /upload はクライアントが送った recorded_at の日時をオフセットのままパスにするため、
+    パスの日時はデバイスのタイムゾーンの時刻として解釈する
+    """
+    match = FILE_PATH_PATTERN.match(file_path)
+    if not match:
+        raise ValueError(f"Unexpected file path: {file_path}")
+    naive = datetime.strptime(f"{match['date']} {match['time']}", "%Y-%m-%d %H-%M-%S")
+    return pytz.timezone(timezone).localize(naive).astimezone(pytz.UTC)
+
+
+def object_sha256(s3, bucket: str, file_path: str) -> str:
+    """オブジェクトのSHA-256をチャンク単位で読み出して計算する"""
+    digest = hashlib.sha256()
+    for chunk in s3.get_object(Bucket=bucket, Key=file_path)["Body"].iter_chunks(READ_CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def repair_finding(s3, bucket: str, supabase, finding: dict, timezones: dict) -> bool:
+    """不整合を修復する（修復した場合True）"""
+    if finding["type"] == "orphan_object":
+        match = FILE_PATH_PATTERN.match(finding["file_path"])
+        if not match:
+            return False
+        device_id = match["device_id"]
+        if device_id not in timezones:
+            devices = supabase.table("devices").select("timezone").eq("device_id", device_id).execute().data
+            timezones[device_id] = (devices[0].get("timezone") if devices else None) or "UTC"
+        recorded_at = recorded_at_from_path(finding["file_path"], timezones[device_id])
+        local_date, local_time = calculate_local_datetime(recorded_at, timezones[device_id])
+        # /upload が登録する行と同じ派生カラムを埋める
+        supabase.table("audio_files").insert({
+            "device_id": device_id,
+            "recorded_at": recorded_at.isoformat(),
+            "local_date": local_date,
+            "local_time": local_time.isoformat(),
+            "time_block": calculate_time_block(local_time),
+            "file_path": finding["file_path"],
+            "file_size_bytes": finding["s3_size_bytes"],
+            "sha256": object_sha256(s3, bucket, finding["file_path"])
+        }).execute()
+        return True
+
+    if finding["type"] == "size_mismatch":
+        supabase.table("audio_files").update({
+            "file_size_bytes": finding["s3_size_bytes"]
+        }).eq("device_id", finding["device_id"]).eq("recorded_at", finding["recorded_at"]).execute()
+        return True
+
+    return False
+
+
+# =========================================
+# 実行
+# =========================================
+def reconcile(s3, supabase, bucket: str, device_ids=None, workers: int = 8, page_size: int = 1000,
+              repair: bool = False, emit=None) -> dict:
+    """
+    S3とaudio_filesを突合する
+
+    Args:
+        s3: boto3 S3クライアント
+        supabase: Supabaseクライアント
+        bucket: S3バケット名
+        device_ids: 対象デバイスID（Noneの場合はS3とdevicesテーブルの全デバイス）
+        workers: 並列に処理するデバイス数
+        page_size: audio_filesの1ページあたりの行数
+        repair: 自動修復を行うかどうか
+        emit: 不整合を1件ずつ受け取るコールバック（スレッドセーフに呼び出される）
+
+    Returns:
+        dict: 件数の集計
+    """
+    if device_ids is None:
+        device_ids = set(list_device_ids(s3, bucket))
+        devices = supabase.table("devices").select("device_id").execute().data
+        device_ids.update(row["device_id"] for row in devices)
+        device_ids = sorted(device_ids)
+
+    stats = {
+        "devices": len(device_ids),
+        "objects": 0,
+        "rows": 0,
+        "orphan_object": 0,
+        "missing_object": 0,
+        "size_mismatch": 0,
+        "repaired": 0,
+        "errors": 0
+    }
+    lock = threading.Lock()
+    timezones = {}
+
+    def reconcile_device(device_id: str) -> None:
+        counts = {"objects": 0, "rows": 0}
+
+        def count(iterable, name):
+            for item in iterable:
+                counts[name] += 1
+                yield item
+
+        objects = count(iter_s3_objects(s3, bucket, f"{S3_FILES_PREFIX}{device_id}/"), "objects")
+        rows = count(iter_audio_file_rows(supabase, device_id, page_size), "rows")
+
+        for finding in merge_join(objects, rows):
+            repaired = False
+            if repair:
+                try:
+                    repaired = repair_finding(s3, bucket, supabase, finding, timezones)
+                except Exception as e:
+                    print(f"❌ Repair failed for {finding['file_path']}: {e}", file=sys.stderr)
+            finding["repaired"] = repaired
+            with lock:
+                stats[finding["type"]] += 1
+                stats["repaired"] += int(repaired)
+                if emit:
+                    emit(finding)
+
+        with lock:
+            stats["objects"] += counts["objects"]
+            stats["rows"] += counts["rows"]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(reconcile_device, device_id): device_id for device_id in device_ids}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"❌ Reconciliation failed for device {futures[future]}: {e}", file=sys.stderr)
+                with lock:
+                    stats["errors"] += 1
+
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="S3とaudio_filesの一括突合")
+    parser.add_argument("--device", action="append", dest="devices", help="対象デバイスID（複数指定可）")
+    parser.add_argument("--workers", type=int, default=8, help="並列に処理するデバイス数（デフォルト: 8）")
+    parser.add_argument("--page-size", type=int, default=1000, help="audio_filesの1ページあたりの行数（デフォルト: 1000）")
+    parser.add_argument("--repair", action="store_true", help="orphan_object / size_mismatch を自動修復する")
+    parser.add_argument("--output", help="不整合をNDJSONで書き出すファイル（省略時は標準出力）")
+    args = parser.parse_args(argv)
+
+    if not app.s3_client or not app.supabase_client:
+        print("❌ S3またはSupabaseの環境変数が設定されていません", file=sys.stderr)
+        return 1
+
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+
+    def emit(finding):
+        output.write(json.dumps(finding, ensure_ascii=False) + "\n")
+
+    started = time.perf_counter()
+    try:
+        stats = reconcile(
+            app.s3_client,
+            app.supabase_client,
+            app.S3_BUCKET_NAME,
+            device_ids=args.devices,
+            workers=args.workers,
+            page_size=args.page_size,
+            repair=args.repair,
+            emit=emit
+        )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    print(f"📊 突合結果 ({time.perf_counter() - started:.1f}s): {json.dumps(stats)}", file=sys.stderr)
+    return 0 if stats["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
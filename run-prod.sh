@@ -66,8 +66,8 @@ echo -e "${BLUE}🗑️  Step 3: 既存コンテナを完全削除中...${NC}"
 echo "  📦 実行中コンテナの検索..."
 RUNNING_CONTAINERS=$(docker ps -q --filter "name=${CONTAINER_NAME}")
 if [ ! -z "$RUNNING_CONTAINERS" ]; then
-    echo "  ⏸️  実行中コンテナを停止中..."
-    docker stop $RUNNING_CONTAINERS
+    echo "  ⏸️  実行中コンテナを停止中（実行中のアップロードのドレインを最大90秒待機）..."
+    docker stop -t 90 $RUNNING_CONTAINERS
     echo -e "  ${GREEN}✅ コンテナを停止しました${NC}"
 else
     echo "  ℹ️  実行中のコンテナは見つかりませんでした"
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+管理者用診断エンドポイント（/api/admin/profile, /api/admin/tracemalloc/*）のテスト
+"""
+
+import threading
+import tracemalloc
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as vault
+
+ADMIN_HEADERS = {"X-Admin-Token": "secret"}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(vault, "ADMIN_TOKEN", "secret")
+    yield TestClient(vault.app)
+    tracemalloc.stop()
+
+
+def busy_loop_for_profile(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_admin_endpoints_require_token(client, monkeypatch):
+    assert client.get("/api/admin/profile?seconds=0.1").status_code == 403
+    assert client.get("/api/admin/profile?seconds=0.1", headers={"X-Admin-Token": "wrong"}).status_code == 403
+
+    monkeypatch.setattr(vault, "ADMIN_TOKEN", None)
+    assert client.post("/api/admin/tracemalloc/start", headers=ADMIN_HEADERS).status_code == 404
+
+
+def test_profile_returns_folded_stacks(client):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop_for_profile, args=(stop,))
+    worker.start()
+    try:
+        response = client.get("/api/admin/profile?seconds=0.3&interval_ms=5", headers=ADMIN_HEADERS)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert response.status_code == 200
+    assert int(response.headers["X-Profile-Samples"]) > 0
+    lines = response.text.splitlines()
+    stack, count = lines[0].rsplit(" ", 1)
+    assert int(count) > 0
+    assert any("busy_loop_for_profile (test_admin_diagnostics.py" in line for line in lines)
+
+
+def test_tracemalloc_snapshot_and_diff(client):
+    assert client.get("/api/admin/tracemalloc/snapshot", headers=ADMIN_HEADERS).status_code == 409
+    assert client.post("/api/admin/tracemalloc/start?frames=5", headers=ADMIN_HEADERS).json()["tracing"] is True
+
+    first = client.get("/api/admin/tracemalloc/snapshot?limit=5", headers=ADMIN_HEADERS).json()
+    retained = [bytearray(1024) for _ in range(2000)]
+    diff = client.get("/api/admin/tracemalloc/snapshot?diff=true&limit=5", headers=ADMIN_HEADERS).json()
+
+    assert len(first["top"]) <= 5
+    assert diff["diff"] is True
+    assert diff["top"][0]["size_diff_bytes"] >= 1024 * 2000
+    assert any("test_admin_diagnostics.py" in frame for frame in diff["top"][0]["traceback"])
+    del retained
+
+    assert client.post("/api/admin/tracemalloc/stop", headers=ADMIN_HEADERS).json()["tracing"] is False
+    assert not tracemalloc.is_tracing()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+/api/audio-files/export（NDJSON/CSVストリーミングエクスポート）のテスト
+"""
+
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as vault
+
+
+@pytest.fixture
+def backends(backends):
+    s3, supabase = backends
+    rows = supabase.tables["audio_files"]
+    start = datetime(2025, 11, 1)
+    for i in range(250):
+        recorded_at = start + timedelta(minutes=30 * (i // 2))
+        # 2台のデバイスが同じrecorded_atで録音している
+        device_id = f"dev-{i % 2}"
+        key = f"files/{device_id}/{recorded_at:%Y-%m-%d}/{recorded_at:%H-%M-%S}/audio.wav"
+        rows.append({
+            "device_id": device_id,
+            "recorded_at": recorded_at.isoformat() + "+00:00",
+            "local_date": f"{recorded_at:%Y-%m-%d}",
+            "file_path": key,
+            "transcriptions_status": "pending",
+        })
+        if i % 10:
+            s3.put_object(Bucket=vault.S3_BUCKET_NAME, Key=key, Body=b"x" * 8)
+    return s3, supabase
+
+
+def test_ndjson_export_pages_through_all_rows(backends):
+    _, supabase = backends
+    client = TestClient(vault.app)
+
+    response = client.get("/api/audio-files/export", params={"page_size": 7})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 250
+    assert len({(r["device_id"], r["recorded_at"]) for r in rows}) == 250
+    assert [r["recorded_at"] for r in rows] == sorted(r["recorded_at"] for r in rows)
+    assert len([call for call in supabase.calls if call == ("select", "audio_files")]) > 30
+
+
+def test_csv_export_with_filters_and_s3_info(backends):
+    client = TestClient(vault.app)
+
+    response = client.get("/api/audio-files/export", params={
+        "format": "csv",
+        "device_id": "dev-0",
+        "date_from": "2025-11-02",
+        "date_to": "2025-11-02",
+        "include_s3": "true",
+    })
+
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert len(rows) == 48
+    assert set(rows[0]) == set(vault.EXPORT_COLUMNS + vault.EXPORT_S3_COLUMNS)
+    assert {r["local_date"] for r in rows} == {"2025-11-02"}
+    assert {r["file_exists"] for r in rows} == {"True", "False"}
+
+
+def test_invalid_format_is_rejected(backends):
+    client = TestClient(vault.app)
+
+    assert client.get("/api/audio-files/export", params={"format": "xml"}).status_code == 400
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+波形サマリー（compute_peaks / /api/audio-files/peaks）のテスト
+"""
+
+import io
+import wave
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+import app as vault
+
+FILE_PATH = 'files/peaks-device/2025-11-11/01-00-00/audio.wav'
+
+
+def make_wav_from(samples: np.ndarray, frame_rate: int = 16000, channels: int = 1) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(frame_rate)
+        wav.writeframes(samples.astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def s3(backends):
+    return backends[0]
+
+
+def test_compute_peaks_min_max_rms():
+    # 1ブロック目: 一定値 16384、2ブロック目: ±32767の矩形波、3ブロック目: 端数（半分）
+    samples = np.concatenate([
+        np.full(100, 16384),
+        np.tile([32767, -32767], 50),
+        np.zeros(50),
+    ])
+
+    peaks = vault.compute_peaks(make_wav_from(samples), samples_per_peak=100)
+
+    assert peaks["length"] == 3
+    assert peaks["min"] == [0.5, -1.0, 0.0]
+    assert peaks["max"] == [0.5, 1.0, 0.0]
+    assert peaks["rms"] == [0.5, 1.0, 0.0]
+    assert peaks["duration_seconds"] == round(250 / 16000, 3)
+
+
+def test_compute_peaks_combines_channels():
+    # L=+0.5, R=-0.5 のステレオ
+    samples = np.tile([16384, -16384], 200)
+
+    peaks = vault.compute_peaks(make_wav_from(samples, channels=2), samples_per_peak=200)
+
+    assert peaks["channels"] == 2
+    assert peaks["min"] == [-0.5]
+    assert peaks["max"] == [0.5]
+
+
+def test_peaks_endpoint_generates_lazily_and_caches(s3):
+    content = make_wav_from(np.zeros(32000))
+    s3.put_object(Bucket=vault.S3_BUCKET_NAME, Key=FILE_PATH, Body=content, ContentType='audio/wav')
+    client = TestClient(vault.app)
+
+    first = client.get("/api/audio-files/peaks", params={"file_path": FILE_PATH})
+    s3.calls.clear()
+    second = client.get("/api/audio-files/peaks", params={"file_path": FILE_PATH})
+
+    assert first.status_code == 200
+    assert first.json()["length"] == 2
+    assert second.json() == first.json()
+    assert s3.calls == []
+    assert (vault.S3_BUCKET_NAME, "peaks/files/peaks-device/2025-11-11/01-00-00/audio.peaks.json") in s3.objects
+
+
+def test_peaks_endpoint_returns_404_for_missing_audio(s3):
+    client = TestClient(vault.app)
+
+    response = client.get("/api/audio-files/peaks", params={"file_path": FILE_PATH})
+
+    assert response.status_code == 404
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+/api/audio-files/stream（Range対応プロキシ・ディスクキャッシュ）のテスト
+"""
+
+import os
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as vault
+
+FILE_PATH = 'files/stream-device/2025-11-11/01-00-00/audio.wav'
+CONTENT = bytes(range(256)) * 1024
+
+
+@pytest.fixture
+def s3(backends, monkeypatch, tmp_path):
+    s3, _ = backends
+    s3.put_object(Bucket=vault.S3_BUCKET_NAME, Key=FILE_PATH, Body=CONTENT, ContentType='audio/wav')
+    s3.calls.clear()
+    monkeypatch.setattr(vault, "STREAM_CACHE_DIR", str(tmp_path))
+    vault._stream_cache.clear()
+    monkeypatch.setattr(vault, "_stream_cache_bytes", 0)
+    return s3
+
+
+def get_calls(s3):
+    return [call for call in s3.calls if call[0] == "get_object"]
+
+
+def get(client, file_path=FILE_PATH, **kwargs):
+    """リクエストを送り、バックグラウンドのキャッシュ取り込みの完了まで待つ"""
+    response = client.get("/api/audio-files/stream", params={"file_path": file_path}, **kwargs)
+    assert vault.flush_stream_cache_fills(5.0)
+    return response
+
+
+def test_cache_miss_is_proxied_and_later_requests_hit_cache(s3):
+    client = TestClient(vault.app)
+
+    first = get(client, headers={"Range": "bytes=0-99"})
+    full = get(client)
+    ranged = get(client, headers={"Range": "bytes=1000-1999"})
+
+    # 初回はS3のRange GETを中継し、オブジェクト全体はバックグラウンドで1回だけ取得する
+    assert first.status_code == 206
+    assert first.content == CONTENT[:100]
+    assert full.status_code == 200
+    assert full.content == CONTENT
+    assert ranged.status_code == 206
+    assert ranged.content == CONTENT[1000:2000]
+    assert ranged.headers["content-range"] == f"bytes 1000-1999/{len(CONTENT)}"
+    assert len(get_calls(s3)) == 2
+
+
+def test_concurrent_fills_share_one_fetch(s3, monkeypatch):
+    started = threading.Event()
+    release = threading.Event()
+    fetch = vault.fetch_stream_object_to_cache
+
+    def slow_fetch(file_path):
+        started.set()
+        release.wait(5.0)
+        return fetch(file_path)
+
+    monkeypatch.setattr(vault, "fetch_stream_object_to_cache", slow_fetch)
+
+    first = vault.schedule_stream_cache_fill(FILE_PATH)
+    assert started.wait(5.0)
+    second = vault.schedule_stream_cache_fill(FILE_PATH)
+    release.set()
+
+    assert first is second
+    assert first.result(5.0)["size"] == len(CONTENT)
+    assert len(get_calls(s3)) == 1
+
+
+def test_startup_clears_untracked_cache_files(s3):
+    stale = os.path.join(vault.STREAM_CACHE_DIR, "stale-object")
+    with open(stale, "wb") as f:
+        f.write(b"x" * 100)
+
+    vault.reset_stream_cache_dir()
+
+    assert not os.path.exists(stale)
+    assert vault._stream_cache_bytes == 0
+
+
+def test_if_none_match_returns_304(s3):
+    client = TestClient(vault.app)
+    etag = get(client).headers["etag"]
+
+    response = client.get("/api/audio-files/stream", params={"file_path": FILE_PATH}, headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_lru_evicts_oldest_object(s3, monkeypatch):
+    monkeypatch.setattr(vault, "STREAM_CACHE_MAX_BYTES", len(CONTENT) + 10)
+    second = FILE_PATH.replace("01-00-00", "01-30-00")
+    third = FILE_PATH.replace("01-00-00", "02-00-00")
+    for key in (second, third):
+        s3.put_object(Bucket=vault.S3_BUCKET_NAME, Key=key, Body=CONTENT[:10], ContentType='audio/wav')
+    client = TestClient(vault.app)
+
+    get(client)
+    get(client, second)
+    get(client, third)
+
+    assert list(vault._stream_cache) == [second, third]
+    assert vault._stream_cache_bytes == 20
+    assert not os.path.exists(vault._stream_cache_path(FILE_PATH))
+
+
+def test_objects_over_budget_are_proxied_with_range(s3, monkeypatch):
+    monkeypatch.setattr(vault, "STREAM_CACHE_MAX_BYTES", 0)
+    client = TestClient(vault.app)
+
+    response = get(client, headers={"Range": "bytes=-100"})
+
+    assert response.status_code == 206
+    assert response.content == CONTENT[-100:]
+    assert not vault._stream_cache
+
+
+def test_missing_object_returns_404(s3):
+    client = TestClient(vault.app)
+
+    response = client.get("/api/audio-files/stream", params={"file_path": "files/none/audio.wav"})
+
+    assert response.status_code == 404
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+backfill_local_time.py（local_date / local_time / time_block のバックフィル）のテスト
+"""
+
+import json
+
+import pytest
+
+import backfill_local_time
+from fake_backends import FakeQuery, FakeSupabaseClient
+
+
+def make_row(device_id: str, recorded_at: str, **values) -> dict:
+    return {
+        "device_id": device_id,
+        "recorded_at": recorded_at,
+        "file_path": f"files/{device_id}/{recorded_at[:10]}/{recorded_at[11:19].replace(':', '-')}/audio.wav",
+        "local_date": None,
+        "local_time": None,
+        "time_block": None,
+        **values
+    }
+
+
+@pytest.fixture
+def supabase():
+    rows = [
+        # タイムゾーン対応前の行（UTCのまま）
+        make_row("tokyo", "2025-11-10T15:30:00+00:00", local_date="2025-11-10", local_time="2025-11-10T15:30:00"),
+        # 正しい値だが time_block がない行
+        make_row("tokyo", "2025-11-10T16:00:00+00:00", local_date="2025-11-11", local_time="2025-11-11T01:00:00"),
+        # すでに正しい行
+        make_row("tokyo", "2025-11-10T16:30:00+00:00", local_date="2025-11-11", local_time="2025-11-11T01:30:00",
+                 time_block="01-30"),
+    ] + [make_row("no-timezone", f"2025-11-10T0{h}:45:00+00:00") for h in range(5)]
+    return FakeSupabaseClient({
+        "devices": [{"device_id": "tokyo", "timezone": "Asia/Tokyo"}, {"device_id": "no-timezone", "timezone": None}],
+        "audio_files": rows,
+    })
+
+
+def rows_by_key(supabase) -> dict:
+    return {(row["device_id"], row["recorded_at"]): row for row in supabase.tables["audio_files"]}
+
+
+def test_backfill_recomputes_only_changed_rows(supabase):
+    stats = backfill_local_time.backfill(supabase, page_size=2, rate=0)
+
+    assert stats["rows"] == 8
+    assert stats["updated"] == 7
+    assert stats["errors"] == 0
+    rows = rows_by_key(supabase)
+    fixed = rows[("tokyo", "2025-11-10T15:30:00+00:00")]
+    assert (fixed["local_date"], fixed["local_time"], fixed["time_block"]) == \
+        ("2025-11-11", "2025-11-11T00:30:00", "00-30")
+    assert rows[("tokyo", "2025-11-10T16:00:00+00:00")]["time_block"] == "01-00"
+    assert rows[("no-timezone", "2025-11-10T03:45:00+00:00")]["time_block"] == "03-30"
+    assert len(supabase.tables["audio_files"]) == 8
+
+    # 2回目は書き込みなし
+    assert backfill_local_time.backfill(supabase, page_size=2, rate=0)["updated"] == 0
+
+
+def test_dry_run_does_not_write(supabase):
+    before = json.dumps(supabase.tables["audio_files"], sort_keys=True)
+
+    stats = backfill_local_time.backfill(supabase, dry_run=True, rate=0)
+
+    assert stats["updated"] == 7
+    assert stats["dry_run"] == 2
+    assert json.dumps(supabase.tables["audio_files"], sort_keys=True) == before
+
+
+def test_interrupted_backfill_resumes_from_checkpoint(supabase, monkeypatch, tmp_path):
+    path = str(tmp_path / "checkpoint.json")
+    update = FakeQuery.update
+    calls = {"count": 0}
+
+    def failing_update(self, payload, **kwargs):
+        # 2ページ目の最初の行で失敗する
+        calls["count"] += 1
+        if calls["count"] == 3:
+            raise ConnectionError("connection reset")
+        return update(self, payload, **kwargs)
+
+    monkeypatch.setattr(FakeQuery, "update", failing_update)
+    first = backfill_local_time.backfill(supabase, device_ids=["no-timezone"], page_size=2, rate=0,
+                                         checkpoint=backfill_local_time.Checkpoint(path))
+    assert first["errors"] == 1
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["devices"]["no-timezone"]["last_recorded_at"] == "2025-11-10T01:45:00+00:00"
+
+    supabase.calls.clear()
+    second = backfill_local_time.backfill(supabase, device_ids=["no-timezone"], page_size=2, rate=0,
+                                          checkpoint=backfill_local_time.Checkpoint(path))
+
+    # 書き込み済みのページは読み直さない
+    assert second["rows"] == 3
+    assert all(row["time_block"] for row in supabase.tables["audio_files"] if row["device_id"] == "no-timezone")
+    assert backfill_local_time.Checkpoint(path).get("no-timezone")["done"] is True
+
+
+def test_rate_limiter_spaces_writes():
+    limiter = backfill_local_time.RateLimiter(rate=1000)
+    started = backfill_local_time.time.monotonic()
+    for _ in range(3):
+        limiter.acquire(50)
+    assert backfill_local_time.time.monotonic() - started >= 0.09
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+compact_archives.py（日次アーカイブバンドル）のテスト
+"""
+
+import hashlib
+from datetime import datetime
+
+import pytest
+import pytz
+from fastapi.testclient import TestClient
+
+import app as vault
+import compact_archives
+
+BUCKET = vault.S3_BUCKET_NAME
+DEVICE_ID = 'archive-device'
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": DEVICE_ID, "timezone": "Asia/Tokyo"}]
+
+
+@pytest.fixture
+def backends(backends):
+    s3, supabase = backends
+    for i, minute in enumerate(["00", "30"]):
+        key = f"files/{DEVICE_ID}/2025-11-10/03-{minute}-00/audio.wav"
+        body = f"RIFF-slot-{i}".encode() * (i + 3)
+        s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+        supabase.tables["audio_files"].append({
+            "device_id": DEVICE_ID,
+            "recorded_at": f"2025-11-10T03:{minute}:00+00:00",
+            "local_date": "2025-11-10",
+            "file_path": key,
+            "file_size_bytes": len(body),
+            "sha256": hashlib.sha256(body).hexdigest(),
+        })
+    # discard ポリシーで保存しなかった行（旧形式の skipped/ はオブジェクトがないため missing として扱う）
+    supabase.tables["audio_files"].append({
+        "device_id": DEVICE_ID, "recorded_at": "2025-11-10T15:00:00+00:00", "local_date": "2025-11-10",
+        "file_path": f"skipped/{DEVICE_ID}/2025-11-10/15-00-00/audio.wav", "file_size_bytes": None,
+    })
+    supabase.tables["audio_files"].append({
+        "device_id": DEVICE_ID, "recorded_at": "2025-11-10T15:30:00+00:00", "local_date": "2025-11-10",
+        "file_path": f"{vault.SKIP_DISCARD_PREFIX}/{DEVICE_ID}/2025-11-10/15-30-00/audio.wav", "file_size_bytes": None,
+    })
+    return s3, supabase
+
+
+def test_compaction_builds_bundle_with_offset_index(backends):
+    s3, supabase = backends
+
+    result = compact_archives.compact_device_day(s3, supabase, BUCKET, DEVICE_ID, "2025-11-10")
+
+    assert result["status"] == "compacted"
+    assert result["slots"] == 2
+    index = vault.load_archive_index(DEVICE_ID, "2025-11-10")
+    assert index["archive_path"] == f"archives/{DEVICE_ID}/2025-11-10/bundle.bin"
+
+    for entry, row in zip(index["entries"], supabase.tables["audio_files"]):
+        original = s3.objects[(BUCKET, row["file_path"])]["Body"]
+        ranged = s3.get_object(Bucket=BUCKET, Key=index["archive_path"], Range=entry["range"])["Body"].read()
+        assert ranged == original
+        assert row["archive_offset"] == entry["offset"]
+        assert row["archive_length"] == len(original)
+
+    # 元のオブジェクトは残す
+    assert (BUCKET, supabase.tables["audio_files"][0]["file_path"]) in s3.objects
+
+
+def test_compaction_is_idempotent(backends):
+    s3, supabase = backends
+    compact_archives.compact_device_day(s3, supabase, BUCKET, DEVICE_ID, "2025-11-10")
+    s3.calls.clear()
+
+    result = compact_archives.compact_device_day(s3, supabase, BUCKET, DEVICE_ID, "2025-11-10")
+
+    assert result["status"] == "skipped"
+    assert not [call for call in s3.calls if call[0] in ("put_object", "upload_file")]
+
+
+def test_rows_without_size_are_compacted_and_missing_objects_are_tolerated(backends):
+    s3, supabase = backends
+    # file_size_bytes 列の追加前に保存された行
+    legacy_key = f"files/{DEVICE_ID}/2025-11-10/04-00-00/audio.wav"
+    s3.put_object(Bucket=BUCKET, Key=legacy_key, Body=b"RIFF-legacy")
+    supabase.tables["audio_files"].append({
+        "device_id": DEVICE_ID, "recorded_at": "2025-11-10T04:00:00+00:00", "local_date": "2025-11-10",
+        "file_path": legacy_key, "file_size_bytes": None, "sha256": None,
+    })
+
+    result = compact_archives.compact_device_day(s3, supabase, BUCKET, DEVICE_ID, "2025-11-10")
+
+    assert result["status"] == "compacted"
+    assert result["slots"] == 3
+    assert result["missing"] == 1
+    index = vault.load_archive_index(DEVICE_ID, "2025-11-10")
+    assert index["entries"][2]["file_path"] == legacy_key
+    assert index["missing"] == [f"skipped/{DEVICE_ID}/2025-11-10/15-00-00/audio.wav"]
+    assert compact_archives.compact_device_day(s3, supabase, BUCKET, DEVICE_ID, "2025-11-10")["status"] == "skipped"
+
+
+def test_days_with_pending_replication_are_deferred(backends):
+    s3, supabase = backends
+    supabase.tables["audio_files"][1]["replication_status"] = "pending"
+
+    stats = compact_archives.compact(s3, supabase, BUCKET, local_date="2025-11-10")
+
+    assert stats["deferred"] == 1
+    assert stats["compacted"] == 0
+    assert (BUCKET, f"archives/{DEVICE_ID}/2025-11-10/index.json") not in s3.objects
+
+
+def test_checksum_mismatch_aborts_device_day(backends):
+    s3, supabase = backends
+    supabase.tables["audio_files"][0]["sha256"] = "0" * 64
+
+    stats = compact_archives.compact(s3, supabase, BUCKET, local_date="2025-11-10")
+
+    assert stats["errors"] == 1
+    assert (BUCKET, f"archives/{DEVICE_ID}/2025-11-10/index.json") not in s3.objects
+
+
+def test_last_closed_local_date_waits_for_grace_period():
+    # 2025-11-10 16:30 UTC = 2025-11-11 01:30 JST（猶予2時間以内のため11-10はまだ確定しない）
+    now = pytz.UTC.localize(datetime(2025, 11, 10, 16, 30))
+    assert compact_archives.last_closed_local_date("Asia/Tokyo", now, grace_hours=2) == "2025-11-09"
+    assert compact_archives.last_closed_local_date("Asia/Tokyo", now, grace_hours=1) == "2025-11-10"
+
+
+def test_presigned_url_and_archive_endpoint_resolve_byte_ranges(backends):
+    s3, supabase = backends
+    compact_archives.compact_device_day(s3, supabase, BUCKET, DEVICE_ID, "2025-11-10")
+    client = TestClient(vault.app)
+    file_path = supabase.tables["audio_files"][1]["file_path"]
+
+    presigned = client.get(f"/api/audio-files/presigned-url?file_path={file_path}&use_archive=true").json()
+    archive = client.get(f"/api/audio-files/archive?device_id={DEVICE_ID}&local_date=2025-11-10").json()
+
+    assert presigned["archive"]["archive_path"] == archive["archive_path"]
+    assert presigned["archive"]["range"] == archive["entries"][1]["range"]
+    assert archive["presigned_url"].startswith("https://fake-s3/")
+    assert client.get(f"/api/audio-files/archive?device_id={DEVICE_ID}&local_date=2025-11-09").status_code == 404
+
+
+def test_deferred_and_missed_days_are_picked_up_by_later_runs(backends):
+    s3, supabase = backends
+    # 11-09 は前回の実行で後回しになった日、11-10 は直近の確定日
+    body = b"RIFF-earlier-day"
+    key = f"files/{DEVICE_ID}/2025-11-09/03-00-00/audio.wav"
+    s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+    supabase.tables["audio_files"].append({
+        "device_id": DEVICE_ID, "recorded_at": "2025-11-09T03:00:00+00:00", "local_date": "2025-11-09",
+        "file_path": key, "file_size_bytes": len(body), "sha256": hashlib.sha256(body).hexdigest(),
+        "replication_status": "pending",
+    })
+    # 2025-11-11 03:00 UTC = 12:00 JST（11-10 まで確定）
+    now = pytz.UTC.localize(datetime(2025, 11, 11, 3, 0))
+
+    first = compact_archives.compact(s3, supabase, BUCKET, now=now)
+    assert (first["targets"], first["compacted"], first["deferred"]) == (2, 1, 1)
+
+    supabase.tables["audio_files"][-1]["replication_status"] = "replicated"
+    second = compact_archives.compact(s3, supabase, BUCKET, now=now)
+
+    # 11-10 はアーカイブ済み（残っているのは discard ポリシーの行のみ）のため対象外
+    assert (second["targets"], second["compacted"], second["deferred"]) == (1, 1, 0)
+    assert (BUCKET, f"archives/{DEVICE_ID}/2025-11-09/index.json") in s3.objects
+    assert compact_archives.list_uncompacted_dates(supabase, DEVICE_ID, "2025-11-10") == []
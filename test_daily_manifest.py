@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+日次マニフェスト（manifests/{device_id}/{local_date}/manifest.json）のテスト
+"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as vault
+from fake_backends import make_wav
+
+DEVICE_ID = 'manifest-test-device'
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": DEVICE_ID, "timezone": "Asia/Tokyo"}]
+
+
+def test_upload_appends_slots_to_manifest(backends, upload):
+    s3, _ = backends
+
+    # 両方とも 2025-11-11（JST）
+    assert upload(DEVICE_ID, "2025-11-11T01:30:00+00:00", make_wav(2.0)).status_code == 200
+    assert upload(DEVICE_ID, "2025-11-11T01:00:00+00:00").status_code == 200
+
+    stored = json.loads(s3.objects[(vault.S3_BUCKET_NAME, vault.get_manifest_key(DEVICE_ID, "2025-11-11"))]["Body"])
+    assert stored["total_count"] == 2
+    # recorded_at順に並ぶ
+    assert [f["recorded_at"] for f in stored["files"]] == [
+        "2025-11-11T01:00:00+00:00",
+        "2025-11-11T01:30:00+00:00",
+    ]
+    assert stored["files"][1]["duration_seconds"] == 2.0
+    assert len(stored["files"][0]["sha256"]) == 64
+
+
+def test_manifest_endpoint_serves_from_cache(backends, upload):
+    s3, _ = backends
+    client = TestClient(vault.app)
+    upload(DEVICE_ID, "2025-11-11T01:00:00+00:00")
+    s3.calls.clear()
+
+    response = client.get("/api/audio-files/manifest", params={"device_id": DEVICE_ID, "local_date": "2025-11-11"})
+
+    assert response.status_code == 200
+    assert response.json()["files"][0]["s3_key"].startswith(f"files/{DEVICE_ID}/")
+    assert not [call for call in s3.calls if call[0] == "get_object"]
+
+
+def test_manifest_endpoint_loads_from_s3_on_cache_miss(backends, upload):
+    s3, _ = backends
+    client = TestClient(vault.app)
+    upload(DEVICE_ID, "2025-11-11T01:00:00+00:00")
+    vault._manifest_cache.clear()
+
+    response = client.get("/api/audio-files/manifest", params={"device_id": DEVICE_ID, "local_date": "2025-11-11"})
+
+    assert response.status_code == 200
+    assert response.json()["total_count"] == 1
+    assert ("get_object", vault.get_manifest_key(DEVICE_ID, "2025-11-11")) in s3.calls
+
+
+def test_manifest_endpoint_returns_404_for_unknown_day(backends, upload):
+    client = TestClient(vault.app)
+
+    response = client.get("/api/audio-files/manifest", params={"device_id": DEVICE_ID, "local_date": "2025-01-01"})
+
+    assert response.status_code == 404
+
+
+def test_same_instant_with_different_offset_is_deduped(backends, upload):
+    upload(DEVICE_ID, "2025-11-11T01:00:00+00:00")
+    upload(DEVICE_ID, "2025-11-11T10:00:00+09:00")
+
+    manifest = vault.load_daily_manifest(DEVICE_ID, "2025-11-11")
+
+    assert manifest["total_count"] == 1
+    assert manifest["files"][0]["recorded_at"] == "2025-11-11T01:00:00+00:00"
+
+
+def test_concurrent_updates_keep_every_entry(backends):
+    entries = [
+        {"recorded_at": f"2025-11-11T{hour:02d}:00:00+00:00", "s3_key": f"files/{DEVICE_ID}/{hour}", "size_bytes": 10}
+        for hour in range(12)
+    ]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda entry: vault.update_daily_manifest(DEVICE_ID, "2025-11-11", entry), entries))
+
+    vault._manifest_cache.clear()
+    assert vault.load_daily_manifest(DEVICE_ID, "2025-11-11")["total_count"] == 12
+
+
+def test_missing_manifest_is_built_from_audio_files(backends, upload):
+    s3, _ = backends
+    upload(DEVICE_ID, "2025-11-11T01:00:00+00:00")
+    del s3.objects[(vault.S3_BUCKET_NAME, vault.get_manifest_key(DEVICE_ID, "2025-11-11"))]
+    vault._manifest_cache.clear()
+
+    manifest = vault.load_daily_manifest(DEVICE_ID, "2025-11-11")
+
+    assert manifest["total_count"] == 1
+    assert manifest["files"][0]["stored"] is True
+    assert (vault.S3_BUCKET_NAME, vault.get_manifest_key(DEVICE_ID, "2025-11-11")) in s3.objects
+
+
+def test_rebuild_restores_entries_lost_by_a_failed_put(backends, upload, monkeypatch):
+    client = TestClient(vault.app)
+    upload(DEVICE_ID, "2025-11-11T01:00:00+00:00", make_wav(2.0))
+
+    def failing_update(*args, **kwargs):
+        raise RuntimeError("S3 unavailable")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(vault, "update_daily_manifest", failing_update)
+        assert upload(DEVICE_ID, "2025-11-11T01:30:00+00:00").status_code == 200
+    assert vault.load_daily_manifest(DEVICE_ID, "2025-11-11")["total_count"] == 1
+
+    response = client.get("/api/audio-files/manifest",
+                          params={"device_id": DEVICE_ID, "local_date": "2025-11-11", "rebuild": "true"})
+
+    assert response.status_code == 200
+    files = response.json()["files"]
+    assert [f["recorded_at"] for f in files] == ["2025-11-11T01:00:00+00:00", "2025-11-11T01:30:00+00:00"]
+    # 既存のエントリの長さは引き継ぐ
+    assert [f["duration_seconds"] for f in files] == [2.0, None]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+録音カバレッジインデックスと /api/devices/{device_id}/coverage のテスト
+"""
+
+import json
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as vault
+from fake_backends import make_wav
+
+DEVICE_ID = 'coverage-test-device'
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": DEVICE_ID, "timezone": "Asia/Tokyo"}]
+
+
+def test_upload_sets_slot_bit_and_coverage_reports_gaps(backends, upload):
+    s3, _ = backends
+    client = TestClient(vault.app)
+
+    # 2025-11-11 03:00 / 03:30 UTC = 12:00 / 12:30 JST
+    assert upload(DEVICE_ID, "2025-11-11T03:00:00+00:00", make_wav(0.1)).status_code == 200
+    assert upload(DEVICE_ID, "2025-11-11T03:30:00+00:00", make_wav(0.1)).status_code == 200
+
+    stored = json.loads(s3.objects[(vault.S3_BUCKET_NAME, "coverage/coverage-test-device/2025-11.json")]["Body"])
+    assert int(stored["days"]["2025-11-11"], 16) == (1 << 24) | (1 << 25)
+
+    body = client.get(f"/api/devices/{DEVICE_ID}/coverage?from=2025-11-11&to=2025-11-12").json()
+    assert [day["covered_slots"] for day in body["days"]] == [2, 0]
+    assert "12-00" not in body["days"][0]["missing_slots"]
+    assert "12-30" not in body["days"][0]["missing_slots"]
+    assert len(body["days"][1]["missing_slots"]) == 48
+    assert body["total_slots"] == 96
+    assert body["covered_slots"] == 2
+
+
+def test_missing_index_is_built_from_audio_files(backends):
+    s3, supabase = backends
+    supabase.tables["audio_files"] = [
+        {"device_id": DEVICE_ID, "recorded_at": "2025-09-30T15:00:00+00:00",
+         "local_date": "2025-10-01", "local_time": "2025-10-01T00:00:00"},
+        {"device_id": DEVICE_ID, "recorded_at": "2025-12-01T14:45:00+00:00",
+         "local_date": "2025-12-01", "local_time": "2025-12-01T23:45:00"},
+    ]
+    client = TestClient(vault.app)
+
+    body = client.get(
+        f"/api/devices/{DEVICE_ID}/coverage?from=2025-10-01&to=2025-12-31&include_missing=false"
+    ).json()
+
+    assert len(body["days"]) == 92
+    assert body["days"][0] == {"local_date": "2025-10-01", "bitmap": f"{1:012x}", "covered_slots": 1}
+    assert int(body["days"][61]["bitmap"], 16) == 1 << 47
+    assert (vault.S3_BUCKET_NAME, "coverage/coverage-test-device/2025-10.json") in s3.objects
+    # 録音のない月はS3に保存しない
+    assert (vault.S3_BUCKET_NAME, "coverage/coverage-test-device/2025-11.json") not in s3.objects
+
+    # 2回目はキャッシュから返す
+    supabase.calls.clear()
+    client.get(f"/api/devices/{DEVICE_ID}/coverage?from=2025-10-01&to=2025-12-31")
+    assert supabase.calls == []
+
+
+def test_update_during_build_is_not_lost(backends, monkeypatch):
+    s3, supabase = backends
+    supabase.tables["audio_files"] = [
+        {"device_id": DEVICE_ID, "recorded_at": "2025-09-30T15:00:00+00:00",
+         "local_date": "2025-10-01", "local_time": "2025-10-01T00:00:00"},
+    ]
+    building = threading.Event()
+    updated = threading.Event()
+    build = vault.build_coverage_month
+
+    def slow_build(device_id, month):
+        coverage = build(device_id, month)
+        if not building.is_set():
+            building.set()
+            # 作成中に届いたビット更新が先に終わる（ロックがなければ）まで待つ
+            updated.wait(0.5)
+        return coverage
+
+    monkeypatch.setattr(vault, "build_coverage_month", slow_build)
+
+    loader = threading.Thread(target=vault.load_coverage_month, args=(DEVICE_ID, "2025-10"))
+    loader.start()
+    assert building.wait(5.0)
+    updater = threading.Thread(target=lambda: (vault.update_coverage(DEVICE_ID, "2025-10-02", "12-00"), updated.set()))
+    updater.start()
+    loader.join(5.0)
+    updater.join(5.0)
+
+    assert vault.load_coverage_month(DEVICE_ID, "2025-10")["days"] == {
+        "2025-10-01": f"{1:012x}", "2025-10-02": f"{1 << 24:012x}"
+    }
+    stored = json.loads(s3.objects[(vault.S3_BUCKET_NAME, "coverage/coverage-test-device/2025-10.json")]["Body"])
+    assert stored["days"] == {"2025-10-01": f"{1:012x}", "2025-10-02": f"{1 << 24:012x}"}
+
+
+def test_coverage_validates_range(backends):
+    client = TestClient(vault.app)
+
+    assert client.get(f"/api/devices/{DEVICE_ID}/coverage?from=2025-11-12&to=2025-11-11").status_code == 400
+    assert client.get(f"/api/devices/{DEVICE_ID}/coverage?from=2024-01-01&to=2025-12-31").status_code == 400
+    assert client.get(f"/api/devices/{DEVICE_ID}/coverage?from=2025/11/01&to=2025-11-02").status_code == 400
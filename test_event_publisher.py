@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+処理開始イベント（file ready）の発行のテスト
+"""
+
+import os
+import json
+from datetime import datetime
+
+import pytest
+
+import app as vault
+from fake_backends import FakeSQSClient
+
+DEVICE_IDS = ['event-device-a', 'event-device-b']
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": d, "timezone": "Asia/Tokyo"} for d in DEVICE_IDS]
+
+
+@pytest.fixture
+def backends(backends, monkeypatch):
+    monkeypatch.setattr(vault, "event_notifier", vault.LocalQueueNotifier())
+    monkeypatch.setattr(vault, "EVENT_RETRY_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(vault, "_event_state", {
+        "worker": None, "published": 0, "messages": 0, "batches": 0,
+        "failed_attempts": 0, "last_delivery_lag_seconds": None
+    })
+    vault._event_buffer.clear()
+    yield backends
+    vault.flush_events(5.0)
+
+
+def test_upload_publishes_ready_event_with_computed_metadata(backends, upload):
+    response = upload(DEVICE_IDS[0], "2025-11-11T03:00:00+00:00")
+    assert response.status_code == 200
+
+    assert vault.flush_events(5.0)
+    message = vault.event_notifier.queue.get_nowait()
+    event = message["events"][0]
+    assert message["device_id"] == DEVICE_IDS[0]
+    assert event["event_id"] == f"{DEVICE_IDS[0]}/2025-11-11T03:00:00+00:00"
+    assert event["local_date"] == "2025-11-11"
+    assert event["time_block"] == "12-00"
+    assert event["status"] == "pending"
+    assert event["file_path"] == response.json()["s3_key"]
+    assert event["duration_seconds"] is not None
+    assert event["sha256"] == response.json()["sha256"]
+
+
+def test_events_are_coalesced_by_device_and_batched(backends, upload, monkeypatch):
+    sqs = FakeSQSClient()
+    monkeypatch.setattr(vault, "event_notifier", vault.SQSNotifier("https://sqs.local/queue.fifo", client=sqs))
+    monkeypatch.setattr(vault, "EVENT_MESSAGE_MAX_EVENTS", 2)
+    monkeypatch.setattr(vault, "EVENT_BATCH_MAX_WAIT_SECONDS", 60)
+
+    for minute in ("00", "30"):
+        for device_id in DEVICE_IDS:
+            assert upload(device_id, f"2025-11-11T03:{minute}:00+00:00").status_code == 200
+    upload(DEVICE_IDS[0], "2025-11-11T04:00:00+00:00")
+
+    assert vault.flush_events(5.0)
+    assert sqs.calls == [("send_message_batch", "https://sqs.local/queue.fifo", 3)]
+    bodies = [json.loads(entry["MessageBody"]) for entry in sqs.messages]
+    assert [(b["device_id"], len(b["events"])) for b in bodies] == \
+        [(DEVICE_IDS[0], 2), (DEVICE_IDS[0], 1), (DEVICE_IDS[1], 2)]
+    assert [entry["MessageGroupId"] for entry in sqs.messages] == [DEVICE_IDS[0], DEVICE_IDS[0], DEVICE_IDS[1]]
+    assert vault.get_event_stats()["published"] == 5
+
+
+def test_failed_messages_are_redelivered(backends, upload, monkeypatch):
+    sqs = FakeSQSClient()
+    sqs.fail_ids = {"0"}
+    monkeypatch.setattr(vault, "event_notifier", vault.SQSNotifier("https://sqs.local/queue", client=sqs))
+
+    upload(DEVICE_IDS[0], "2025-11-11T03:00:00+00:00")
+    vault.start_event_publisher()
+    # 最初の送信は失敗し、バッファに戻る
+    vault.time.sleep(vault.EVENT_BATCH_MAX_WAIT_SECONDS + 0.3)
+    assert sqs.messages == []
+    assert vault.get_event_stats()["pending"] == 1
+
+    sqs.fail_ids = set()
+    assert vault.flush_events(5.0)
+    assert len(sqs.messages) == 1
+    stats = vault.get_event_stats()
+    assert stats["failed_attempts"] >= 1
+    assert stats["published"] == 1
+
+
+def test_local_first_upload_publishes_after_replication(backends, upload, monkeypatch, tmp_path):
+    s3, _ = backends
+    monkeypatch.setattr(vault, "LOCAL_INGEST_DIR", str(tmp_path))
+    monkeypatch.setattr(vault, "_replication_state", {
+        "workers": [], "in_flight": 0, "replicated": 0, "retries": 0,
+        "failed": 0, "rejected_uploads": 0, "last_lag_seconds": None
+    })
+    vault._replication_pending.clear()
+
+    try:
+        body = upload(DEVICE_IDS[0], "2025-11-11T03:00:00+00:00").json()
+        assert vault.flush_replication(5.0)
+    finally:
+        vault.shutdown_replicator(5.0)
+
+    assert vault.flush_events(5.0)
+    event = vault.event_notifier.queue.get_nowait()["events"][0]
+    assert event["file_path"] == body["s3_key"]
+    assert (vault.S3_BUCKET_NAME, body["s3_key"]) in s3.objects
+
+
+def test_outbox_events_are_recovered_on_start(backends, monkeypatch, tmp_path):
+    monkeypatch.setattr(vault, "EVENT_OUTBOX_DIR", str(tmp_path))
+    monkeypatch.setattr(vault, "event_notifier", None)
+    event = {"event_id": "event-device-a/2025-11-11T03:00:00+00:00", "device_id": DEVICE_IDS[0],
+             "status": "pending", "created_at": vault.time.time()}
+    vault._write_durably(vault._event_outbox_path(event["event_id"]), json.dumps(event).encode('utf-8'))
+
+    # 再起動を模擬: 送信前に落ちたイベントはアウトボックスから再送される
+    notifier = vault.LocalQueueNotifier()
+    monkeypatch.setattr(vault, "event_notifier", notifier)
+    vault.start_event_publisher()
+
+    assert vault.flush_events(5.0)
+    assert notifier.queue.get_nowait()["events"][0]["event_id"] == event["event_id"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_skipped_recordings_do_not_publish_events(backends, upload, monkeypatch):
+    monkeypatch.setattr(vault, "determine_initial_status", lambda device_id, time_block: "skipped")
+
+    upload(DEVICE_IDS[0], "2025-11-11T03:00:00+00:00")
+
+    assert vault.flush_events(5.0)
+    assert vault.event_notifier.queue.empty()
+
+
+def test_event_id_uses_utc_recorded_at_and_created_at_is_iso(backends, upload):
+    response = upload(DEVICE_IDS[0], "2025-11-11T12:00:00+09:00")
+    assert response.status_code == 200
+
+    assert vault.flush_events(5.0)
+    event = vault.event_notifier.queue.get_nowait()["events"][0]
+    assert event["event_id"] == f"{DEVICE_IDS[0]}/2025-11-11T03:00:00+00:00"
+    assert datetime.fromisoformat(event["created_at"]).tzinfo is not None
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+export_snapshot.py（audio_files の Parquet スナップショット出力）のテスト
+"""
+
+import os
+import io
+import json
+from datetime import datetime
+
+import pytest
+import pytz
+
+import app as vault
+import export_snapshot
+
+BUCKET = vault.S3_BUCKET_NAME
+DEVICE_ID = 'snapshot-device'
+# フィクスチャで差し替える前の Parquet エンコーダー
+encode_parquet = export_snapshot.encode_parquet
+
+NOW = pytz.UTC.localize(datetime(2025, 11, 12, 6, 0))   # 2025-11-12 15:00 JST（11-11まで確定）
+
+
+def add_recording(s3, supabase, recorded_at: str, local_date: str, local_time: str, size=None, with_size=True):
+    key = f"files/{DEVICE_ID}/{recorded_at[:10]}/{recorded_at[11:19].replace(':', '-')}/audio.wav"
+    body = b"RIFF" + b"\0" * (size or 100)
+    s3.put_object(Bucket=BUCKET, Key=key, Body=body)
+    supabase.tables["audio_files"].append({
+        "device_id": DEVICE_ID, "recorded_at": recorded_at, "local_date": local_date, "local_time": local_time,
+        "time_block": local_time[11:13] + "-" + ("30" if local_time[14:16] >= "30" else "00"),
+        "file_path": key, "file_size_bytes": len(body) if with_size else None, "sha256": None,
+        "transcriptions_status": "pending", "behavior_features_status": "pending",
+        "emotion_features_status": "pending", "created_at": recorded_at,
+    })
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": DEVICE_ID, "timezone": "Asia/Tokyo"}]
+
+
+@pytest.fixture
+def backends(backends, monkeypatch):
+    s3, supabase = backends
+    add_recording(s3, supabase, "2025-11-09T15:30:00+00:00", "2025-11-10", "2025-11-10T00:30:00")
+    add_recording(s3, supabase, "2025-11-10T03:00:00+00:00", "2025-11-10", "2025-11-10T12:00:00", with_size=False)
+    add_recording(s3, supabase, "2025-11-11T03:00:00+00:00", "2025-11-11", "2025-11-11T12:00:00", size=200)
+    # まだ確定していない日
+    add_recording(s3, supabase, "2025-11-12T01:00:00+00:00", "2025-11-12", "2025-11-12T10:00:00")
+    # recorded_at をUTCに揃える前に書かれたマニフェスト（オフセット付き）
+    s3.put_object(Bucket=BUCKET, Key=vault.get_manifest_key(DEVICE_ID, "2025-11-10"), Body=json.dumps({
+        "device_id": DEVICE_ID, "local_date": "2025-11-10",
+        "files": [{"recorded_at": "2025-11-10T12:00:00+09:00", "duration_seconds": 60.0, "status": "pending"}]
+    }).encode())
+    # Parquet の代わりにJSONで書き出し、パーティションの内容を検証する
+    monkeypatch.setattr(export_snapshot, "encode_parquet", lambda records: json.dumps(records).encode())
+    return s3, supabase
+
+
+def read_partition(root, local_date: str) -> list[dict]:
+    with open(os.path.join(root, export_snapshot.partition_path(DEVICE_ID, local_date)), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_export_writes_closed_days_partitioned_by_device_and_date(backends, tmp_path):
+    s3, supabase = backends
+    destination = export_snapshot.LocalDestination(str(tmp_path))
+
+    stats = export_snapshot.export(supabase, s3, BUCKET, destination, now=NOW)
+
+    assert stats["partitions"] == 2
+    assert stats["rows"] == 3
+    day = read_partition(tmp_path, "2025-11-10")
+    assert [r["recorded_at"] for r in day] == ["2025-11-09T15:30:00+00:00", "2025-11-10T03:00:00+00:00"]
+    # サイズが未記録の行はS3の一覧から、再生時間は日次マニフェストから補完する
+    assert day[1]["size_bytes"] == 104
+    assert day[1]["stored"] is True
+    assert day[1]["duration_seconds"] == 60.0
+    assert day[0]["duration_seconds"] is None
+    assert not os.path.exists(os.path.join(tmp_path, export_snapshot.partition_path(DEVICE_ID, "2025-11-12")))
+
+
+def test_durations_are_read_from_the_exporter_bucket(backends, monkeypatch):
+    s3, supabase = backends
+    # APIサーバーのS3クライアント・キャッシュには依存しない
+    monkeypatch.setattr(vault, "s3_client", None)
+    rows = [r for r in supabase.tables["audio_files"] if r["local_date"] == "2025-11-10"]
+
+    records = export_snapshot.build_day_records(s3, BUCKET, DEVICE_ID, "2025-11-10", rows)
+
+    assert [r["duration_seconds"] for r in records] == [None, 60.0]
+
+
+def test_timezone_change_does_not_split_a_local_date(backends, tmp_path):
+    s3, supabase = backends
+    # 23:30 JST（11-11）の後にUTCへ移動し、ローカル日付が11-10に戻る
+    add_recording(s3, supabase, "2025-11-11T14:30:00+00:00", "2025-11-11", "2025-11-11T23:30:00")
+    add_recording(s3, supabase, "2025-11-11T15:30:00+00:00", "2025-11-12", "2025-11-12T00:30:00")
+    add_recording(s3, supabase, "2025-11-11T16:00:00+00:00", "2025-11-11", "2025-11-11T16:00:00")
+    destination = export_snapshot.LocalDestination(str(tmp_path))
+
+    export_snapshot.export(supabase, s3, BUCKET, destination, date_from="2025-11-11", date_to="2025-11-12", now=NOW)
+
+    assert [r["recorded_at"] for r in read_partition(tmp_path, "2025-11-11")] == [
+        "2025-11-11T03:00:00+00:00", "2025-11-11T14:30:00+00:00", "2025-11-11T16:00:00+00:00"
+    ]
+
+
+def test_incremental_export_appends_only_new_days(backends, tmp_path, monkeypatch):
+    s3, supabase = backends
+    monkeypatch.setattr(export_snapshot, "EXPORT_REEXPORT_DAYS", 0)
+    destination = export_snapshot.LocalDestination(str(tmp_path))
+    export_snapshot.export(supabase, s3, BUCKET, destination, now=NOW)
+
+    next_day = pytz.UTC.localize(datetime(2025, 11, 13, 6, 0))
+    stats = export_snapshot.export(supabase, s3, BUCKET, destination, now=next_day)
+
+    assert stats["partitions"] == 1
+    assert [r["local_date"] for r in read_partition(tmp_path, "2025-11-12")] == ["2025-11-12"]
+    state = json.loads(destination.read(export_snapshot.STATE_FILE))
+    assert state["devices"][DEVICE_ID]["last_local_date"] == "2025-11-12"
+
+    # 新しい確定日がなければ何もしない
+    assert export_snapshot.export(supabase, s3, BUCKET, destination, now=next_day)["partitions"] == 0
+
+
+def test_late_rows_are_picked_up_by_the_trailing_window(backends, tmp_path):
+    s3, supabase = backends
+    destination = export_snapshot.LocalDestination(str(tmp_path))
+    export_snapshot.export(supabase, s3, BUCKET, destination, now=NOW)
+
+    # 出力後に 11-11 の録音が遅れて届いた
+    add_recording(s3, supabase, "2025-11-11T05:00:00+00:00", "2025-11-11", "2025-11-11T14:00:00")
+    next_day = pytz.UTC.localize(datetime(2025, 11, 13, 6, 0))
+    stats = export_snapshot.export(supabase, s3, BUCKET, destination, now=next_day)
+
+    # 11-10〜11-11 を出し直し、11-12 を追加
+    assert stats["partitions"] == 3
+    assert len(read_partition(tmp_path, "2025-11-11")) == 2
+
+
+def test_days_awaiting_replication_are_not_marked_exported(backends, tmp_path):
+    s3, supabase = backends
+    supabase.tables["audio_files"][2]["replication_status"] = "pending"   # 11-11
+    destination = export_snapshot.LocalDestination(str(tmp_path))
+
+    export_snapshot.export(supabase, s3, BUCKET, destination, now=NOW)
+
+    state = json.loads(destination.read(export_snapshot.STATE_FILE))
+    assert state["devices"][DEVICE_ID]["last_local_date"] == "2025-11-10"
+
+
+def test_export_to_s3_destination(backends):
+    s3, supabase = backends
+    destination = export_snapshot.open_destination(None, s3, BUCKET)
+
+    export_snapshot.export(supabase, s3, BUCKET, destination, now=NOW)
+
+    key = f"{export_snapshot.DEFAULT_PREFIX}/{export_snapshot.partition_path(DEVICE_ID, '2025-11-11')}"
+    assert json.loads(s3.objects[(BUCKET, key)]["Body"])[0]["size_bytes"] == 204
+    assert (BUCKET, f"{export_snapshot.DEFAULT_PREFIX}/{export_snapshot.STATE_FILE}") in s3.objects
+
+
+def test_encode_parquet_round_trip(backends):
+    s3, supabase = backends
+    rows = [r for r in supabase.tables["audio_files"] if r["local_date"] == "2025-11-10"]
+    records = export_snapshot.build_day_records(s3, BUCKET, DEVICE_ID, "2025-11-10", rows)
+
+    pq = pytest.importorskip("pyarrow.parquet")
+    body = encode_parquet(records)
+
+    table = pq.read_table(io.BytesIO(body))
+    assert table.column_names == export_snapshot.SNAPSHOT_COLUMNS
+    assert table.column("size_bytes").to_pylist() == [104, 104]
+    assert table.column("duration_seconds").to_pylist() == [None, 60.0]
+    assert table.column("recorded_at").to_pylist()[1] == pytz.UTC.localize(datetime(2025, 11, 10, 3, 0))
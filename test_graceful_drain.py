@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+グレースフルシャットダウン（ドレイン）のテスト
+負荷をかけた状態でuvicornにSIGTERMを送り、アップロードが1件も失われないことを確認する
+"""
+
+import sys
+import os
+import json
+import time
+import signal
+import socket
+import subprocess
+import threading
+
+import httpx
+from fastapi.testclient import TestClient
+
+import app as vault
+from fake_backends import make_wav
+
+DEVICE_ID = 'drain-test-device'
+
+# フェイクバックエンドでuvicornを起動し、終了時に登録済みの行数をファイルへ書き出す
+SERVER_SCRIPT = """
+import os, sys, json
+sys.path.insert(0, os.getcwd())
+import uvicorn
+import app as vault
+from fake_backends import FakeS3Client, FakeSupabaseClient
+
+port, put_delay, result_path = int(sys.argv[1]), float(sys.argv[2]), sys.argv[3]
+vault.s3_client = FakeS3Client(put_delay=put_delay)
+vault.supabase_client = FakeSupabaseClient({"devices": []})
+
+def write_result(remaining):
+    rows = vault.supabase_client.tables.get("audio_files", [])
+    with open(result_path, "w") as f:
+        json.dump([row["recorded_at"] for row in rows], f)
+
+vault.register_drain_hook(write_result)
+uvicorn.run(vault.app, host="127.0.0.1", port=port, log_level="warning")
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(tmp_path, name: str, put_delay: float):
+    port = free_port()
+    result_path = str(tmp_path / f"{name}.json")
+    process = subprocess.Popen(
+        [sys.executable, "-c", SERVER_SCRIPT, str(port), str(put_delay), result_path],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env={**os.environ, "DRAIN_TIMEOUT_SECONDS": "30"},
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            if httpx.get(f"{url}/ready").status_code == 200:
+                return process, url, result_path
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"server {name} did not start")
+
+
+def post_upload(url: str, recorded_at: str) -> httpx.Response:
+    return httpx.post(
+        f"{url}/upload",
+        files={"file": ("audio.wav", make_wav(0.1), "audio/wav")},
+        data={"metadata": json.dumps({"device_id": DEVICE_ID, "recorded_at": recorded_at})},
+        headers={"Connection": "close"},
+        timeout=30,
+    )
+
+
+def test_restart_under_load_drops_no_uploads(tmp_path):
+    old_process, old_url, old_result = start_server(tmp_path, "old", put_delay=0.2)
+    new_process, new_url, new_result = start_server(tmp_path, "new", put_delay=0.0)
+
+    uploads = 20
+    accepted = {}
+    lock = threading.Lock()
+
+    def device(i: int) -> None:
+        recorded_at = f"2025-11-11T03:{i:02d}:00+00:00"
+        time.sleep(i * 0.05)
+        try:
+            response = post_upload(old_url, recorded_at)
+            server = "old"
+        except httpx.TransportError:
+            response = None
+        if response is None or response.status_code == 503:
+            # 端末側のリトライ（再起動後のコンテナ相当）
+            response = post_upload(new_url, recorded_at)
+            server = "new"
+        with lock:
+            accepted[recorded_at] = (server, response.status_code)
+
+    threads = [threading.Thread(target=device, args=(i,)) for i in range(uploads)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.4)
+    old_process.send_signal(signal.SIGTERM)
+    for thread in threads:
+        thread.join()
+
+    old_returncode = old_process.wait(timeout=30)
+    new_process.send_signal(signal.SIGTERM)
+    new_process.wait(timeout=30)
+
+    assert old_returncode in (0, -signal.SIGTERM)
+    assert all(status == 200 for _, status in accepted.values())
+
+    with open(old_result) as f:
+        old_rows = json.load(f)
+    with open(new_result) as f:
+        new_rows = json.load(f)
+    stored = [r.replace("+00:00", "") for r in old_rows + new_rows]
+    # 200を返したアップロードはすべてどちらかのサーバーに1件ずつ登録されている
+    assert len(old_rows) + len(new_rows) == uploads
+    assert sorted(stored) == sorted(r[:19] for r in accepted)
+    assert len(old_rows) == sum(1 for server, _ in accepted.values() if server == "old")
+    assert old_rows and new_rows
+
+
+def test_draining_rejects_new_uploads_and_fails_readiness(upload, monkeypatch):
+    monkeypatch.setitem(vault._drain_state, "draining", True)
+    client = TestClient(vault.app)
+
+    ready = client.get("/ready")
+    rejected = upload(DEVICE_ID, "2025-11-11T03:00:00+00:00")
+
+    assert ready.status_code == 503
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == str(vault.DRAIN_RETRY_AFTER_SECONDS)
+    assert client.get("/health").json()["status"] == "draining"
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+reconcile_storage.py（S3 ↔ audio_files 突合）のテスト
+"""
+
+import hashlib
+
+import reconcile_storage
+from fake_backends import FakeS3Client, FakeSupabaseClient
+
+BUCKET = 'test-bucket'
+
+
+def build_backends():
+    s3 = FakeS3Client()
+    supabase = FakeSupabaseClient({
+        "devices": [
+            {"device_id": "dev-a", "timezone": "Asia/Tokyo"},
+            {"device_id": "dev-c", "timezone": "UTC"},
+        ],
+        "audio_files": [],
+    })
+
+    def add(device_id, time_str, size, row=True, object_=True, recorded_size=None):
+        key = f"files/{device_id}/2025-11-11/{time_str}/audio.wav"
+        if object_:
+            s3.put_object(Bucket=BUCKET, Key=key, Body=b"x" * size)
+        if row:
+            supabase.tables["audio_files"].append({
+                "device_id": device_id,
+                "recorded_at": f"2025-11-11T{time_str.replace('-', ':')}+00:00",
+                "file_path": key,
+                "file_size_bytes": size if recorded_size is None else recorded_size,
+            })
+
+    add("dev-a", "01-00-00", 10)
+    add("dev-a", "01-30-00", 10, row=False)               # orphan
+    add("dev-a", "02-00-00", 10, object_=False)           # missing
+    add("dev-a", "02-30-00", 10, recorded_size=99)        # size mismatch
+    add("dev-b", "03-00-00", 5, row=False)                # orphan（devicesに未登録）
+    add("dev-c", "04-00-00", 5, object_=False)            # missing（S3にプレフィックスなし）
+    # skipped/ の行は突合対象外
+    supabase.tables["audio_files"].append({
+        "device_id": "dev-a", "recorded_at": "2025-11-11T05:00:00+00:00",
+        "file_path": "skipped/dev-a/2025-11-11/05-00-00/audio.wav",
+    })
+    return s3, supabase
+
+
+def test_reconcile_reports_all_inconsistencies():
+    s3, supabase = build_backends()
+    findings = []
+
+    stats = reconcile_storage.reconcile(s3, supabase, BUCKET, workers=2, page_size=2, emit=findings.append)
+
+    assert stats["devices"] == 3
+    assert stats["orphan_object"] == 2
+    assert stats["missing_object"] == 2
+    assert stats["size_mismatch"] == 1
+    assert stats["errors"] == 0
+    assert {(f["type"], f["file_path"].split("/")[3]) for f in findings} == {
+        ("orphan_object", "01-30-00"),
+        ("orphan_object", "03-00-00"),
+        ("missing_object", "02-00-00"),
+        ("missing_object", "04-00-00"),
+        ("size_mismatch", "02-30-00"),
+    }
+
+
+def test_reconcile_repair_registers_orphans_and_fixes_sizes():
+    s3, supabase = build_backends()
+
+    stats = reconcile_storage.reconcile(s3, supabase, BUCKET, device_ids=["dev-a"], repair=True)
+    second = reconcile_storage.reconcile(s3, supabase, BUCKET, device_ids=["dev-a"])
+
+    assert stats["repaired"] == 2
+    repaired = [row for row in supabase.tables["audio_files"] if row["file_path"].endswith("01-30-00/audio.wav")][0]
+    # パスの日時はデバイスのタイムゾーン（Asia/Tokyo）の時刻
+    assert repaired["recorded_at"] == "2025-11-10T16:30:00+00:00"
+    assert repaired["local_date"] == "2025-11-11"
+    assert repaired["local_time"] == "2025-11-11T01:30:00"
+    assert repaired["time_block"] == "01-30"
+    assert repaired["sha256"] == hashlib.sha256(b"x" * 10).hexdigest()
+    assert second["orphan_object"] == 0
+    assert second["size_mismatch"] == 0
+    assert second["missing_object"] == 1
+
+
+def test_merge_join_matches_sorted_streams():
+    objects = iter([("files/d/a", 1), ("files/d/c", 1)])
+    rows = iter([{"device_id": "d", "file_path": "files/d/b"}, {"device_id": "d", "file_path": "files/d/c"}])
+
+    findings = list(reconcile_storage.merge_join(objects, rows))
+
+    assert [(f["type"], f["file_path"]) for f in findings] == [
+        ("orphan_object", "files/d/a"),
+        ("missing_object", "files/d/b"),
+    ]
+
+
+def test_recorded_at_from_path_uses_device_timezone():
+    path = "files/dev-a/2025-11-11/09-00-00/audio.wav"
+
+    assert reconcile_storage.recorded_at_from_path(path).isoformat() == "2025-11-11T09:00:00+00:00"
+    assert reconcile_storage.recorded_at_from_path(path, "Asia/Tokyo").isoformat() == "2025-11-11T00:00:00+00:00"
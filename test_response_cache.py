@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+一覧レスポンスキャッシュ（ETag / 304 / アップロード時の無効化）のテスト
+"""
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as vault
+from fake_backends import make_wav
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": "dev-a", "timezone": "UTC"}, {"device_id": "dev-b", "timezone": "UTC"}]
+
+
+@pytest.fixture
+def backends(backends):
+    for key in vault._response_cache_stats:
+        vault._response_cache_stats[key] = 0
+    return backends
+
+
+def list_files(client, headers=None, **params):
+    return client.get("/api/audio-files", params=params, headers=headers or {})
+
+
+def test_repeated_polls_are_served_from_cache_with_304(backends, upload):
+    _, supabase = backends
+    client = TestClient(vault.app)
+    assert upload("dev-a", "2025-11-11T01:00:00+00:00", make_wav(0.1)).status_code == 200
+
+    first = list_files(client, device_id="dev-a")
+    selects = len(supabase.calls)
+    second = list_files(client, device_id="dev-a")
+    third = list_files(client, headers={"If-None-Match": first.headers["etag"]}, device_id="dev-a")
+
+    assert first.headers["x-cache"] == "MISS"
+    assert second.headers["x-cache"] == "HIT"
+    assert second.json() == first.json()
+    assert third.status_code == 304
+    assert len(supabase.calls) == selects
+    stats = vault.get_response_cache_stats()
+    assert stats["hits"] == 2
+    assert stats["not_modified"] == 1
+
+
+def test_upload_invalidates_only_affected_entries(backends, upload):
+    client = TestClient(vault.app)
+    assert upload("dev-a", "2025-11-11T01:00:00+00:00", make_wav(0.1)).status_code == 200
+    assert upload("dev-b", "2025-11-11T01:00:00+00:00", make_wav(0.1)).status_code == 200
+
+    list_files(client, device_id="dev-a", date_from="2025-11-11", date_to="2025-11-11")
+    list_files(client, device_id="dev-a", date_from="2025-11-01", date_to="2025-11-05")
+    list_files(client, device_id="dev-b")
+    list_files(client)
+    client.get("/api/devices")
+
+    assert upload("dev-a", "2025-11-11T02:00:00+00:00", make_wav(0.1)).status_code == 200
+
+    assert list_files(client, device_id="dev-a", date_from="2025-11-11", date_to="2025-11-11").headers["x-cache"] == "MISS"
+    assert list_files(client, device_id="dev-a", date_from="2025-11-01", date_to="2025-11-05").headers["x-cache"] == "HIT"
+    assert list_files(client, device_id="dev-b").headers["x-cache"] == "HIT"
+    assert list_files(client).headers["x-cache"] == "MISS"
+    # 既存デバイスのアップロードではデバイス一覧は変わらない
+    assert client.get("/api/devices").headers["x-cache"] == "HIT"
+
+
+def test_new_device_invalidates_device_list(backends, upload):
+    client = TestClient(vault.app)
+    assert upload("dev-a", "2025-11-11T01:00:00+00:00", make_wav(0.1)).status_code == 200
+    client.get("/api/devices")
+
+    assert upload("dev-b", "2025-11-11T01:00:00+00:00", make_wav(0.1)).status_code == 200
+    response = client.get("/api/devices")
+
+    assert response.headers["x-cache"] == "MISS"
+    assert response.json()["total_count"] == 2
+
+
+def test_metrics_expose_hit_ratio(backends):
+    client = TestClient(vault.app)
+    list_files(client)
+    list_files(client)
+
+    metrics = client.get("/api/metrics").json()
+
+    assert metrics["response_cache"]["hit_ratio"] == 0.5
+
+
+def test_response_read_before_invalidation_is_not_cached(backends):
+    generation = vault.response_cache_generation()
+    # 読み込み中にレプリケーションのワーカーなどが dev-a / 2025-11-11 を無効化した
+    vault.invalidate_response_cache("dev-a", "2025-11-11")
+
+    vault.cache_response(("stale",), {"files": []}, device_id="dev-a", generation=generation)
+    vault.cache_response(("other-device",), {"files": []}, device_id="dev-b", generation=generation)
+    vault.cache_response(("other-range",), {"files": []}, device_id="dev-a",
+                         date_from="2025-11-01", date_to="2025-11-05", generation=generation)
+
+    assert vault.get_cached_response(("stale",)) is None
+    assert vault.get_cached_response(("other-device",)) is not None
+    assert vault.get_cached_response(("other-range",)) is not None
+    assert vault.get_response_cache_stats()["stale_skips"] == 1
+
+
+def test_response_is_not_cached_when_invalidation_log_overflows(backends, monkeypatch):
+    monkeypatch.setattr(vault, "_response_cache_invalidations", vault.deque(maxlen=2))
+    generation = vault.response_cache_generation()
+    for day in range(3):
+        vault.invalidate_response_cache("dev-b", f"2025-11-1{day}")
+
+    vault.cache_response(("overflow",), {"files": []}, device_id="dev-a", generation=generation)
+
+    assert vault.get_cached_response(("overflow",)) is None
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+orjson によるレスポンスのシリアライズ（encode_json / FastJSONResponse / レスポンスモデル）のテスト
+"""
+
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import numpy as np
+import pytest
+import pytz
+from dateutil import parser as date_parser
+from fastapi.testclient import TestClient
+
+import app as vault
+import benchmark_serialization
+
+DEVICE_ID = 'serialization-device'
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": DEVICE_ID, "timezone": "Asia/Tokyo"}]
+
+
+def test_encode_json_matches_previous_json_dumps_output():
+    content = {
+        "recorded_at": date_parser.parse("2025-07-19T13:30:15.123+09:00"),
+        "timestamp": pytz.UTC.localize(datetime(2025, 11, 10, 2, 1, 55)),
+        "size": Decimal("1.5"),
+        "label": "録音",
+    }
+
+    expected = json.dumps({
+        **content,
+        "recorded_at": content["recorded_at"].isoformat(),
+        "timestamp": content["timestamp"].isoformat(),
+    }, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+    assert vault.encode_json(content) == expected
+    assert vault.encode_json({"peaks": np.array([0.25, 0.5])}) == b'{"peaks":[0.25,0.5]}'
+
+
+def test_audio_files_page_serializes_rows_without_copy():
+    rows = benchmark_serialization.make_rows(3)
+
+    body = benchmark_serialization.run_in_place(rows)
+
+    assert json.loads(body) == json.loads(benchmark_serialization.run_dict_copy(benchmark_serialization.make_rows(3)))
+    assert rows[0]["last_modified"].tzinfo is not None
+
+
+def test_endpoints_return_same_shape_with_orjson(backends, upload):
+    client = TestClient(vault.app)
+
+    uploaded = upload(DEVICE_ID, "2025-11-11T12:00:00+09:00").json()
+    listing = client.get(f"/api/audio-files?device_id={DEVICE_ID}").json()
+    health = client.get("/health").json()
+
+    assert uploaded["recorded_at"] == "2025-11-11T12:00:00+09:00"
+    assert uploaded["supabase_id"] is None
+    assert listing["total_count"] == 1
+    assert listing["files"][0]["file_exists"] is True
+    assert date_parser.parse(listing["files"][0]["last_modified"]).tzinfo is not None
+    assert health["status"] == "healthy"
+    assert date_parser.parse(health["timestamp"]).tzinfo is not None
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+SKIP対象データの保存ポリシー（SKIP_STORAGE_POLICY）のテスト
+フェイクのS3/Supabaseに対して /upload を実行し、保存先とステータスを確認する
+"""
+
+import io
+import wave
+
+import pytest
+
+import app as vault
+
+SKIP_DEVICE_ID = '9f7d6e27-98c3-4c19-bdfb-f7fda58b9a93'
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": SKIP_DEVICE_ID, "timezone": "Asia/Tokyo"}]
+
+
+def test_store_policy_keeps_files_prefix(backends, upload, monkeypatch):
+    s3, supabase = backends
+    monkeypatch.setattr(vault, "SKIP_STORAGE_POLICY", "store")
+
+    # 2025-11-11 14:00 UTC = 23:00 JST（SKIP対象）
+    response = upload(SKIP_DEVICE_ID, "2025-11-11T14:00:00+00:00")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["processing_status"] == "skipped"
+    assert body["s3_key"].startswith("files/")
+    assert ("put_object", body["s3_key"]) in s3.calls
+    assert supabase.tables["audio_files"][0]["transcriptions_status"] == "skipped"
+
+
+def test_discard_policy_records_metadata_only(backends, upload, monkeypatch):
+    s3, supabase = backends
+    monkeypatch.setattr(vault, "SKIP_STORAGE_POLICY", "discard")
+
+    response = upload(SKIP_DEVICE_ID, "2025-11-11T14:00:00+00:00")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["stored"] is False
+    assert not [call for call in s3.calls if call[0] == "put_object" and call[1].endswith(".wav")]
+    row = supabase.tables["audio_files"][0]
+    assert row["file_path"].startswith(f"{vault.SKIP_DISCARD_PREFIX}/")
+    assert not vault.is_stored_file_path(row["file_path"])
+    assert row["emotion_features_status"] == "skipped"
+
+
+def test_cold_policy_uses_storage_class_outside_files_prefix(backends, upload, monkeypatch):
+    s3, _ = backends
+    monkeypatch.setattr(vault, "SKIP_STORAGE_POLICY", "cold")
+
+    body = upload(SKIP_DEVICE_ID, "2025-11-11T14:00:00+00:00").json()
+
+    stored = s3.objects[(vault.S3_BUCKET_NAME, body["s3_key"])]
+    assert body["s3_key"].startswith("skipped/")
+    assert stored["StorageClass"] == vault.SKIP_STORAGE_CLASS
+
+
+def test_preview_policy_stores_downsampled_audio(backends, upload, monkeypatch):
+    s3, _ = backends
+    monkeypatch.setattr(vault, "SKIP_STORAGE_POLICY", "preview")
+
+    body = upload(SKIP_DEVICE_ID, "2025-11-11T14:00:00+00:00").json()
+
+    stored = s3.objects[(vault.S3_BUCKET_NAME, body["s3_key"])]
+    assert body["s3_key"].endswith("/preview.wav")
+    with wave.open(io.BytesIO(stored["Body"]), 'rb') as wav:
+        assert wav.getframerate() == vault.SKIP_PREVIEW_FRAME_RATE
+
+
+def test_policy_ignored_outside_skip_hours(backends, upload, monkeypatch):
+    s3, supabase = backends
+    monkeypatch.setattr(vault, "SKIP_STORAGE_POLICY", "discard")
+
+    # 2025-11-11 03:00 UTC = 12:00 JST（SKIP対象外）
+    body = upload(SKIP_DEVICE_ID, "2025-11-11T03:00:00+00:00").json()
+
+    assert body["processing_status"] == "pending"
+    assert body["stored"] is True
+    assert body["s3_key"].startswith("files/")
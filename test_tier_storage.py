@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+tier_storage.py（ストレージ階層化）と、アーカイブ済みオブジェクトの復元（presigned-url）のテスト
+"""
+
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as vault
+import tier_storage
+
+BUCKET = vault.S3_BUCKET_NAME
+DEVICE_ID = 'tier-device'
+TODAY = date(2025, 11, 20)
+
+
+def make_row(local_date: str, status: str = "completed", **values) -> dict:
+    return {
+        "device_id": DEVICE_ID,
+        "recorded_at": f"{local_date}T03:00:00+00:00",
+        "local_date": local_date,
+        "file_path": f"files/{DEVICE_ID}/{local_date}/03-00-00/audio.wav",
+        "file_size_bytes": 4,
+        "transcriptions_status": status,
+        "behavior_features_status": status,
+        "emotion_features_status": "skipped",
+        **values
+    }
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": DEVICE_ID, "timezone": "UTC"}]
+
+
+@pytest.fixture
+def backends(backends):
+    s3, supabase = backends
+    rows = [
+        make_row("2024-10-01"),                      # 415日 → GLACIER
+        make_row("2025-07-01"),                      # 142日 → GLACIER_IR
+        make_row("2025-10-01"),                      # 50日 → STANDARD_IA
+        make_row("2025-11-15"),                      # 5日 → 対象外
+        make_row("2025-09-01", status="pending"),    # 処理中 → 対象外
+        make_row("2025-08-01", storage_tier="GLACIER_IR"),  # 移動済み
+    ]
+    for row in rows:
+        s3.put_object(Bucket=BUCKET, Key=row["file_path"], Body=b"RIFF")
+    s3.objects[(BUCKET, rows[5]["file_path"])]["StorageClass"] = "GLACIER_IR"
+    supabase.tables["audio_files"] = rows
+    return s3, supabase
+
+
+def storage_classes(s3, supabase):
+    return [(s3.objects[(BUCKET, row["file_path"])]["StorageClass"], row.get("storage_tier"))
+            for row in supabase.tables["audio_files"]]
+
+
+def test_objects_are_tiered_by_age_and_status(backends):
+    s3, supabase = backends
+
+    stats = tier_storage.tier(s3, supabase, BUCKET, today=TODAY, batch_size=2)
+
+    assert stats["transitioned"] == 3
+    assert stats["errors"] == 0
+    assert storage_classes(s3, supabase) == [
+        ("GLACIER", "GLACIER"),
+        ("GLACIER_IR", "GLACIER_IR"),
+        ("STANDARD_IA", "STANDARD_IA"),
+        ("STANDARD", None),
+        ("STANDARD", None),
+        ("GLACIER_IR", "GLACIER_IR"),
+    ]
+    assert s3.objects[(BUCKET, supabase.tables["audio_files"][0]["file_path"])]["Body"] == b"RIFF"
+
+
+def test_tiering_is_idempotent_and_records_already_moved_objects(backends):
+    s3, supabase = backends
+    tier_storage.tier(s3, supabase, BUCKET, today=TODAY)
+    # コピー後に行の更新だけが失敗した状態を模擬する
+    supabase.tables["audio_files"][2]["storage_tier"] = None
+    s3.calls.clear()
+
+    stats = tier_storage.tier(s3, supabase, BUCKET, today=TODAY)
+
+    assert stats["transitioned"] == 0
+    assert stats["already"] == 1
+    assert not [call for call in s3.calls if call[0] == "copy_object"]
+    assert supabase.tables["audio_files"][2]["storage_tier"] == "STANDARD_IA"
+
+
+def test_dry_run_does_not_touch_storage(backends):
+    s3, supabase = backends
+
+    stats = tier_storage.tier(s3, supabase, BUCKET, today=TODAY, dry_run=True)
+
+    assert stats["dry_run"] == 3
+    assert stats["bytes"] == 12
+    assert not [call for call in s3.calls if call[0] in ("head_object", "copy_object")]
+
+
+def test_presigned_url_restores_archived_objects_on_demand(backends):
+    s3, supabase = backends
+    tier_storage.tier(s3, supabase, BUCKET, today=TODAY)
+    client = TestClient(vault.app)
+    file_path = supabase.tables["audio_files"][0]["file_path"]
+    url = f"/api/audio-files/presigned-url?file_path={file_path}"
+
+    status_only = client.get(url + "&restore=false")
+    requested = client.get(url)
+    in_progress = client.get(url)
+    s3.complete_restore(BUCKET, file_path)
+    restored = client.get(url)
+
+    assert status_only.status_code == 202
+    assert status_only.json()["restore_status"] == "archived"
+    assert requested.status_code == 202
+    assert requested.json()["restore_status"] == "requested"
+    assert requested.headers["Retry-After"] == str(vault.STORAGE_RESTORE_RETRY_AFTER_SECONDS)
+    assert in_progress.json()["restore_status"] == "in_progress"
+    assert restored.status_code == 200
+    assert restored.json()["restore_status"] == "restored"
+    assert restored.json()["presigned_url"].startswith("https://fake-s3/")
+    assert [call for call in s3.calls if call[0] == "restore_object"] == [("restore_object", file_path)]
+
+    # GLACIER_IR は復元なしで取り出せる
+    instant = client.get(f"/api/audio-files/presigned-url?file_path={supabase.tables['audio_files'][1]['file_path']}")
+    assert instant.status_code == 200
+    assert "restore_status" not in instant.json()
+
+
+def test_rows_without_size_are_tiered_and_discard_rows_are_skipped(backends):
+    s3, supabase = backends
+    legacy = make_row("2025-10-02", file_size_bytes=None)
+    s3.put_object(Bucket=BUCKET, Key=legacy["file_path"], Body=b"RIFF")
+    supabase.tables["audio_files"] += [
+        legacy,
+        make_row("2025-10-03", file_size_bytes=None,
+                 file_path=f"{vault.SKIP_DISCARD_PREFIX}/{DEVICE_ID}/2025-10-03/03-00-00/audio.wav"),
+        # 旧形式の discard 行（オブジェクトなし）
+        make_row("2025-10-04", file_size_bytes=None,
+                 file_path=f"skipped/{DEVICE_ID}/2025-10-04/03-00-00/audio.wav"),
+    ]
+
+    assert tier_storage.tier(s3, supabase, BUCKET, today=TODAY, dry_run=True)["dry_run"] == 5
+    stats = tier_storage.tier(s3, supabase, BUCKET, today=TODAY)
+
+    assert stats["transitioned"] == 4
+    assert stats["missing"] == 1
+    assert stats["errors"] == 0
+    assert legacy["storage_tier"] == "STANDARD_IA"
+    assert s3.objects[(BUCKET, legacy["file_path"])]["StorageClass"] == "STANDARD_IA"
+    assert supabase.tables["audio_files"][-2].get("storage_tier") is None
+
+
+@pytest.mark.parametrize("endpoint", ["stream", "peaks"])
+def test_stream_and_peaks_request_restore_for_archived_objects(backends, endpoint):
+    s3, supabase = backends
+    tier_storage.tier(s3, supabase, BUCKET, today=TODAY)
+    client = TestClient(vault.app)
+    file_path = supabase.tables["audio_files"][0]["file_path"]
+    url = f"/api/audio-files/{endpoint}?file_path={file_path}"
+
+    requested = client.get(url)
+    in_progress = client.get(url)
+
+    assert requested.status_code == 202
+    assert requested.json() == {
+        "file_path": file_path,
+        "storage_class": "GLACIER",
+        "restore_status": "requested",
+        "retry_after_seconds": vault.STORAGE_RESTORE_RETRY_AFTER_SECONDS,
+        "bucket": BUCKET,
+    }
+    assert requested.headers["Retry-After"] == str(vault.STORAGE_RESTORE_RETRY_AFTER_SECONDS)
+    assert in_progress.json()["restore_status"] == "in_progress"
+    assert [call for call in s3.calls if call[0] == "restore_object"] == [("restore_object", file_path)]
+
+
+def test_rows_deleted_during_tiering_are_not_recreated(backends, monkeypatch):
+    s3, supabase = backends
+    transition_object = tier_storage.transition_object
+    deleted = supabase.tables["audio_files"][1]
+
+    def deleting_transition(s3, bucket, file_path, storage_class):
+        # オブジェクトを移している間に行が削除された
+        if file_path == deleted["file_path"]:
+            supabase.tables["audio_files"].remove(deleted)
+        return transition_object(s3, bucket, file_path, storage_class)
+
+    monkeypatch.setattr(tier_storage, "transition_object", deleting_transition)
+
+    stats = tier_storage.tier(s3, supabase, BUCKET, today=TODAY)
+
+    assert stats["transitioned"] == 3
+    assert deleted["recorded_at"] not in [row["recorded_at"] for row in supabase.tables["audio_files"]]
+    assert supabase.tables["audio_files"][0]["storage_tier"] == "GLACIER"
+
+
+def lambda_notification(events, prefix="files/"):
+    return {"LambdaFunctionConfigurations": [{
+        "Id": "audio-processor",
+        "LambdaFunctionArn": "arn:aws:lambda:ap-southeast-2:000000000000:function:audio-processor",
+        "Events": events,
+        "Filter": {"Key": {"FilterRules": [{"Name": "Prefix", "Value": prefix}]}},
+    }]}
+
+
+def test_tiering_refuses_to_run_when_copy_events_are_notified(backends):
+    s3, supabase = backends
+    s3.notification_configuration = lambda_notification(["s3:ObjectCreated:*"])
+
+    with pytest.raises(RuntimeError, match="audio-processor"):
+        tier_storage.tier(s3, supabase, BUCKET, today=TODAY)
+
+    assert not [call for call in s3.calls if call[0] == "copy_object"]
+    # ドライランは通知を発生させないため確認しない
+    assert tier_storage.tier(s3, supabase, BUCKET, today=TODAY, dry_run=True)["dry_run"] == 3
+
+
+def test_notification_check_accepts_put_only_and_unrelated_prefixes(backends):
+    s3, _ = backends
+
+    s3.notification_configuration = lambda_notification(["s3:ObjectCreated:Put"])
+    assert tier_storage.check_event_notifications(s3, BUCKET) == []
+    s3.notification_configuration = lambda_notification(["s3:ObjectCreated:*"], prefix="archives/")
+    assert tier_storage.check_event_notifications(s3, BUCKET) == []
+    s3.notification_configuration = lambda_notification(["s3:ObjectCreated:Copy"], prefix="")
+    assert tier_storage.check_event_notifications(s3, BUCKET) == ["audio-processor: s3:ObjectCreated:Copy"]
+    s3.notification_configuration = {"EventBridgeConfiguration": {}}
+    assert len(tier_storage.check_event_notifications(s3, BUCKET)) == 1
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+分散トレーシング（スパンの記録・エクスポーター・トレースIDの返却）のテスト
+"""
+
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as vault
+
+DEVICE_ID = 'tracing-device'
+RECORDED_AT = '2025-11-11T03:00:00+00:00'
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+SAMPLED = {"traceparent": f"00-{TRACE_ID}-00f067aa0ba902b7-01"}
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": DEVICE_ID, "timezone": "UTC"}]
+
+
+@pytest.fixture
+def exporter(backends, monkeypatch):
+    exporter = vault.InMemorySpanExporter()
+    monkeypatch.setattr(vault, "span_exporter", exporter)
+    monkeypatch.setattr(vault, "TRACE_SAMPLE_RATE", 0.0)
+    monkeypatch.setattr(vault, "ADMIN_TOKEN", "secret")
+    return exporter
+
+
+def test_sampled_upload_records_a_span_per_stage(exporter, upload):
+    response = upload(DEVICE_ID, RECORDED_AT, headers=SAMPLED)
+
+    assert response.status_code == 200
+    assert response.headers["X-Trace-Id"] == TRACE_ID
+    assert response.json()["trace_id"] == TRACE_ID
+
+    spans = exporter.get_trace(TRACE_ID)
+    names = [span["name"] for span in spans]
+    for stage in ("POST /upload", "upload.receive_multipart", "upload.read", "upload.convert",
+                  "upload.device_lookup", "s3.put_object", "supabase.insert", "upload.manifest"):
+        assert stage in names
+
+    root = next(span for span in spans if span["name"] == "POST /upload")
+    assert root["parent_span_id"] == "00f067aa0ba902b7"
+    assert root["attributes"]["http.status_code"] == 200
+    put = next(span for span in spans if span["name"] == "s3.put_object")
+    assert put["parent_span_id"] == root["span_id"]
+    assert put["attributes"]["s3.retry_attempts"] == 0
+    assert all(span["end_time_unix_nano"] >= span["start_time_unix_nano"] for span in spans)
+
+
+def test_unsampled_requests_return_trace_id_without_recording(exporter, upload):
+    response = upload(DEVICE_ID, RECORDED_AT)
+
+    assert len(response.headers["X-Trace-Id"]) == 32
+    assert response.headers["traceparent"].endswith("-00")
+    assert list(exporter.spans) == []
+
+
+def test_failed_s3_put_marks_span_as_error(exporter, upload, monkeypatch):
+    def failing_put_object(**kwargs):
+        raise ConnectionError("connection reset")
+
+    monkeypatch.setattr(vault.s3_client, "put_object", failing_put_object)
+
+    assert upload(DEVICE_ID, RECORDED_AT, headers=SAMPLED).status_code == 500
+
+    put = next(span for span in exporter.get_trace(TRACE_ID) if span["name"] == "s3.put_object")
+    assert put["status"] == "ERROR"
+    assert "connection reset" in put["attributes"]["error"]
+
+
+def test_replication_spans_join_the_upload_trace(exporter, upload, monkeypatch, tmp_path):
+    monkeypatch.setattr(vault, "LOCAL_INGEST_DIR", str(tmp_path))
+    monkeypatch.setattr(vault, "_replication_state", {
+        "workers": [], "in_flight": 0, "replicated": 0, "retries": 0,
+        "failed": 0, "rejected_uploads": 0, "last_lag_seconds": None
+    })
+    vault._replication_pending.clear()
+
+    try:
+        assert upload(DEVICE_ID, RECORDED_AT, headers=SAMPLED).status_code == 200
+        assert vault.flush_replication(5.0)
+    finally:
+        vault.shutdown_replicator(5.0)
+
+    names = [span["name"] for span in exporter.get_trace(TRACE_ID)]
+    assert "local_ingest.stage" in names
+    assert "replication.job" in names
+    assert "s3.upload_file" in names
+
+
+def test_admin_trace_endpoint_and_file_exporter(exporter, upload, tmp_path):
+    upload(DEVICE_ID, RECORDED_AT, headers=SAMPLED)
+    client = TestClient(vault.app)
+
+    body = client.get(f"/api/admin/traces/{TRACE_ID}", headers={"X-Admin-Token": "secret"}).json()
+    assert body["span_count"] == len(exporter.get_trace(TRACE_ID))
+    assert client.get(f"/api/admin/traces/{'0' * 31}1", headers={"X-Admin-Token": "secret"}).status_code == 404
+
+    file_exporter = vault.FileSpanExporter(str(tmp_path / "traces.jsonl"))
+    for span in body["spans"]:
+        file_exporter.export(span)
+    with open(tmp_path / "traces.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line)["span_id"] for line in f] == [span["span_id"] for span in body["spans"]]
+
+
+@pytest.mark.parametrize("header", [None, "", "garbage", f"00-{'0' * 32}-00f067aa0ba902b7-01",
+                                    f"00-{TRACE_ID}-short-01"])
+def test_invalid_traceparent_is_ignored(header):
+    assert vault.parse_traceparent(header) is None
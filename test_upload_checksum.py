@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+アップロード時のチェックサム（SHA-256 / S3 ChecksumSHA256）のテスト
+"""
+
+import base64
+import hashlib
+
+import pytest
+
+import app as vault
+from fake_backends import make_wav
+
+DEVICE_ID = 'checksum-device'
+RECORDED_AT = '2025-11-11T01:00:00+00:00'
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": DEVICE_ID, "timezone": "UTC"}]
+
+
+def test_sha256_is_sent_to_s3_stored_and_returned(backends, upload, monkeypatch):
+    s3, supabase = backends
+    # 複数チャンクに分けて読み込まれるようにする
+    monkeypatch.setattr(vault, "UPLOAD_READ_CHUNK_SIZE", 1000)
+    content = make_wav(1.0)
+    expected = hashlib.sha256(content).hexdigest()
+
+    response = upload(DEVICE_ID, RECORDED_AT, content)
+
+    assert response.status_code == 200
+    assert response.json()["sha256"] == expected
+    assert supabase.tables["audio_files"][0]["sha256"] == expected
+    stored = s3.objects[(vault.S3_BUCKET_NAME, response.json()["s3_key"])]
+    assert stored["ChecksumSHA256"] == base64.b64encode(bytes.fromhex(expected)).decode()
+
+
+def test_client_checksum_is_verified(backends, upload):
+    s3, supabase = backends
+    content = make_wav(0.1)
+
+    ok = upload(DEVICE_ID, RECORDED_AT, content, sha256=hashlib.sha256(content).hexdigest().upper())
+    supabase.tables["audio_files"].clear()
+    mismatch = upload(DEVICE_ID, RECORDED_AT, content, sha256="0" * 64)
+
+    assert ok.status_code == 200
+    assert mismatch.status_code == 400
+    assert "Checksum mismatch" in mismatch.json()["detail"]
+    assert supabase.tables["audio_files"] == []
+
+
+def test_oversized_upload_returns_413(backends, upload, monkeypatch):
+    monkeypatch.setattr(vault, "MAX_UPLOAD_SIZE_BYTES", 100)
+
+    response = upload(DEVICE_ID, RECORDED_AT, make_wav(0.1))
+
+    assert response.status_code == 413
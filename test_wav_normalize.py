@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+WAV正規化（16kHz / mono / 16-bit へのダウンミックス・リサンプリング）のテスト
+"""
+
+import io
+import asyncio
+import wave
+import hashlib
+
+import numpy as np
+import pytest
+
+import app as vault
+
+DEVICE_ID = 'normalize-device'
+
+
+@pytest.fixture
+def devices():
+    return [{"device_id": DEVICE_ID, "timezone": "UTC"}]
+
+
+def make_tone_wav(frame_rate: int, channels: int, frequency: float = 1000.0, seconds: float = 1.0,
+                  sample_width: int = 2) -> bytes:
+    t = np.arange(int(frame_rate * seconds)) / frame_rate
+    data = np.repeat(0.5 * np.sin(2 * np.pi * frequency * t)[:, None], channels, axis=1)
+    if sample_width == 1:
+        pcm = np.rint(data * 127 + 128).astype(np.uint8).tobytes()
+    else:
+        pcm = np.rint(data * 32767).astype('<i2').tobytes()
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(sample_width)
+        wav.setframerate(frame_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def decode(wav_content: bytes) -> tuple[np.ndarray, dict]:
+    samples, info = vault.wav_samples(wav_content)
+    return samples[:, 0] / 32767, info
+
+
+def test_compliant_wav_is_returned_without_copy():
+    wav_content = make_tone_wav(16000, 1)
+
+    normalized, converted = vault.normalize_wav(wav_content)
+
+    assert converted is False
+    assert normalized is wav_content
+
+
+@pytest.mark.parametrize("frame_rate,channels,sample_width", [
+    (44100, 2, 2),
+    (48000, 1, 2),
+    (22050, 2, 2),
+    (8000, 1, 1),
+    (16000, 2, 2),
+])
+def test_resampled_tone_matches_reference(frame_rate, channels, sample_width):
+    normalized, converted = vault.normalize_wav(make_tone_wav(frame_rate, channels, sample_width=sample_width))
+    samples, info = decode(normalized)
+
+    assert converted is True
+    assert vault.is_watchme_wav(info)
+    assert samples.shape[0] == 16000
+    reference = 0.5 * np.sin(2 * np.pi * 1000 * np.arange(16000) / 16000)
+    tolerance = 0.02 if sample_width == 1 else 0.001
+    assert np.abs(samples - reference)[200:-200].max() < tolerance
+
+
+def test_content_above_nyquist_is_filtered_out():
+    # 12kHzは16kHz出力のナイキスト周波数（8kHz）を超えるため除去される（折り返さない）
+    normalized, _ = vault.normalize_wav(make_tone_wav(44100, 1, frequency=12000))
+    samples, _ = decode(normalized)
+
+    assert np.abs(samples[200:-200]).max() < 0.001
+
+
+def test_upload_stores_normalized_wav(backends, upload):
+    s3, supabase = backends
+
+    response = upload(DEVICE_ID, "2025-11-11T03:00:00+00:00", make_tone_wav(48000, 2))
+
+    assert response.status_code == 200
+    body = response.json()
+    stored = s3.objects[(vault.S3_BUCKET_NAME, body["s3_key"])]["Body"]
+    assert vault.is_watchme_wav(vault.read_wav_info(stored))
+    assert body["sha256"] == hashlib.sha256(stored).hexdigest()
+    assert supabase.tables["audio_files"][0]["file_size_bytes"] == len(stored)
+
+
+def test_upload_normalizes_off_the_event_loop(backends, upload, monkeypatch):
+    normalize_wav = vault.normalize_wav
+    loops = []
+
+    def recording_normalize(wav_content):
+        try:
+            loops.append(asyncio.get_running_loop())
+        except RuntimeError:
+            loops.append(None)
+        return normalize_wav(wav_content)
+
+    monkeypatch.setattr(vault, "normalize_wav", recording_normalize)
+
+    assert upload(DEVICE_ID, "2025-11-11T03:00:00+00:00", make_tone_wav(48000, 2)).status_code == 200
+    assert loops == [None]
+
+
+def test_upload_stores_peaks_and_indexes_off_the_event_loop(backends, upload, monkeypatch):
+    loops = {}
+
+    def recording(name, func):
+        def wrapper(*args, **kwargs):
+            try:
+                loops[name] = asyncio.get_running_loop()
+            except RuntimeError:
+                loops[name] = None
+            return func(*args, **kwargs)
+        return wrapper
+
+    for name in ("store_audio_object", "store_peaks", "update_day_indexes"):
+        monkeypatch.setattr(vault, name, recording(name, getattr(vault, name)))
+
+    assert upload(DEVICE_ID, "2025-11-11T03:10:00+00:00", make_tone_wav(16000, 1)).status_code == 200
+    assert loops == {"store_audio_object": None, "store_peaks": None, "update_day_indexes": None}
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+処理が完了した録音を低コストのストレージクラスへ移すストレージ階層化
+
+audio_files の処理ステータス（transcriptions / behavior_features / emotion_features）が
+すべて完了（completed / skipped）した行について、ローカル日付からの経過日数に応じて
+app.STORAGE_TIER_RULES のストレージクラスへ S3 オブジェクトを移し、
+audio_files.storage_tier / tiered_at に記録する。
+
+- デバイスごとに recorded_at のキーセットページングで読み出し、1ページを1バッチとして処理する
+- S3への操作（head_object / copy_object）は全デバイスで共有するスレッドプールで実行する（並列数 --workers）
+- 同じキーへの copy_object でストレージクラスだけを変更する（S3イベントは ObjectCreated:Copy）。
+  audio-processor Lambda などが Copy で再処理されないよう、実行前にバケットのイベント通知設定を確認し、
+  対象のキーに ObjectCreated:* / ObjectCreated:Copy（または EventBridge 連携）が設定されている場合は中止する
+  （通知は ObjectCreated:Put のみにすること。確認済みの場合は --skip-notification-check で省略できる）
+- 現在のストレージクラスは head_object で確認し、既に同じか低い階層のオブジェクトはコピーしない
+  （行の更新に失敗しても、再実行すれば行だけが更新される）
+- 上の階層には戻さない。GLACIER などへ移したオブジェクトは /api/audio-files/presigned-url・stream・peaks へのアクセスで復元を要求する
+
+使用方法:
+    python tier_storage.py --dry-run                     # 対象の件数とサイズのみ表示
+    python tier_storage.py                               # 全デバイス
+    python tier_storage.py --device DEVICE_ID --workers 32
+"""
+
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+import pytz
+from botocore.exceptions import ClientError
+from postgrest.types import ReturnMethod
+
+import app
+from app import storage_class_rank
+
+# 1ページあたりの行数
+DEFAULT_BATCH_SIZE = 500
+
+# 1回の update で recorded_at を in で指定する最大行数（URLの長さを抑える）
+UPDATE_CHUNK_SIZE = 100
+
+# S3への同時リクエスト数（全デバイス合計）
+DEFAULT_WORKERS = 16
+
+# 同じキーへの copy_object で発生し、通知対象にしてはいけないイベント
+COPY_EVENTS = ("s3:ObjectCreated:*", "s3:ObjectCreated:Copy")
+
+# 階層化の対象になるキーのプレフィックスとファイル名（イベント通知のフィルターとの照合用）
+TIERED_KEY_PREFIXES = ("files/", f"{app.SKIP_STORAGE_PREFIX}/")
+TIERED_KEY_NAMES = ("audio.wav", "preview.wav")
+
+STATUS_COLUMNS = ("transcriptions_status", "behavior_features_status", "emotion_features_status")
+
+TIER_COLUMNS = ", ".join([
+    "device_id", "recorded_at", "local_date", "file_path", "file_size_bytes",
+    "replication_status", "storage_tier", *STATUS_COLUMNS
+])
+
+
+# =========================================
+# 対象の決定
+# =========================================
+def target_storage_class(row: dict, today: date, rules=None) -> Optional[str]:
+    """行を移すべきストレージクラスを返す（移す必要がない場合はNone）"""
+    # 音声を保存していない行（discard ポリシー）と、S3へのレプリケーション待ちの行は対象外
+    # （file_size_bytes が NULL の旧い行も対象にする。オブジェクトがなければ transition_object が missing を返す）
+    if not app.is_stored_file_path(row.get("file_path")) or row.get("replication_status") == "pending":
+        return None
+    if any(row.get(column) not in app.STORAGE_TIER_DONE_STATUSES for column in STATUS_COLUMNS):
+        return None
+
+    age_days = (today - date.fromisoformat(str(row["local_date"]))).days
+    target = None
+    for min_age_days, storage_class in rules or app.STORAGE_TIER_RULES:
+        if age_days >= min_age_days and storage_class_rank(storage_class) > storage_class_rank(target):
+            target = storage_class
+    if target is None or storage_class_rank(target) <= storage_class_rank(row.get("storage_tier")):
+        return None
+    return target
+
+
+def tier_cutoff_date(today: date, rules=None) -> str:
+    """いずれかのルールの対象になりうる最も新しいローカル日付"""
+    min_age_days = min(age for age, _ in rules or app.STORAGE_TIER_RULES)
+    return (today - timedelta(days=min_age_days)).isoformat()
+
+
+def iter_pages(supabase, device_id: str, date_to: str, page_size: int = DEFAULT_BATCH_SIZE):
+    """デバイスの date_to 以前の audio_files 行を recorded_at 順にキーセットページングでページ単位に返す"""
+    after = None
+    while True:
+        query = supabase.table("audio_files").select(TIER_COLUMNS) \
+            .eq("device_id", device_id) \
+            .lte("local_date", date_to)
+        if after is not None:
+            query = query.gt("recorded_at", after)
+        rows = query.order("recorded_at").limit(page_size).execute().data
+        if rows:
+            yield rows
+        if len(rows) < page_size:
+            return
+        after = rows[-1]["recorded_at"]
+
+
+# =========================================
+# 実行前の確認（S3イベント通知）
+# =========================================
+def _filter_matches_tiered_keys(notification: dict) -> bool:
+    """通知のキーフィルター（prefix / suffix）が階層化の対象のキーに一致しうるか"""
+    rules = {rule["Name"].lower(): rule["Value"]
+             for rule in notification.get("Filter", {}).get("Key", {}).get("FilterRules", [])}
+    prefix = rules.get("prefix", "")
+    suffix = rules.get("suffix", "")
+    prefix_matches = any(key_prefix.startswith(prefix) or prefix.startswith(key_prefix)
+                         for key_prefix in TIERED_KEY_PREFIXES)
+    return prefix_matches and any(name.endswith(suffix) for name in TIERED_KEY_NAMES)
+
+
+def check_event_notifications(s3, bucket: str) -> list[str]:
+    """
+    階層化のコピー（ObjectCreated:Copy）で発火するイベント通知がないか確認する
+
+    Returns:
+        list[str]: 問題のある通知の説明（空の場合は実行してよい）
+    """
+    config = s3.get_bucket_notification_configuration(Bucket=bucket)
+    problems = []
+    for kind, arn_key in (("LambdaFunctionConfigurations", "LambdaFunctionArn"),
+                          ("QueueConfigurations", "QueueArn"),
+                          ("TopicConfigurations", "TopicArn")):
+        for notification in config.get(kind, []):
+            events = [event for event in notification.get("Events", []) if event in COPY_EVENTS]
+            if events and _filter_matches_tiered_keys(notification):
+                name = notification.get("Id") or notification.get(arn_key)
+                problems.append(f"{name}: {', '.join(events)}")
+    if "EventBridgeConfiguration" in config:
+        # EventBridge には Copy を含むすべてのイベントが送られる（ルール側のフィルターは確認できない）
+        problems.append("EventBridge: all events (including ObjectCreated:Copy) are delivered")
+    return problems
+
+
+# =========================================
+# ストレージクラスの変更
+# =========================================
+def transition_object(s3, bucket: str, file_path: str, storage_class: str) -> dict:
+    """
+    オブジェクトを指定のストレージクラスへ移す
+
+    Returns:
+        dict: status（transitioned / already / missing）と現在のストレージクラス・サイズ
+    """
+    try:
+        head = s3.head_object(Bucket=bucket, Key=file_path)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ("404", "NoSuchKey", "NotFound"):
+            return {"status": "missing"}
+        raise
+
+    current = head.get("StorageClass") or "STANDARD"
+    size = head["ContentLength"]
+    # 復元が必要なクラスのオブジェクトはコピーできないため、より低い階層にも移さない
+    if storage_class_rank(current) >= storage_class_rank(storage_class) or current in app.STORAGE_RESTORE_CLASSES:
+        return {"status": "already", "storage_class": current, "bytes": size}
+
+    s3.copy_object(
+        Bucket=bucket,
+        Key=file_path,
+        CopySource={"Bucket": bucket, "Key": file_path},
+        StorageClass=storage_class,
+        MetadataDirective="COPY",
+        ChecksumAlgorithm="SHA256"
+    )
+    return {"status": "transitioned", "storage_class": storage_class, "bytes": size}
+
+
+def tier_batch(s3, supabase, bucket: str, rows: list[dict], executor, today: date,
+               dry_run: bool = False) -> dict:
+    """
+    1ページ分の行を並列に移し、移した（または既に移っていた）行の storage_tier をまとめて更新する
+
+    行の更新は (device_id, recorded_at) で絞り込んだ update で行う（処理中に削除された行を作り直さない）
+    """
+    counts = {"rows": len(rows), "transitioned": 0, "already": 0, "missing": 0, "dry_run": 0,
+              "errors": 0, "bytes": 0}
+    targets = [(row, storage_class) for row in rows
+               if (storage_class := target_storage_class(row, today)) is not None]
+    if dry_run:
+        counts["dry_run"] = len(targets)
+        counts["bytes"] = sum(row.get("file_size_bytes") or 0 for row, _ in targets)
+        return counts
+
+    futures = [(row, executor.submit(transition_object, s3, bucket, row["file_path"], storage_class))
+               for row, storage_class in targets]
+
+    tiered_at = datetime.now(pytz.UTC).isoformat()
+    updates = {}  # (device_id, storage_class) -> [recorded_at, ...]
+    for row, future in futures:
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"❌ Transition failed for {row['file_path']}: {e}", file=sys.stderr)
+            counts["errors"] += 1
+            continue
+        counts[result["status"]] += 1
+        if result["status"] == "missing":
+            continue
+        if result["status"] == "transitioned":
+            counts["bytes"] += result["bytes"]
+        updates.setdefault((row["device_id"], result["storage_class"]), []).append(row["recorded_at"])
+
+    for (device_id, storage_class), recorded_ats in updates.items():
+        for start in range(0, len(recorded_ats), UPDATE_CHUNK_SIZE):
+            supabase.table("audio_files").update(
+                {"storage_tier": storage_class, "tiered_at": tiered_at}, returning=ReturnMethod.minimal
+            ).eq("device_id", device_id).in_("recorded_at", recorded_ats[start:start + UPDATE_CHUNK_SIZE]).execute()
+    return counts
+
+
+# =========================================
+# 実行
+# =========================================
+def tier(s3, supabase, bucket: str, device_ids=None, workers: int = DEFAULT_WORKERS,
+         batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False, today=None, emit=None,
+         check_notifications: bool = True) -> dict:
+    """
+    対象デバイスの録音をストレージ階層化のルールに従って移す
+
+    Args:
+        device_ids: 対象デバイスID（Noneの場合はdevicesテーブルの全デバイス）
+        workers: S3への同時リクエスト数
+        today: 経過日数の基準日（Noneの場合はUTCの今日）
+        emit: バッチごとの結果を受け取るコールバック
+        check_notifications: 実行前にイベント通知の設定を確認する
+
+    Returns:
+        dict: 件数の集計
+
+    Raises:
+        RuntimeError: 階層化のコピーで発火するイベント通知が設定されている場合
+    """
+    if check_notifications and not dry_run:
+        problems = check_event_notifications(s3, bucket)
+        if problems:
+            raise RuntimeError(
+                "S3 event notifications would fire on the tiering copy (ObjectCreated:Copy); "
+                f"limit them to s3:ObjectCreated:Put: {'; '.join(problems)}"
+            )
+
+    today = today or datetime.now(pytz.UTC).date()
+    if device_ids is None:
+        devices = supabase.table("devices").select("device_id").execute().data
+        device_ids = sorted(row["device_id"] for row in devices)
+    date_to = tier_cutoff_date(today)
+
+    stats = {"devices": len(device_ids), "rows": 0, "transitioned": 0, "already": 0, "missing": 0,
+             "dry_run": 0, "errors": 0, "bytes": 0}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for device_id in device_ids:
+            try:
+                for rows in iter_pages(supabase, device_id, date_to, batch_size):
+                    counts = tier_batch(s3, supabase, bucket, rows, executor, today, dry_run)
+                    for name, value in counts.items():
+                        stats[name] += value
+                    if emit:
+                        emit({"device_id": device_id, "until": rows[-1]["recorded_at"], **counts})
+            except Exception as e:
+                print(f"❌ Tiering failed for device {device_id}: {e}", file=sys.stderr)
+                stats["errors"] += 1
+
+    return stats
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="処理が完了した録音を低コストのストレージクラスへ移す")
+    parser.add_argument("--device", action="append", dest="devices", help="対象デバイスID（複数指定可）")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"S3への同時リクエスト数（デフォルト: {DEFAULT_WORKERS}）")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"1バッチあたりの行数（デフォルト: {DEFAULT_BATCH_SIZE}）")
+    parser.add_argument("--dry-run", action="store_true", help="移さずに対象の件数とサイズのみ表示する")
+    parser.add_argument("--skip-notification-check", action="store_true",
+                        help="S3イベント通知の設定の確認を省略する（EventBridge のルールで Copy を除外済みの場合など）")
+    args = parser.parse_args(argv)
+
+    if not app.s3_client or not app.supabase_client:
+        print("❌ S3またはSupabaseの環境変数が設定されていません", file=sys.stderr)
+        return 1
+
+    def emit(result):
+        print(json.dumps(result, ensure_ascii=False))
+
+    started = time.perf_counter()
+    try:
+        stats = tier(
+            app.s3_client,
+            app.supabase_client,
+            app.S3_BUCKET_NAME,
+            device_ids=args.devices,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+            emit=emit,
+            check_notifications=not args.skip_notification_check
+        )
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        return 1
+    print(f"🧊 ストレージ階層化の結果 ({time.perf_counter() - started:.1f}s): {json.dumps(stats)}", file=sys.stderr)
+    return 0 if stats["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())